@@ -0,0 +1,168 @@
+"""Холодный архив операций: помесячные файлы SQLite.
+
+Завершенные, отклоненные и отмененные операции старше ARCHIVE_AFTER_DAYS
+переносятся из transactions и withdrawals в файлы <каталог>/YYYY-MM.db по
+месяцу created_at операции. Ожидающие операции остаются в основной базе
+всегда. В основной базе хранятся только каталог архивов (archives: число
+строк и итоги для пересчета статистики) и месяцы, в которых есть архивные
+операции каждого пользователя (archived_user_months), а сами файлы
+подключаются ATTACH на время одного запроса.
+
+Перенос идет пачками: сначала строки копируются в архив и архив
+коммитится, затем одной транзакцией удаляются из основной базы. Сбой между
+шагами оставляет копию в обеих базах, повторный запуск ее перезаписывает
+(INSERT OR REPLACE в архиве), поэтому строки не теряются. Из основной базы
+удаляются только строки, совпадающие со своей копией: если статус операции
+успел измениться между шагами, она остается в основной базе, а копия
+удаляется из архива.
+"""
+import asyncio
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Статусы, после которых операция больше не меняется
+FINAL_STATUSES = ('completed', 'rejected', 'cancelled')
+
+# Порядок колонок совпадает с таблицами основной базы: строки читаются по индексам
+TRANSACTION_COLUMNS = (
+    'id', 'user_id', 'type', 'amount', 'status', 'payment_method', 'details',
+    'admin_id', 'created_at', 'completed_at',
+)
+WITHDRAWAL_COLUMNS = (
+    'id', 'transaction_id', 'user_id', 'amount', 'fee', 'net_amount', 'payment_method',
+    'requisites', 'status', 'admin_comment', 'created_at', 'processed_at',
+)
+
+# Схема подключенного файла архива (alias archive)
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS archive.transactions (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        type TEXT,
+        amount REAL,
+        status TEXT,
+        payment_method TEXT,
+        details TEXT,
+        admin_id INTEGER,
+        created_at TIMESTAMP,
+        completed_at TIMESTAMP
+    )
+    ''',
+    # История пользователя: WHERE user_id = ? ORDER BY created_at, id
+    'CREATE INDEX IF NOT EXISTS archive.idx_transactions_user_created ON transactions (user_id, created_at)',
+    '''
+    CREATE TABLE IF NOT EXISTS archive.withdrawals (
+        id INTEGER PRIMARY KEY,
+        transaction_id INTEGER,
+        user_id INTEGER,
+        amount REAL,
+        fee REAL,
+        net_amount REAL,
+        payment_method TEXT,
+        requisites TEXT,
+        status TEXT,
+        admin_comment TEXT,
+        created_at TIMESTAMP,
+        processed_at TIMESTAMP
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS archive.idx_withdrawals_transaction ON withdrawals (transaction_id)',
+]
+
+
+def archive_dir(db_name):
+    """Каталог архивов: ARCHIVE_DIR или <имя базы>-archive рядом с ней"""
+    return config.ARCHIVE_DIR or os.path.splitext(os.path.abspath(db_name))[0] + '-archive'
+
+
+def month_of(created_at):
+    """'YYYY-MM-DD HH:MM:SS' -> 'YYYY-MM'"""
+    return created_at[:7]
+
+
+def month_start(month):
+    return f'{month}-01'
+
+
+def month_end(month):
+    """Начало следующего месяца: все строки месяца created_at меньше него"""
+    year, number = map(int, month.split('-'))
+    if number == 12:
+        year, number = year + 1, 1
+    else:
+        number += 1
+    return f'{year:04d}-{number:02d}-01'
+
+
+@contextmanager
+def attached(conn, path, create=False):
+    """Подключить файл архива к соединению как archive на время блока.
+
+    ATTACH нельзя выполнить внутри транзакции. Несуществующий файл без
+    create не подключается (ATTACH создал бы пустую базу) - FileNotFoundError.
+    """
+    if not create and not os.path.exists(path):
+        raise FileNotFoundError(path)
+    conn.execute('ATTACH DATABASE ? AS archive', (path,))
+    try:
+        if create:
+            for sql in SCHEMA:
+                conn.execute(sql)
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        conn.execute('DETACH DATABASE archive')
+
+
+class ArchiveJob:
+    """Фоновая задача: раз в interval секунд переносит старые операции в архив.
+
+    Каждая пачка - отдельный вызов в пуле потоков базы, поэтому перенос
+    большого хвоста не занимает поток надолго и чередуется с запросами бота.
+    """
+
+    def __init__(self, db, interval=None, after_days=None):
+        self.db = db
+        self.interval = config.ARCHIVE_INTERVAL if interval is None else interval
+        self.after_days = config.ARCHIVE_AFTER_DAYS if after_days is None else after_days
+        self._task = None
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Ошибка переноса операций в архив")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self):
+        """Перенести все операции старше after_days; возвращает их число"""
+        before = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(time.time() - self.after_days * 86400))
+        total = 0
+        while True:
+            moved = await self.db.archive_transactions(before)
+            if not moved:
+                break
+            total += moved
+        if total:
+            logger.info(f"В архив перенесено операций: {total} (старше {before})")
+        return total
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
@@ -0,0 +1,64 @@
+"""Статические ответы бота, собранные один раз.
+
+Клавиатуры хранятся сразу в виде JSON для reply_markup (aiogram передает
+строку в запрос без повторной сериализации), тексты - готовыми строками.
+Настройки config читаются из окружения один раз при запуске и во время
+работы не меняются, поэтому ресурс собирается один раз за процесс; deps
+только перечисляют настройки, от которых он зависит.
+"""
+import json
+
+# Все объявленные ресурсы, в порядке объявления
+_registry = []
+
+
+class Asset:
+    """Значение без аргументов, вычисляемое при первом обращении"""
+
+    __slots__ = ('name', 'build', 'deps', 'value')
+
+    def __init__(self, name, build, deps):
+        self.name = name
+        self.build = build
+        self.deps = frozenset(deps)
+        self.value = None
+
+    def get(self):
+        value = self.value
+        if value is None:
+            value = self.rebuild()
+        return value
+
+    def rebuild(self):
+        self.value = self.build()
+        return self.value
+
+    def __repr__(self):
+        return f"<Asset {self.name} deps={sorted(self.deps)}>"
+
+
+def static(*deps):
+    """Декоратор: результат функции кешируется, deps - имена настроек config"""
+    def wrap(build):
+        asset = Asset(build.__name__, build, deps)
+        _registry.append(asset)
+        return asset
+    return wrap
+
+
+def markup(*deps):
+    """Декоратор для сборщика клавиатуры: кешируется готовый JSON"""
+    def wrap(builder):
+        def build():
+            return json.dumps(builder().to_python(), ensure_ascii=False, separators=(',', ':'))
+        build.__name__ = builder.__name__
+        return static(*deps)(build)
+    return wrap
+
+
+def build_all():
+    """Собрать все ресурсы заранее (при запуске бота)"""
+    for asset in _registry:
+        asset.rebuild()
+    return len(_registry)
+
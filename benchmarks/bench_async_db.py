@@ -0,0 +1,76 @@
+"""Задержка обработчиков при синхронном и асинхронном доступе к БД.
+
+Имитирует нагрузку: часть «обработчиков» пишет в SQLite (как cmd_start или
+создание заявки), остальные выполняют легкую работу (как показ меню).
+Замеряется p50/p99 времени ответа легких обработчиков.
+
+Запуск: python -m benchmarks.bench_async_db [--writers 200] [--readers 2000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from database import Database, AsyncDatabase
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    index = min(len(samples) - 1, int(len(samples) * pct / 100))
+    return samples[index]
+
+
+async def run_load(db, is_async, writers, readers):
+    latencies = []
+
+    async def writer(user_id):
+        if is_async:
+            await db.create_user(user_id, f"user_{user_id}", "Bench", "")
+            await db.create_transaction(user_id, 'deposit', 1000, 'qiwi')
+        else:
+            db.create_user(user_id, f"user_{user_id}", "Bench", "")
+            db.create_transaction(user_id, 'deposit', 1000, 'qiwi')
+
+    async def reader():
+        started = time.perf_counter()
+        await asyncio.sleep(0)
+        latencies.append(time.perf_counter() - started)
+
+    jobs = [writer(user_id) for user_id in range(writers)] + [reader() for _ in range(readers)]
+    random.Random(42).shuffle(jobs)
+    await asyncio.gather(*jobs)
+    return latencies
+
+
+def bench(mode, writers, readers):
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Database(os.path.join(tmp, 'bench.db'))
+        db = AsyncDatabase(database) if mode == 'async' else database
+        try:
+            latencies = asyncio.run(run_load(db, mode == 'async', writers, readers))
+        finally:
+            if mode == 'async':
+                db.close()
+
+    print(
+        f"{mode:>5}: p50={statistics.median(latencies) * 1000:.2f}ms "
+        f"p99={percentile(latencies, 99) * 1000:.2f}ms "
+        f"max={max(latencies) * 1000:.2f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', type=int, default=200)
+    parser.add_argument('--readers', type=int, default=2000)
+    args = parser.parse_args()
+
+    for mode in ('sync', 'async'):
+        bench(mode, args.writers, args.readers)
+
+
+if __name__ == '__main__':
+    main()
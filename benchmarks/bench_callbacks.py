@@ -0,0 +1,135 @@
+"""Фаззинг и скорость разбора формата callback_data (callbacks.py).
+
+1. Круговая проверка: случайные действия и аргументы (включая граничные
+   значения varint) кодируются и разбираются обратно без потерь, длина
+   не превышает лимит Telegram.
+2. Мутации: испорченные, обрезанные, дополненные и случайные строки
+   разбираются либо в корректное значение, либо с CallbackDataError -
+   никаких других исключений. Строки старого формата не разбираются.
+3. Скорость: unpack/pack против split('_') для старых строк.
+
+Запуск: python -m benchmarks.bench_callbacks [--cases 200000] [--rounds 200000]
+"""
+import argparse
+import base64
+import random
+import string
+import time
+
+import callbacks
+from callbacks import Action, CallbackDataError, SPEC, UINT, pack, unpack
+
+EDGE_VALUES = (0, 1, 127, 128, 255, 16383, 16384, 2 ** 31 - 1, 2 ** 32, 2 ** 63, callbacks.MAX_UINT)
+ALPHABET = string.ascii_letters + string.digits + '-_'
+LEGACY = (
+    'deposit_qiwi', 'deposit_card', 'amount_1000', 'amount_custom', 'cancel',
+    'withdraw_crypto', 'trans_complete_15', 'confirm_withdraw_7', 'admin_ban_123',
+    'history_next_42', 'users_prev_9', 'search_page_2', 'search_user_5', 'broadcast_stop_3',
+)
+
+
+def random_args(rng, action):
+    args = []
+    for kind in SPEC[action]:
+        if kind is UINT:
+            args.append(rng.choice(EDGE_VALUES) if rng.random() < 0.3 else rng.randrange(2 ** rng.choice((7, 14, 32, 64))))
+        else:
+            args.append(rng.choice(kind))
+    return tuple(args)
+
+
+def fuzz_roundtrip(rng, cases):
+    actions = list(Action)
+    longest = 0
+    for _ in range(cases):
+        action = rng.choice(actions)
+        args = random_args(rng, action)
+        data = pack(action, *args)
+        longest = max(longest, len(data))
+        assert len(data.encode()) <= callbacks.MAX_LENGTH, data
+        assert unpack(data) == (action, args), (action, args, data)
+    return longest
+
+
+def mutate(rng, data):
+    choice = rng.randrange(6)
+    if choice == 0 and data:
+        pos = rng.randrange(len(data))
+        return data[:pos] + rng.choice(ALPHABET) + data[pos + 1:]
+    if choice == 1:
+        return data[:rng.randrange(len(data) + 1)]
+    if choice == 2:
+        return data + ''.join(rng.choice(ALPHABET) for _ in range(rng.randrange(1, 8)))
+    if choice == 3:
+        return ''.join(rng.choice(ALPHABET) for _ in range(rng.randrange(0, 70)))
+    if choice == 4:
+        # произвольные байты, включая не-ASCII и "=" внутри
+        return ''.join(chr(rng.randrange(0x20, 0x500)) for _ in range(rng.randrange(0, 20)))
+    raw = bytearray(rng.randrange(256) for _ in range(rng.randrange(0, 40)))
+    if raw and rng.random() < 0.5:
+        raw[0] = callbacks.VERSION
+    return base64.urlsafe_b64encode(bytes(raw)).rstrip(b'=').decode()
+
+
+def fuzz_mutations(rng, cases):
+    actions = list(Action)
+    decoded = rejected = 0
+    for _ in range(cases):
+        action = rng.choice(actions)
+        data = mutate(rng, pack(action, *random_args(rng, action)))
+        try:
+            result = unpack(data)
+        except CallbackDataError:
+            rejected += 1
+            continue
+        # Разобранное значение должно кодироваться и разбираться стабильно
+        decoded += 1
+        assert unpack(pack(result[0], *result[1])) == result, data
+
+    for data in LEGACY:
+        try:
+            unpack(data)
+        except CallbackDataError:
+            continue
+        raise AssertionError(f"строка старого формата разобрана: {data}")
+    return decoded, rejected
+
+
+def legacy_parse(data):
+    parts = data.split('_')
+    return parts[0], parts[1], int(parts[2])
+
+
+def measure(func, items, rounds):
+    count = len(items)
+    started = time.perf_counter()
+    for index in range(rounds):
+        func(items[index % count])
+    return (time.perf_counter() - started) / rounds * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cases', type=int, default=200000)
+    parser.add_argument('--rounds', type=int, default=200000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    longest = fuzz_roundtrip(rng, args.cases)
+    print(f"круговая проверка: {args.cases} случаев OK, самая длинная строка {longest} байт")
+
+    decoded, rejected = fuzz_mutations(rng, args.cases)
+    print(f"мутации: {args.cases} случаев, разобрано {decoded}, отклонено {rejected}, других ошибок нет")
+
+    samples = [pack(Action.TRANS_STATUS, rng.randrange(10 ** 6), 'completed') for _ in range(1000)]
+    legacy = [f"trans_complete_{rng.randrange(10 ** 6)}" for _ in range(1000)]
+    packed_args = [unpack(data)[1] for data in samples]
+
+    print(f"unpack:        {measure(unpack, samples, args.rounds):7.0f} нс")
+    print(f"pack:          {measure(lambda a: pack(Action.TRANS_STATUS, *a), packed_args, args.rounds):7.0f} нс")
+    print(f"split('_'):    {measure(legacy_parse, legacy, args.rounds):7.0f} нс (старый формат, без проверок)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+"""Замеры методов Database на сгенерированной базе (см. benchmarks.datagen).
+
+Для каждого случая - p50/p95/p99 и среднее время вызова и число строк в
+ответе. Случаи с тяжелыми пользователями берут самых активных из описания
+набора, get_all_users идет на глубоких OFFSET рядом с keyset-страницей
+на той же глубине. update_transaction_status меняет статус ожидающего
+вывода и вне замера возвращает его обратно, так что база не меняется.
+
+Результаты пишутся в benchmarks/results/ в JSON, имя файла - по размеру
+набора; если файл уже есть, перед перезаписью печатается изменение p50 по
+каждому случаю относительно него.
+
+База генерируется во временный каталог или берется из --db: файл, созданный
+генератором с теми же параметрами, используется повторно, иначе создается.
+
+Запуск: python -m benchmarks.bench_database [--users 100000] [--transactions 2000000]
+        [--db data.db] [--rounds 200] [--output results.json]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+from benchmarks import datagen
+from benchmarks.bench_e2e import git_commit, summarize
+from database import Database
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# Глубины для get_all_users: доли списка пользователей
+DEPTHS = (0.0, 0.1, 0.5, 0.99)
+
+SEARCH_QUERIES = {
+    'id': None,          # user_id случайного пользователя
+    'referral': None,    # его реферальный код
+    'username': None,    # его username
+    'substring': 'trader_1',
+    'name': 'Софья',
+    'miss': 'nobody_here',
+}
+
+
+def measure(call, arguments, warmup=3):
+    """Время каждого вызова call(*args); возвращает (сводку, строк в последнем ответе)"""
+    for args in arguments[:warmup]:
+        call(*args)
+    samples = []
+    result = None
+    for args in arguments:
+        started = time.perf_counter()
+        result = call(*args)
+        samples.append(time.perf_counter() - started)
+    return samples, result
+
+
+def rows_of(result):
+    if isinstance(result, tuple):
+        result = result[0]
+    if isinstance(result, (list, dict)):
+        return len(result)
+    return int(result is not None)
+
+
+def prepare(db, description, rng, rounds):
+    """Аргументы случаев: выборки пользователей, глубины и заявки"""
+    with db.connection() as conn:
+        user_ids = [row[0] for row in conn.execute('SELECT user_id FROM users')]
+        users = [
+            conn.execute('SELECT user_id, username, referral_id FROM users WHERE user_id = ?', (user_id,)).fetchone()
+            for user_id in rng.sample(user_ids, min(rounds, len(user_ids)))
+        ]
+        depth_cursors = {}
+        for depth in DEPTHS:
+            offset = int(len(user_ids) * depth)
+            row = conn.execute(
+                'SELECT user_id FROM users ORDER BY created_at DESC, user_id DESC LIMIT 1 OFFSET ?', (offset,)
+            ).fetchone()
+            depth_cursors[offset] = row[0]
+        pending = [row[0] for row in conn.execute(
+            "SELECT transaction_id FROM withdrawals WHERE status = 'pending' ORDER BY id LIMIT ?", (rounds,)
+        )]
+    heavy = [user_id for user_id, _ in description['heavy_users']]
+    return users, depth_cursors, pending, heavy
+
+
+def run_cases(db, description, rounds, seed):
+    rng = random.Random(seed)
+    users, depth_cursors, pending, heavy = prepare(db, description, rng, rounds)
+    sample_ids = [(user[0],) for user in users]
+    heavy_ids = [(heavy[index % len(heavy)],) for index in range(rounds)]
+    few = max(5, rounds // 20)  # для запросов, читающих много строк
+
+    cases = {}
+
+    def case(name, call, arguments):
+        samples, result = measure(call, arguments)
+        cases[name] = dict(summarize(samples), rows=rows_of(result))
+
+    # get_user: мимо кеша (чтение из базы) и из кеша
+    def uncached(user_id):
+        db.user_cache.invalidate(user_id)
+        return db.get_user(user_id)
+    case('get_user.uncached', uncached, sample_ids)
+    case('get_user.cached', db.get_user, sample_ids)
+
+    case('get_user_transactions.typical', lambda user_id: db.get_user_transactions(user_id, 10), sample_ids)
+    case('get_user_transactions.heavy', lambda user_id: db.get_user_transactions(user_id, 10), heavy_ids)
+    case('get_user_transactions_page.heavy', db.get_user_transactions_page, heavy_ids)
+
+    case('get_pending_withdrawals', db.get_pending_withdrawals, [()] * few)
+    case('get_pending_withdrawals_page', db.get_pending_withdrawals_page, [()] * rounds)
+
+    case('get_bot_stats', db.get_bot_stats, [()] * rounds)
+
+    for kind, query in SEARCH_QUERIES.items():
+        if kind == 'id':
+            arguments = [(str(user[0]),) for user in users]
+        elif kind == 'referral':
+            arguments = [(user[2],) for user in users]
+        elif kind == 'username':
+            arguments = [(user[1] or str(user[0]),) for user in users]
+        else:
+            arguments = [(query,)] * few
+        case(f'search_users.{kind}', db.search_users, arguments)
+
+    # OFFSET читает и отбрасывает все строки до нужной; keyset - нет
+    for offset, cursor in depth_cursors.items():
+        case(f'get_all_users.offset_{offset}', db.get_all_users, [(10, offset)] * few)
+        case(f'get_users_page.depth_{offset}', lambda after: db.get_users_page(10, after=after), [(cursor,)] * few)
+
+    # Смена статуса вывода; обратно - вне замера
+    samples = []
+    for trans_id in pending:
+        started = time.perf_counter()
+        db.update_transaction_status(trans_id, 'completed', 1)
+        samples.append(time.perf_counter() - started)
+        db.update_transaction_status(trans_id, 'pending')
+    cases['update_transaction_status'] = dict(summarize(samples), rows=1)
+
+    return cases
+
+
+def default_output(description):
+    return os.path.join(RESULTS_DIR, f"database-{description['users']}u-{description['transactions']}t.json")
+
+
+def print_report(result, previous):
+    old = (previous or {}).get('cases', {})
+    print(f"{'случай':<36}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'строк':>8}{'к прошлому':>12}")
+    for name, item in result['cases'].items():
+        change = ''
+        if name in old and old[name]['p50_ms']:
+            change = f"{(item['p50_ms'] / old[name]['p50_ms'] - 1) * 100:+.0f}%"
+        print(
+            f"{name:<36}{item['p50_ms']:10.3f}{item['p95_ms']:10.3f}{item['p99_ms']:10.3f}"
+            f"{item['rows']:8d}{change:>12}"
+        )
+    if previous:
+        print(f"\nсравнение с {previous['meta'].get('commit')} от {previous['meta'].get('date')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--transactions', type=int, default=2000000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--pending', type=float, default=0.03, help="доля заявок на вывод в ожидании")
+    parser.add_argument('--db', help="файл базы для повторного использования")
+    parser.add_argument('--rounds', type=int, default=200, help="вызовов на случай")
+    parser.add_argument('--output', help="файл результатов (по умолчанию в benchmarks/results/)")
+    args = parser.parse_args()
+
+    params = {'users': args.users, 'transactions': args.transactions, 'seed': args.seed, 'pending': args.pending}
+    progress = lambda text: print(f"\r{text:<40}", end='', file=sys.stderr)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.db or os.path.join(tmp, 'bench.db')
+        description = datagen.load_description(path)
+        if description is None or any(description[key] != value for key, value in params.items()):
+            if os.path.exists(path):
+                sys.exit(f"{path} создан не генератором или с другими параметрами")
+            description = datagen.generate(path, progress=progress, **params)
+            print(f"\nнабор сгенерирован за {description['seconds']:.0f}s", file=sys.stderr)
+
+        db = Database(path)
+        try:
+            cases = run_cases(db, description, args.rounds, args.seed)
+        finally:
+            db.close()
+        size = os.path.getsize(path)
+
+    result = {
+        'meta': {
+            'commit': git_commit(),
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'dataset': params,
+            'db_bytes': size,
+            'rounds': args.rounds,
+        },
+        'cases': cases,
+    }
+
+    output = args.output or default_output(description)
+    previous = None
+    if os.path.exists(output):
+        with open(output, encoding='utf-8') as f:
+            previous = json.load(f)
+    print_report(result, previous)
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"\nрезультаты: {output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Проверка ShardedDispatcher на синтетических обновлениях.
+
+Генерирует поток обновлений от множества пользователей, обрабатывает их
+обработчиком со случайной задержкой (имитация запросов к API и базе) и
+проверяет, что для каждого пользователя порядок обработки совпадает с
+порядком поступления. Печатает пропускную способность и метрики воркеров.
+
+Запуск: python -m benchmarks.bench_dispatch [--users 500] [--updates 20000] [--workers 32]
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+
+from dispatch import ShardedDispatcher
+
+
+def make_update(update_id, user_id):
+    user = SimpleNamespace(id=user_id)
+    return SimpleNamespace(update_id=update_id, message=SimpleNamespace(from_user=user, chat=user))
+
+
+async def run(args):
+    rng = random.Random(7)
+    processed = defaultdict(list)
+
+    async def handler(update):
+        await asyncio.sleep(rng.random() * args.max_delay)
+        processed[update.message.from_user.id].append(update.update_id)
+
+    shards = ShardedDispatcher(handler, workers=args.workers, queue_size=args.queue_size)
+    sent = defaultdict(list)
+
+    started = time.perf_counter()
+    for update_id in range(args.updates):
+        user_id = rng.randrange(args.users)
+        sent[user_id].append(update_id)
+        await shards.submit(make_update(update_id, user_id))
+    await shards.stop()
+    elapsed = time.perf_counter() - started
+
+    broken = [user_id for user_id in sent if processed[user_id] != sent[user_id]]
+    print(f"{args.updates} обновлений за {elapsed:.2f}s: {args.updates / elapsed:.0f} upd/s")
+    print(f"нарушений порядка: {len(broken)} из {len(sent)} пользователей")
+
+    for worker in shards.metrics():
+        print(
+            f"  worker {worker['worker']:>2}: processed={worker['processed']:>5} "
+            f"max_depth={worker['max_depth']:>3} errors={worker['errors']} "
+            f"avg_wait={worker['wait_time'] / max(worker['processed'], 1) * 1000:.1f}ms"
+        )
+    return 1 if broken else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--updates', type=int, default=20000)
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--queue-size', type=int, default=100)
+    parser.add_argument('--max-delay', type=float, default=0.002, help="макс. задержка обработчика, с")
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(run(args)))
+
+
+if __name__ == '__main__':
+    main()
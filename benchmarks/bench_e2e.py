@@ -0,0 +1,386 @@
+"""Сквозной бенчмарк: синтетические обновления через bot.dp с поддельным Bot API.
+
+Бот работает целиком - фильтры, Router, FSM в SQLite, база во временном
+файле, - а запросы к Telegram перехватываются и только записываются.
+Смесь сценариев задается весами:
+
+    start     /start с реферальным кодом нового пользователя
+    balance   «💰 Мой баланс»
+    history   «📊 История операций»
+    deposit   «📥 Пополнить» -> способ -> сумма кнопкой (process_deposit_amount)
+    withdraw  «📤 Вывести» -> способ -> сумма -> реквизиты
+    admin     «📊 Статистика бота» от администратора
+
+Сценарии идут в --concurrency параллельных сессиях, у каждой свои
+пользователи, поэтому шаги одного диалога выполняются по порядку. Каждое
+обновление обрабатывается в отдельной задаче через updates_handler, как в
+OrderedDispatcher. Отчет: обновлений в секунду, p50/p95/p99 по
+обработчикам и доля времени в базе; --json сохраняет его для сравнения
+между коммитами.
+
+Запуск: python -m benchmarks.bench_e2e [--sessions 2000] [--concurrency 32]
+        [--mix balance=40,start=15,history=15,deposit=15,withdraw=10,admin=5] [--json out.json]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+ADMIN_ID = 1
+DEFAULT_MIX = 'balance=40,start=15,history=15,deposit=15,withdraw=10,admin=5'
+
+# Пользователи сессии: заранее созданы с балансом, чтобы вывод проходил
+USERS_PER_SESSION_SLOT = 50
+START_BALANCE = 1_000_000
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'p50_ms': percentile(ordered, 0.50) * 1e3,
+        'p95_ms': percentile(ordered, 0.95) * 1e3,
+        'p99_ms': percentile(ordered, 0.99) * 1e3,
+        'total_ms': sum(ordered) * 1e3,
+    }
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"неизвестные сценарии: {', '.join(sorted(unknown))}")
+    return mix
+
+
+# ===== СИНТЕТИЧЕСКИЕ ОБНОВЛЕНИЯ =====
+class UpdateFactory:
+    def __init__(self):
+        self.update_id = 0
+        self.message_id = 0
+
+    def _user(self, user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': 'Bench', 'username': f'bench{user_id}'}
+
+    def _message(self, user_id, text):
+        self.message_id += 1
+        message = {
+            'message_id': self.message_id,
+            'date': 0,
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id),
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return message
+
+    def message(self, user_id, text):
+        self.update_id += 1
+        return {'update_id': self.update_id, 'message': self._message(user_id, text)}
+
+    def callback(self, user_id, data):
+        self.update_id += 1
+        return {
+            'update_id': self.update_id,
+            'callback_query': {
+                'id': str(self.update_id),
+                'from': self._user(user_id),
+                'chat_instance': '1',
+                'data': data,
+                'message': self._message(user_id, '…'),
+            },
+        }
+
+
+def scenario_start(factory, user_id, rng, context):
+    new_user = context['next_new_user']()
+    referrer = rng.choice(context['existing_users'])
+    return [factory.message(new_user, f'/start ref{referrer}')]
+
+
+def scenario_balance(factory, user_id, rng, context):
+    return [factory.message(user_id, '💰 Мой баланс')]
+
+
+def scenario_history(factory, user_id, rng, context):
+    return [factory.message(user_id, '📊 История операций')]
+
+
+def scenario_deposit(factory, user_id, rng, context):
+    from callbacks import Action, pack
+    return [
+        factory.message(user_id, '📥 Пополнить'),
+        factory.callback(user_id, pack(Action.DEPOSIT_METHOD, rng.choice(['qiwi', 'yoomoney', 'bank_card', 'crypto']))),
+        factory.callback(user_id, pack(Action.DEPOSIT_AMOUNT, rng.choice([50, 100, 500, 1000, 5000]))),
+    ]
+
+
+def scenario_withdraw(factory, user_id, rng, context):
+    from callbacks import Action, pack
+    return [
+        factory.message(user_id, '📤 Вывести'),
+        factory.callback(user_id, pack(Action.WITHDRAW_METHOD, rng.choice(['qiwi', 'bank_card', 'crypto']))),
+        factory.message(user_id, str(rng.randrange(1000, 5000))),
+        factory.message(user_id, '4276' + ''.join(rng.choice('0123456789') for _ in range(12))),
+    ]
+
+
+def scenario_admin(factory, user_id, rng, context):
+    return [factory.message(ADMIN_ID, '📊 Статистика бота')]
+
+
+SCENARIOS = {
+    'start': scenario_start,
+    'balance': scenario_balance,
+    'history': scenario_history,
+    'deposit': scenario_deposit,
+    'withdraw': scenario_withdraw,
+    'admin': scenario_admin,
+}
+
+
+# ===== ПРОГОН =====
+class ApiRecorder:
+    """Подмена Bot.request: запросы только считаются, ответы - правдоподобные заглушки"""
+
+    def __init__(self):
+        self.calls = Counter()
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        self.calls[method] += 1
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        if method in ('sendMessage', 'editMessageText'):
+            chat_id = int((data or {}).get('chat_id', 0))
+            return {'message_id': 1, 'date': 0, 'chat': {'id': chat_id, 'type': 'private'}, 'text': ''}
+        return True
+
+
+def build_sessions(args, rng, mix, slots):
+    """Сценарии по слотам параллельных сессий; обновления строятся заранее"""
+    from aiogram import types
+
+    factory = UpdateFactory()
+    names, weights = zip(*mix.items())
+    existing = [slot_user for slot in slots for slot_user in slot]
+    new_users = iter(range(10_000_000, 20_000_000))
+    context = {'existing_users': existing, 'next_new_user': lambda: next(new_users)}
+
+    plans = [[] for _ in slots]
+    for index in range(args.sessions):
+        slot = index % len(slots)
+        name = rng.choices(names, weights)[0]
+        user_id = rng.choice(slots[slot])
+        updates = [types.Update(**raw) for raw in SCENARIOS[name](factory, user_id, rng, context)]
+        plans[slot].append((name, updates))
+    return plans
+
+
+async def run(args):
+    from aiogram import Bot, Dispatcher
+
+    import assets
+    import bot
+    import metrics
+
+    Bot.set_current(bot.bot)
+    Dispatcher.set_current(bot.dp)
+    recorder = ApiRecorder()
+    bot.bot.request = recorder.request
+    assets.build_all()
+
+    # Сырые длительности обработчиков для перцентилей (гистограммы /metrics слишком грубые)
+    handler_samples = defaultdict(list)
+
+    class RecordingMiddleware(metrics.MetricsMiddleware):
+        async def on_pre_process_update(self, update, data):
+            pass
+
+        def _finish(self, data):
+            started = data.get('metrics_started')
+            if started is not None:
+                handler_samples[data['metrics_handler']].append(time.perf_counter() - started)
+
+    bot.dp.middleware.setup(RecordingMiddleware())
+
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    slots = [
+        list(range(100_000 + slot * USERS_PER_SESSION_SLOT, 100_000 + (slot + 1) * USERS_PER_SESSION_SLOT))
+        for slot in range(args.concurrency)
+    ]
+
+    # Подготовка базы не входит в замер
+    for slot in slots:
+        for user_id in slot:
+            bot.db.sync.create_user(user_id, f'bench{user_id}', 'Bench', '')
+            bot.db.sync.update_balance(user_id, START_BALANCE)
+    bot.db.sync.create_user(ADMIN_ID, 'bench_admin', 'Admin', '')
+
+    plans = build_sessions(args, rng, mix, slots)
+    updates_total = sum(len(updates) for plan in plans for _, updates in plan)
+
+    loop = asyncio.get_running_loop()
+    update_samples = []
+    scenario_samples = defaultdict(list)
+    errors = Counter()
+
+    async def process(update):
+        started = time.perf_counter()
+        # Отдельная задача на обновление, как в OrderedDispatcher
+        try:
+            await loop.create_task(bot.dp.updates_handler.notify(update))
+        except Exception as e:
+            errors[type(e).__name__] += 1
+        update_samples.append(time.perf_counter() - started)
+
+    async def session_worker(plan):
+        for name, updates in plan:
+            started = time.perf_counter()
+            for update in updates:
+                await process(update)
+            scenario_samples[name].append(time.perf_counter() - started)
+
+    # Прогрев: первые сессии каждого слота без записи результатов
+    warmup = [plan[:args.warmup] for plan in plans]
+    measured = [plan[args.warmup:] for plan in plans]
+    await asyncio.gather(*(session_worker(plan) for plan in warmup))
+    handler_samples.clear()
+    update_samples.clear()
+    scenario_samples.clear()
+    recorder.calls.clear()
+    db_before = metrics.DB_DURATION.totals()
+
+    started = time.perf_counter()
+    cpu_started = time.thread_time()
+    await asyncio.gather(*(session_worker(plan) for plan in measured))
+    elapsed = time.perf_counter() - started
+    # Процессорное время потока event loop: aiogram, обработчики, FSM (без потоков базы)
+    loop_cpu = time.thread_time() - cpu_started
+
+    db_after = metrics.DB_DURATION.totals()
+    db_methods = {}
+    for labels, (count, total) in db_after.items():
+        count_before, total_before = db_before.get(labels, (0, 0.0))
+        if count > count_before:
+            db_methods[labels[0]] = {'count': count - count_before, 'total_ms': (total - total_before) * 1e3}
+    db_ms = sum(item['total_ms'] for item in db_methods.values())
+    update_ms = sum(update_samples) * 1e3
+
+    await bot.dp.storage.close()
+    bot.db.close()
+
+    measured_updates = len(update_samples)
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'sqlite': __import__('sqlite3').sqlite_version,
+            'sessions': args.sessions,
+            'warmup_sessions_per_slot': args.warmup,
+            'concurrency': args.concurrency,
+            'mix': mix,
+            'seed': args.seed,
+            'updates_generated': updates_total,
+        },
+        'throughput': {
+            'updates': measured_updates,
+            'seconds': elapsed,
+            'updates_per_sec': measured_updates / elapsed if elapsed else 0.0,
+            'errors': dict(errors),
+        },
+        'update_latency': summarize(update_samples),
+        'scenarios': {name: summarize(samples) for name, samples in sorted(scenario_samples.items())},
+        'handlers': {name: summarize(samples) for name, samples in sorted(handler_samples.items())},
+        # Суммы по обновлениям: ожидание базы (с очередью к пулу) и остальное
+        'time_split': {
+            'update_ms': update_ms,
+            'db_ms': db_ms,
+            'other_ms': max(0.0, update_ms - db_ms),
+            'db_share': db_ms / update_ms if update_ms else 0.0,
+            'loop_cpu_ms': loop_cpu * 1e3,
+            'loop_busy': loop_cpu / elapsed if elapsed else 0.0,
+        },
+        'db_methods': dict(sorted(db_methods.items(), key=lambda item: -item[1]['total_ms'])),
+        'api_calls': dict(recorder.calls),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(result):
+    throughput = result['throughput']
+    split = result['time_split']
+    print(
+        f"{throughput['updates']} обновлений за {throughput['seconds']:.2f}s: "
+        f"{throughput['updates_per_sec']:.0f} upd/s, ошибок: {sum(throughput['errors'].values())}"
+    )
+    latency = result['update_latency']
+    print(f"обновление: p50={latency['p50_ms']:.2f}ms p95={latency['p95_ms']:.2f}ms p99={latency['p99_ms']:.2f}ms")
+    print(
+        f"время обновлений {split['update_ms']:.0f}ms: база {split['db_ms']:.0f}ms "
+        f"({split['db_share']:.0%}), остальное {split['other_ms']:.0f}ms"
+    )
+    print(f"Python в потоке event loop: {split['loop_cpu_ms']:.0f}ms CPU ({split['loop_busy']:.0%} времени прогона)")
+
+    print(f"\n{'обработчик':<36}{'n':>7}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+    for name, stats in sorted(result['handlers'].items(), key=lambda item: -item[1]['total_ms']):
+        print(f"{name:<36}{stats['count']:>7}{stats['p50_ms']:10.2f}{stats['p95_ms']:10.2f}{stats['p99_ms']:10.2f}")
+
+    print(f"\n{'метод базы':<36}{'n':>7}{'всего, мс':>12}")
+    for name, stats in list(result['db_methods'].items())[:10]:
+        print(f"{name:<36}{stats['count']:>7}{stats['total_ms']:12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=2000, help="сценариев всего")
+    parser.add_argument('--concurrency', type=int, default=32, help="параллельных сессий")
+    parser.add_argument('--warmup', type=int, default=5, help="сценариев прогрева на сессию")
+    parser.add_argument('--mix', default=DEFAULT_MIX)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--json', help="файл для результатов в JSON")
+    args = parser.parse_args()
+
+    # До импорта бота: его basicConfig тогда ничего не меняет
+    logging.basicConfig(level=logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp:
+        # Настройки читаются при импорте config, до импорта бота
+        os.environ['DB_NAME'] = os.path.join(tmp, 'bench.db')
+        os.environ['ADMIN_IDS'] = str(ADMIN_ID)
+        result = asyncio.run(run(args))
+
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\nрезультаты: {args.json}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Накладные расходы метрик на горячем пути и стоимость /metrics.
+
+Замеряется запись в гистограмму и счетчик (то, что делается на каждое
+обновление, вызов Database и запрос к Bot API) и полный проход обработки
+сообщения через Dispatcher с MetricsMiddleware и без нее.
+
+Запуск: python -m benchmarks.bench_metrics [--rounds 100000]
+"""
+import argparse
+import asyncio
+import time
+
+from aiogram import Bot, Dispatcher, types
+
+import metrics
+
+
+def measure(function, rounds):
+    started = time.perf_counter()
+    for index in range(rounds):
+        function(index)
+    return (time.perf_counter() - started) / rounds * 1e9
+
+
+async def measure_dispatch(with_middleware, rounds):
+    bot = Bot(token='123456:' + 'A' * 35)
+    dp = Dispatcher(bot)
+    if with_middleware:
+        dp.middleware.setup(metrics.MetricsMiddleware())
+
+    @dp.message_handler()
+    async def echo(message):
+        return None
+
+    Bot.set_current(bot)
+    Dispatcher.set_current(dp)
+    update = types.Update(**{
+        'update_id': 1,
+        'message': {
+            'message_id': 1, 'date': 0, 'text': 'hi',
+            'chat': {'id': 1, 'type': 'private'},
+            'from': {'id': 1, 'is_bot': False, 'first_name': 'u'},
+        },
+    })
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        await dp.updates_handler.notify(update)
+    return (time.perf_counter() - started) / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=100000)
+    args = parser.parse_args()
+
+    histogram = metrics.Histogram('bench_histogram_seconds', 'bench', ('handler',))
+    counter = metrics.Counter('bench_total', 'bench', ('method', 'error'))
+    handlers = [f'handler_{index}' for index in range(40)]
+
+    print(f"{'операция':<32}{'нс':>10}")
+    print(f"{'Histogram.observe':<32}{measure(lambda i: histogram.observe(0.003, handlers[i % 40]), args.rounds):10.0f}")
+    print(f"{'Counter.inc':<32}{measure(lambda i: counter.inc('sendMessage', 'BadRequest'), args.rounds):10.0f}")
+    print(f"{'time.perf_counter x2':<32}{measure(lambda i: (time.perf_counter(), time.perf_counter()), args.rounds):10.0f}")
+
+    rounds = args.rounds // 10
+    plain = asyncio.run(measure_dispatch(False, rounds))
+    instrumented = asyncio.run(measure_dispatch(True, rounds))
+    print(f"\n{'обработка сообщения':<32}{'мкс':>10}")
+    print(f"{'без метрик':<32}{plain:10.2f}")
+    print(f"{'с MetricsMiddleware':<32}{instrumented:10.2f}")
+
+    started = time.perf_counter()
+    text = metrics.render()
+    print(f"\n/metrics: {len(text)} байт за {(time.perf_counter() - started) * 1e3:.2f} мс")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Стоимость маршрутизации обновления: цепочка lambda-фильтров против Router.
+
+Для N кнопок меню и N префиксов callback регистрируются обработчики двумя
+способами: как в исходном bot.py (lambda-фильтр на каждый обработчик) и
+через таблицы Router. Обновления адресованы случайным обработчикам;
+измеряется время Dispatcher.process_update на одно обновление. Хранилище
+состояний - MemoryStorage, чтобы мерить только маршрутизацию.
+
+Запуск: python -m benchmarks.bench_router [--handlers 10 50 200 1000] [--updates 5000]
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+
+from router import Router
+
+USER = {'id': 1, 'is_bot': False, 'first_name': 'bench'}
+CHAT = {'id': 1, 'type': 'private'}
+
+
+def make_updates(count, handlers, rng):
+    updates = []
+    for update_id in range(count):
+        index = rng.randrange(handlers)
+        message = {'message_id': update_id, 'date': 0, 'chat': CHAT, 'from': USER, 'text': f"Кнопка {index}"}
+        if update_id % 2:
+            updates.append(types.Update(**{'update_id': update_id, 'message': message}))
+        else:
+            updates.append(types.Update(**{
+                'update_id': update_id,
+                'callback_query': {
+                    'id': str(update_id), 'from': USER, 'chat_instance': '1',
+                    'message': message, 'data': f"action{index}_{update_id}_x",
+                },
+            }))
+    return updates
+
+
+def build_lambda_chain(dp, handlers, hits):
+    for index in range(handlers):
+        text = f"Кнопка {index}"
+        prefix = f"action{index}_"
+
+        async def on_message(message):
+            hits.append(1)
+
+        async def on_callback(callback_query):
+            hits.append(1)
+
+        dp.register_message_handler(on_message, lambda message, text=text: message.text == text)
+        dp.register_callback_query_handler(on_callback, lambda c, prefix=prefix: c.data.startswith(prefix))
+
+
+def build_router(dp, handlers, hits):
+    router = Router(dp)
+    for index in range(handlers):
+        async def on_message(message):
+            hits.append(1)
+
+        async def on_callback(callback_query):
+            hits.append(1)
+
+        router.text(f"Кнопка {index}")(on_message)
+        router.callback(f"action{index}")(on_callback)
+
+
+async def measure(build, handlers, updates):
+    bot = Bot('123456:bench')
+    dp = Dispatcher(bot, storage=MemoryStorage())
+    Bot.set_current(bot)
+    Dispatcher.set_current(dp)
+
+    hits = []
+    build(dp, handlers, hits)
+
+    async def process(update):
+        # Как в воркере: у каждого обновления своя копия контекста
+        await asyncio.get_running_loop().create_task(dp.process_update(update))
+
+    started = time.perf_counter()
+    for update in updates:
+        await process(update)
+    elapsed = time.perf_counter() - started
+
+    assert len(hits) == len(updates), (len(hits), len(updates))
+    return elapsed / len(updates) * 1e6
+
+
+async def run(args):
+    print(f"{'обработчиков':>13}{'lambda, мкс':>14}{'Router, мкс':>14}{'ускорение':>11}")
+    for handlers in args.handlers:
+        updates = make_updates(args.updates, handlers, random.Random(handlers))
+        chain = await measure(build_lambda_chain, handlers, updates)
+        table = await measure(build_router, handlers, updates)
+        print(f"{handlers:>13}{chain:14.1f}{table:14.1f}{chain / table:10.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--handlers', type=int, nargs='+', default=[10, 50, 200, 1000])
+    parser.add_argument('--updates', type=int, default=5000)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
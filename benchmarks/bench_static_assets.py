@@ -0,0 +1,136 @@
+"""Стоимость подготовки ответа: сборка на каждое сообщение против готовых ресурсов.
+
+Для типовых ответов (/start, поддержка, курсы, пополнение) измеряется время
+от текста и клавиатуры до параметров запроса, как их готовит Bot.send_message:
+prepare_arg сериализует объект клавиатуры в JSON, а готовую строку
+передает как есть.
+
+Запуск: python -m benchmarks.bench_static_assets [--rounds 20000]
+"""
+import argparse
+import json
+import time
+
+from aiogram.utils.payload import prepare_arg
+
+import assets
+import config
+import texts
+from keyboards import (
+    get_main_menu, get_payment_methods, get_withdraw_methods,
+    MAIN_MENU, PAYMENT_METHODS, WITHDRAW_METHODS,
+)
+from utils import format_balance
+
+
+# ===== КАК БЫЛО: форматирование на каждое сообщение =====
+def render_start_before(user_id):
+    text = (
+        f"🎉 Добро пожаловать в *{config.BOT_NAME}*!\n\n"
+        f"{config.BOT_DESCRIPTION}\n\n"
+        f"💎 *Наши преимущества:*\n"
+        f"• Мгновенные переводы\n"
+        f"• Низкие комиссии\n"
+        f"• Круглосуточная поддержка\n"
+        f"• Множество способов оплаты\n\n"
+        f"📊 *Быстрый старт:*\n"
+        f"1. Пополните баланс\n"
+        f"2. Выводите средства\n"
+        f"3. Приглашайте друзей\n\n"
+        f"💰 *Ваш реферальный код:* `ref{user_id}`\n"
+        f"🔗 *Ссылка:* https://t.me/bench_bot?start=ref{user_id}"
+    )
+    return text, prepare_arg(get_main_menu())
+
+
+def render_support_before(user_id):
+    text = (
+        f"🆘 *Служба поддержки*\n\n"
+        f"📞 Техподдержка: {config.SUPPORT_USERNAME}\n"
+        f"📢 Новости: {config.CHANNEL_USERNAME}\n"
+        f"🌐 Сайт: {config.WEBSITE_URL}\n\n"
+        f"⏰ *Режим работы:*\n"
+        f"• Поддержка: 24/7\n"
+        f"• Выводы: 10:00-22:00 МСК\n\n"
+        f"📋 *Правила:*\n"
+        f"1. Минимальный вывод: {format_balance(config.MIN_WITHDRAW)}\n"
+        f"2. Комиссия на вывод: {config.WITHDRAW_FEE}%\n"
+        f"3. Верификация не требуется"
+    )
+    return text, None
+
+
+def render_deposit_before(user_id):
+    text = (
+        f"💳 *Выберите способ пополнения:*\n\n"
+        f"Минимальная сумма: {format_balance(config.MIN_DEPOSIT)}\n"
+        f"Максимальная сумма: {format_balance(config.MAX_DEPOSIT)}"
+    )
+    return text, prepare_arg(get_payment_methods())
+
+
+def render_withdraw_before(user_id):
+    return "💸 *Вывод средств*", prepare_arg(get_withdraw_methods())
+
+
+# ===== КАК СТАЛО: готовые ресурсы =====
+def render_start_after(user_id):
+    text = (
+        f"{texts.WELCOME.get()}"
+        f"💰 *Ваш реферальный код:* `ref{user_id}`\n"
+        f"🔗 *Ссылка:* https://t.me/bench_bot?start=ref{user_id}"
+    )
+    return text, prepare_arg(MAIN_MENU.get())
+
+
+def render_support_after(user_id):
+    return texts.SUPPORT.get(), None
+
+
+def render_deposit_after(user_id):
+    return texts.DEPOSIT_METHODS.get(), prepare_arg(PAYMENT_METHODS.get())
+
+
+def render_withdraw_after(user_id):
+    return "💸 *Вывод средств*", prepare_arg(WITHDRAW_METHODS.get())
+
+
+CASES = [
+    ('/start', render_start_before, render_start_after),
+    ('поддержка', render_support_before, render_support_after),
+    ('пополнение', render_deposit_before, render_deposit_after),
+    ('вывод', render_withdraw_before, render_withdraw_after),
+]
+
+
+def measure(render, rounds):
+    started = time.perf_counter()
+    for user_id in range(rounds):
+        render(user_id)
+    return (time.perf_counter() - started) / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=20000)
+    args = parser.parse_args()
+
+    assets.build_all()
+
+    # Результаты должны совпадать: готовый JSON равен сериализации объекта
+    for name, before, after in CASES:
+        text_before, markup_before = before(1)
+        text_after, markup_after = after(1)
+        assert text_before == text_after, name
+        if markup_before is not None:
+            assert json.loads(markup_before) == json.loads(markup_after), name
+
+    print(f"{'ответ':<12}{'было, мкс':>12}{'стало, мкс':>12}{'ускорение':>11}")
+    for name, before, after in CASES:
+        cost_before = measure(before, args.rounds)
+        cost_after = measure(after, args.rounds)
+        print(f"{name:<12}{cost_before:12.2f}{cost_after:12.2f}{cost_before / cost_after:10.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Нагрузочная проверка вывода средств при параллельных заявках.
+
+Много задач одновременно выводят деньги с одного баланса. Сравниваются
+старый путь (create_transaction + update_balance, два коммита) и
+create_withdrawal (одна транзакция с условным списанием): скорость и
+итоговый баланс. Баланс не должен уйти в минус, а сумма успешных
+выводов - превысить начальный баланс.
+
+Запуск: python -m benchmarks.bench_withdrawal_concurrency [--tasks 500] [--users 5]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from database import Database, AsyncDatabase
+
+INITIAL_BALANCE = 10000
+AMOUNT = 1000
+
+
+async def two_step_withdraw(db, user_id):
+    # Прежняя логика process_withdraw_amount_message + process_withdraw_requisites
+    user = await db.get_user(user_id)
+    if user[4] < AMOUNT:
+        return None
+    trans_id = await db.create_transaction(user_id, 'withdraw', AMOUNT, 'qiwi', 'req')
+    await db.update_balance(user_id, AMOUNT, 'withdraw')
+    return trans_id
+
+
+async def atomic_withdraw(db, user_id):
+    return await db.create_withdrawal(user_id, AMOUNT, 'qiwi', 'req')
+
+
+async def hammer(withdraw, tasks, users):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = AsyncDatabase(Database(os.path.join(tmp, 'bench.db')), max_workers=8)
+        for user_id in range(1, users + 1):
+            await db.create_user(user_id, f"user_{user_id}", "Bench", "")
+            await db.update_balance(user_id, INITIAL_BALANCE, 'deposit')
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(
+            withdraw(db, task % users + 1) for task in range(tasks)
+        ))
+        elapsed = time.perf_counter() - started
+
+        balances = [(await db.get_user(user_id))[4] for user_id in range(1, users + 1)]
+        db.close()
+
+    succeeded = sum(1 for trans_id in results if trans_id is not None)
+    return elapsed, succeeded, balances
+
+
+async def run(args):
+    failed = False
+    for name, withdraw in (('два коммита', two_step_withdraw), ('атомарно', atomic_withdraw)):
+        elapsed, succeeded, balances = await hammer(withdraw, args.tasks, args.users)
+        overdrawn = [balance for balance in balances if balance < 0]
+        print(
+            f"{name:>12}: {args.tasks / elapsed:7.0f} заявок/с, успешных {succeeded}, "
+            f"мин. баланс {min(balances):.0f}, ушли в минус: {len(overdrawn)}"
+        )
+        if withdraw is atomic_withdraw:
+            expected = args.users * (INITIAL_BALANCE // AMOUNT)
+            failed = bool(overdrawn) or succeeded != min(expected, args.tasks)
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tasks', type=int, default=500)
+    parser.add_argument('--users', type=int, default=5)
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(run(args)))
+
+
+if __name__ == '__main__':
+    main()
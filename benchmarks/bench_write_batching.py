@@ -0,0 +1,62 @@
+"""Пропускная способность записи с групповым коммитом и без него.
+
+Параллельные «обработчики» создают транзакции пополнения через
+AsyncDatabase. Сравниваются режимы DB_BATCH_WRITES выкл/вкл; --synchronous
+позволяет проверить влияние fsync (FULL) против значения по умолчанию.
+
+Запуск: python -m benchmarks.bench_write_batching [--tasks 200] [--writes 20] [--synchronous FULL]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import config
+from database import Database, AsyncDatabase
+
+
+async def load(db, tasks, writes):
+    async def handler(user_id):
+        for _ in range(writes):
+            await db.create_transaction(user_id, 'deposit', 1000, 'qiwi')
+
+    started = time.perf_counter()
+    await asyncio.gather(*(handler(user_id) for user_id in range(tasks)))
+    return time.perf_counter() - started
+
+
+def bench(batch_writes, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = AsyncDatabase(Database(os.path.join(tmp, 'bench.db')), batch_writes=batch_writes)
+        try:
+            elapsed = asyncio.run(load(db, args.tasks, args.writes))
+            batches = db.batcher.batches if db.batcher else args.tasks * args.writes
+        finally:
+            db.close()
+
+    total = args.tasks * args.writes
+    mode = 'вкл' if batch_writes else 'выкл'
+    print(f"пакетирование {mode:>4}: {total / elapsed:8.0f} записей/с, коммитов: {batches}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tasks', type=int, default=200)
+    parser.add_argument('--writes', type=int, default=20)
+    parser.add_argument('--synchronous', default=config.DB_PRAGMAS['synchronous'])
+    parser.add_argument('--window-ms', type=float, default=config.DB_BATCH_WINDOW_MS)
+    parser.add_argument('--max-size', type=int, default=config.DB_BATCH_MAX_SIZE)
+    args = parser.parse_args()
+
+    config.DB_PRAGMAS['synchronous'] = args.synchronous
+    config.DB_BATCH_WINDOW_MS = args.window_ms
+    config.DB_BATCH_MAX_SIZE = args.max_size
+    print(f"synchronous={args.synchronous}, окно {args.window_ms} мс, пакет до {args.max_size}")
+
+    for batch_writes in (False, True):
+        bench(batch_writes, args)
+
+
+if __name__ == '__main__':
+    main()
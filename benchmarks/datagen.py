@@ -0,0 +1,389 @@
+"""Детерминированный генератор базы для замеров database.py на больших объемах.
+
+Заполняет users, transactions, withdrawals и referral_payments так, как они
+выглядели бы в живом боте, и доводит базу до согласованного состояния:
+входящие остатки в ledger, счетчики bot_stats, поисковый индекс users_fts.
+Один и тот же --seed с теми же размерами дает ту же базу байт в байт по
+содержимому таблиц.
+
+Распределения:
+    пользователи  регистрируются равномерно за PERIOD_DAYS; треть пришла
+                  по реферальной ссылке, пригласившие - чаще старые аккаунты
+    операции      равномерно во времени; WHALE_SHARE операций приходится на
+                  лог-равномерно выбранных старых пользователей (первый -
+                  самый тяжелый), остальные - на случайных уже
+                  зарегистрированных
+    выводы        не больше баланса; доля --pending заявок так и остается
+                  в ожидании - длинная очередь на всю историю
+    пополнения    часть брошена неоплаченной (pending) или отменена
+
+На время загрузки индексы и триггеры таблиц снимаются и создаются заново в
+конце - так 20 млн строк вставляются за минуты, а не часы.
+
+Запуск: python -m benchmarks.datagen --out data.db [--users 100000] [--transactions 2000000]
+        [--seed 1] [--pending 0.03]
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sqlite3
+import sys
+import time
+
+import config
+from database import Database
+
+# Настройки набора хранятся в settings, чтобы бенчмарк мог переиспользовать базу
+SETTINGS_KEY = 'datagen'
+
+# Начало истории и ее длина; от часов не зависит, чтобы набор был воспроизводим
+EPOCH = 1704067200  # 2024-01-01 00:00:00 UTC
+PERIOD_DAYS = 730
+
+WHALE_SHARE = 0.3
+REFERRED_SHARE = 0.35
+REFERRAL_PERCENT = 5
+BANNED_SHARE = 0.005
+
+# Тип операции: вес
+TYPE_WEIGHTS = {'deposit': 55, 'withdraw': 30, 'bonus': 5, 'referral': 10}
+METHOD_WEIGHTS = {'bank_card': 45, 'yoomoney': 30, 'qiwi': 15, 'crypto': 10}
+
+FIRST_NAMES = (
+    'Александр', 'Дмитрий', 'Максим', 'Иван', 'Артем', 'Никита', 'Михаил', 'Егор',
+    'Анна', 'Мария', 'Елена', 'Ольга', 'Дарья', 'Софья', 'Алина', 'Виктория',
+    'Alex', 'John', 'Maria', 'Kate', 'Sergey', 'Oleg',
+)
+LAST_NAMES = ('Иванов', 'Смирнов', 'Кузнецов', 'Попова', 'Соколова', 'Лебедев', 'Новикова', 'Морозов')
+NICKS = ('alex', 'dima', 'max', 'ivan', 'kate', 'masha', 'crypto', 'trader', 'lucky', 'pro', 'sofia', 'dark')
+
+# Строк на один executemany и одну транзакцию
+CHUNK = 50000
+
+# Таблицы, чьи индексы и триггеры снимаются на время загрузки
+LOADED_TABLES = ('users', 'transactions', 'withdrawals', 'referral_payments', 'ledger')
+
+
+def timestamp(seconds):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(seconds))
+
+
+def weighted(rng, weights):
+    """Функция выбора по весам: один rng.random() на вызов"""
+    total = sum(weights.values())
+    bounds, items, acc = [], [], 0
+    for item, weight in weights.items():
+        acc += weight
+        bounds.append(acc / total)
+        items.append(item)
+
+    def choose():
+        point = rng.random()
+        for bound, item in zip(bounds, items):
+            if point < bound:
+                return item
+        return items[-1]
+    return choose
+
+
+def money(rng, median, low, high):
+    """Логнормальная сумма в целых рублях в пределах [low, high]"""
+    return float(min(high, max(low, round(rng.lognormvariate(math.log(median), 0.9)))))
+
+
+class Generator:
+    def __init__(self, users, transactions, seed=1, pending=0.03):
+        self.users = users
+        self.transactions = transactions
+        self.seed = seed
+        self.pending = pending
+        self.period = PERIOD_DAYS * 86400
+
+        rng = random.Random(seed)
+        # Регистрации идут подряд; user_id растут вместе со временем, как в Telegram
+        self.user_ids = [100000000 + index * 37 + rng.randrange(37) for index in range(users)]
+        self.created = [EPOCH + self.period * index // users + rng.randrange(60) for index in range(users)]
+        self.referrer = [None] * users
+        self.referrals = [0] * users
+        for index in range(1, users):
+            if rng.random() < REFERRED_SHARE:
+                # Старые аккаунты приглашают чаще
+                referrer = int(index * rng.random() ** 3)
+                self.referrer[index] = referrer
+                self.referrals[referrer] += 1
+        self.referred = [index for index in range(users) if self.referrer[index] is not None]
+
+        # Копейки: баланс и обороты считаются по ходу генерации операций
+        self.balance = [0] * users
+        self.deposited = [0] * users
+        self.withdrawn = [0] * users
+        self.operations = [0] * users
+        self.last_active = list(self.created)
+
+    # ===== ОПЕРАЦИИ =====
+    def _pick_user(self, rng, registered):
+        if rng.random() < WHALE_SHARE:
+            return min(registered, int(registered ** rng.random())) - 1
+        return rng.randrange(registered)
+
+    def transaction_rows(self):
+        """Пачки (transactions, withdrawals, referral_payments) в порядке id"""
+        rng = random.Random(self.seed + 1)
+        choose_type = weighted(rng, TYPE_WEIGHTS)
+        choose_method = weighted(rng, METHOD_WEIGHTS)
+        admin_id = config.ADMIN_IDS[0]
+        users, total = self.users, self.transactions
+
+        transactions, withdrawals, payments = [], [], []
+        withdrawal_id = payment_id = 0
+        for trans_id in range(1, total + 1):
+            moment = EPOCH + self.period * trans_id // total
+            # Пользователи с регистрацией до этого момента
+            registered = max(1, min(users, users * trans_id // total))
+            index = self._pick_user(rng, registered)
+            trans_type = choose_type()
+            amount = None
+
+            if trans_type == 'referral':
+                referred = self.referred[rng.randrange(len(self.referred))] if self.referred else None
+                if referred is None or referred >= registered:
+                    trans_type = 'deposit'
+                else:
+                    index = self.referrer[referred]
+                    amount = round(money(rng, 3000, config.MIN_DEPOSIT, config.MAX_DEPOSIT) * REFERRAL_PERCENT / 100, 2)
+            if trans_type == 'withdraw':
+                amount = money(rng, 2500, config.MIN_WITHDRAW, config.MAX_WITHDRAW)
+                if amount * 100 > self.balance[index]:
+                    trans_type = 'deposit'
+            if trans_type == 'deposit':
+                amount = money(rng, 3000, config.MIN_DEPOSIT, config.MAX_DEPOSIT)
+            elif trans_type == 'bonus':
+                amount = float(rng.choice((50, 100, 200, 500)))
+
+            user_id = self.user_ids[index]
+            created_at = timestamp(moment)
+            point = rng.random()
+            method = details = None
+            kopecks = int(round(amount * 100))
+
+            if trans_type == 'deposit':
+                method = choose_method()
+                status = 'completed' if point < 0.80 else 'pending' if point < 0.92 else 'cancelled'
+                if status == 'completed':
+                    self.balance[index] += kopecks
+                    self.deposited[index] += kopecks
+            elif trans_type == 'withdraw':
+                method = choose_method()
+                details = f"{method}:{rng.randrange(10 ** 15, 10 ** 16)}"
+                if point < self.pending:
+                    status = 'pending'
+                else:
+                    status = 'completed' if point < 0.95 else 'rejected'
+                if status != 'rejected':
+                    self.balance[index] -= kopecks
+                if status == 'completed':
+                    self.withdrawn[index] += kopecks
+                fee = round(amount * config.WITHDRAW_FEE / 100, 2)
+                withdrawal_id += 1
+                withdrawals.append((
+                    withdrawal_id, trans_id, user_id, amount, fee, round(amount - fee, 2), method, details,
+                    status, None, created_at, None if status == 'pending' else timestamp(moment + 3600)
+                ))
+            else:
+                status = 'completed'
+                self.balance[index] += kopecks
+                if trans_type == 'referral':
+                    payment_id += 1
+                    payments.append((payment_id, user_id, self.user_ids[referred], amount, trans_id, created_at))
+
+            processed = status != 'pending' and trans_type in ('deposit', 'withdraw')
+            transactions.append((
+                trans_id, user_id, trans_type, amount, status, method, details,
+                admin_id if processed else None, created_at,
+                timestamp(moment + 3600) if status != 'pending' else None
+            ))
+            self.operations[index] += 1
+            self.last_active[index] = moment
+
+            if len(transactions) >= CHUNK:
+                yield transactions, withdrawals, payments
+                transactions, withdrawals, payments = [], [], []
+        if transactions:
+            yield transactions, withdrawals, payments
+
+    # ===== ПОЛЬЗОВАТЕЛИ =====
+    def user_rows(self):
+        rng = random.Random(self.seed + 2)
+        rows = []
+        for index, user_id in enumerate(self.user_ids):
+            created = self.created[index]
+            username = f"{rng.choice(NICKS)}_{index}" if rng.random() < 0.7 else None
+            last_name = rng.choice(LAST_NAMES) if rng.random() < 0.4 else None
+            referrer = self.referrer[index]
+            rows.append((
+                user_id, username, rng.choice(FIRST_NAMES), last_name,
+                self.balance[index] / 100, self.deposited[index] / 100, self.withdrawn[index] / 100,
+                f"REF{user_id}{time.strftime('%m%d', time.gmtime(created))}",
+                self.user_ids[referrer] if referrer is not None else None,
+                self.referrals[index], int(rng.random() < BANNED_SHARE),
+                timestamp(created), timestamp(self.last_active[index])
+            ))
+            if len(rows) >= CHUNK:
+                yield rows
+                rows = []
+        if rows:
+            yield rows
+
+    def heavy_users(self, limit=10):
+        order = sorted(range(self.users), key=lambda index: -self.operations[index])[:limit]
+        return [(self.user_ids[index], self.operations[index]) for index in order]
+
+    def params(self):
+        return {'users': self.users, 'transactions': self.transactions, 'seed': self.seed, 'pending': self.pending}
+
+
+def generate(path, users, transactions, seed=1, pending=0.03, progress=None):
+    """Создать базу path (файл не должен существовать). Возвращает описание набора."""
+    if os.path.exists(path):
+        raise FileExistsError(path)
+    started = time.perf_counter()
+    say = progress or (lambda text: None)
+
+    # Схема и миграции - как у бота
+    Database(path, pool_size=1).close()
+
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA cache_size = -262144')
+
+    placeholders = ', '.join('?' * len(LOADED_TABLES))
+    objects = conn.execute(f'''
+        SELECT type, name, sql FROM sqlite_master
+        WHERE type IN ('index', 'trigger') AND sql IS NOT NULL AND tbl_name IN ({placeholders})
+        ORDER BY type, name
+    ''', LOADED_TABLES).fetchall()
+    for kind, name, _ in objects:
+        conn.execute(f'DROP {kind.upper()} {name}')
+
+    generator = Generator(users, transactions, seed, pending)
+    done = 0
+    for trans_rows, withdrawal_rows, payment_rows in generator.transaction_rows():
+        conn.execute('BEGIN')
+        conn.executemany('''
+            INSERT INTO transactions
+            (id, user_id, type, amount, status, payment_method, details, admin_id, created_at, completed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', trans_rows)
+        conn.executemany('''
+            INSERT INTO withdrawals
+            (id, transaction_id, user_id, amount, fee, net_amount, payment_method, requisites,
+             status, admin_comment, created_at, processed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', withdrawal_rows)
+        conn.executemany('''
+            INSERT INTO referral_payments (id, referrer_id, referral_id, amount, transaction_id, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', payment_rows)
+        conn.commit()
+        done += len(trans_rows)
+        say(f"операции: {done}/{transactions}")
+
+    for rows in generator.user_rows():
+        conn.execute('BEGIN')
+        conn.executemany('''
+            INSERT INTO users
+            (user_id, username, first_name, last_name, balance, total_deposited, total_withdrawn,
+             referral_id, referrer_id, referrals_count, is_banned, created_at, last_active)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        conn.commit()
+    say(f"пользователи: {users}")
+
+    # Входящие остатки журнала - как в миграции 6
+    conn.execute('BEGIN')
+    conn.execute('''
+        INSERT INTO ledger (user_id, delta, kind, created_at)
+        SELECT user_id, CAST(ROUND(balance * 100) AS INTEGER), 'opening', created_at
+        FROM users
+        WHERE CAST(ROUND(balance * 100) AS INTEGER) != 0
+        ORDER BY user_id
+    ''')
+    conn.execute('''
+        INSERT INTO balance_snapshots (user_id, ledger_id, balance)
+        SELECT user_id, id, delta FROM ledger WHERE kind = 'opening'
+    ''')
+    conn.commit()
+
+    say("индексы и триггеры")
+    conn.execute('BEGIN')
+    for _, _, sql in objects:
+        conn.execute(sql)
+    conn.commit()
+
+    description = dict(generator.params(), heavy_users=generator.heavy_users())
+    conn.execute(
+        'INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)',
+        (SETTINGS_KEY, json.dumps(description))
+    )
+    conn.execute('ANALYZE')
+    conn.close()
+
+    # Счетчики и поисковый индекс - штатными методами
+    db = Database(path, pool_size=1)
+    try:
+        db.rebuild_stats()
+        db.rebuild_search_index()
+    finally:
+        db.close()
+
+    description['seconds'] = time.perf_counter() - started
+    return description
+
+
+def load_description(path):
+    """Описание набора из базы, созданной generate(); None - база не от генератора"""
+    if not os.path.exists(path):
+        return None
+    conn = sqlite3.connect(path)
+    try:
+        row = conn.execute('SELECT value FROM settings WHERE key = ?', (SETTINGS_KEY,)).fetchone()
+    except sqlite3.Error:
+        row = None
+    finally:
+        conn.close()
+    return json.loads(row[0]) if row else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--out', required=True, help="файл новой базы")
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--transactions', type=int, default=2000000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--pending', type=float, default=0.03, help="доля заявок на вывод в ожидании")
+    parser.add_argument('--verify', action='store_true', help="сверить журнал и счетчики после загрузки")
+    args = parser.parse_args()
+
+    description = generate(
+        args.out, args.users, args.transactions, args.seed, args.pending,
+        progress=lambda text: print(f"\r{text:<40}", end='', file=sys.stderr)
+    )
+    print(file=sys.stderr)
+    print(json.dumps(description, ensure_ascii=False, indent=2))
+
+    if args.verify:
+        db = Database(args.out, pool_size=1)
+        try:
+            balances, snapshots = db.verify_ledger()
+            drift = db.rebuild_stats(fix=False)
+        finally:
+            db.close()
+        print(f"журнал: балансов {len(balances)}, снимков {len(snapshots)} с расхождением; счетчики: {drift or 'ок'}")
+        if balances or snapshots or drift:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
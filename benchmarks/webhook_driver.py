@@ -0,0 +1,170 @@
+"""Сравнение задержки доставки обновлений: webhook против long polling.
+
+Поднимает локальный поддельный Telegram Bot API, подключает к нему bot.dp и
+прогоняет одинаковый поток обновлений «💰 Мой баланс» в обоих режимах.
+Задержка - от появления обновления у «Telegram» до получения ответного
+sendMessage.
+
+Запуск: python -m benchmarks.webhook_driver [--updates 200] [--concurrency 1]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+from aiohttp import ClientSession, web
+
+API_PORT = 18081
+WEBHOOK_PORT = 18082
+
+
+class FakeTelegramAPI:
+    """Минимальный Bot API: отдает обновления через getUpdates и фиксирует ответы"""
+
+    def __init__(self):
+        self.queue = []
+        self.has_updates = asyncio.Event()
+        self.replied = {}
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        data = await request.post()
+
+        if method == 'getUpdates':
+            try:
+                await asyncio.wait_for(self.has_updates.wait(), float(data.get('timeout', 0)) or 0.01)
+            except asyncio.TimeoutError:
+                pass
+            updates, self.queue = self.queue, []
+            self.has_updates.clear()
+            return web.json_response({'ok': True, 'result': updates})
+
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        elif method == 'sendMessage':
+            chat_id = int(data['chat_id'])
+            waiter = self.replied.pop(chat_id, None)
+            if waiter is not None:
+                waiter.set_result(time.perf_counter())
+            result = {
+                'message_id': 1, 'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'}, 'text': data.get('text', '')
+            }
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    def push(self, update):
+        self.queue.append(update)
+        self.has_updates.set()
+
+
+def make_update(update_id):
+    user = {'id': 10_000 + update_id, 'is_bot': False, 'first_name': 'Bench'}
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user['id'], 'type': 'private'},
+            'from': user,
+            'text': '💰 Мой баланс',
+        },
+    }
+
+
+async def drive(api, deliver, updates, concurrency):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+
+    async def one(update_id):
+        async with semaphore:
+            update = make_update(update_id)
+            replied = loop.create_future()
+            api.replied[update['message']['chat']['id']] = replied
+            started = time.perf_counter()
+            await deliver(update)
+            latencies.append(await replied - started)
+
+    await asyncio.gather(*(one(update_id) for update_id in range(1, updates + 1)))
+    return latencies
+
+
+def report(mode, latencies):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(
+        f"{mode:>8}: p50={statistics.median(latencies) * 1000:.1f}ms "
+        f"p99={p99 * 1000:.1f}ms n={len(latencies)}"
+    )
+
+
+async def main_async(args):
+    from aiogram import Bot, Dispatcher
+    from aiogram.bot.api import TelegramAPIServer
+
+    import bot
+    import config
+    import server
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    Bot.set_current(bot.bot)
+    Dispatcher.set_current(bot.dp)
+    bot.bot.server = TelegramAPIServer.from_base(f'http://127.0.0.1:{API_PORT}')
+
+    api = FakeTelegramAPI()
+    api_app = web.Application()
+    api_app.router.add_post('/bot{token}/{method}', api.handle)
+    api_runner = web.AppRunner(api_app)
+    await api_runner.setup()
+    await web.TCPSite(api_runner, '127.0.0.1', API_PORT).start()
+
+    # Long polling, как в резервном режиме server.run_bot
+    polling = asyncio.create_task(bot.dp.start_polling(timeout=1))
+
+    async def deliver_polling(update):
+        api.push(update)
+
+    report('polling', await drive(api, deliver_polling, args.updates, args.concurrency))
+    bot.dp.stop_polling()
+    api.has_updates.set()
+    await polling
+
+    # Webhook на HTTP сервере из server.py
+    app = server.create_app(bot.dp, config.WEBHOOK_SECRET)
+    runner = await server.start_http_server(app, port=WEBHOOK_PORT)
+    url = f'http://127.0.0.1:{WEBHOOK_PORT}{config.WEBHOOK_PATH}'
+    headers = {'X-Telegram-Bot-Api-Secret-Token': config.WEBHOOK_SECRET}
+
+    async with ClientSession() as session:
+        async def deliver_webhook(update):
+            async with session.post(url, json=update, headers=headers) as response:
+                response.raise_for_status()
+
+        report('webhook', await drive(api, deliver_webhook, args.updates, args.concurrency))
+
+    await runner.cleanup()
+    await bot.dp.shards.stop()
+    await api_runner.cleanup()
+    await (await bot.bot.get_session()).close()
+    bot.db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--updates', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DB_NAME'] = os.path.join(tmp, 'bench.db')
+        asyncio.run(main_async(args))
+
+
+if __name__ == '__main__':
+    main()
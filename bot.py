@@ -1,13 +1,23 @@
 import asyncio
 import logging
-from aiogram import Bot, Dispatcher, types
+from aiogram import types
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.types import ParseMode
+from aiogram.utils.exceptions import MessageNotModified
 
+import assets
 import config
-from database import Database
+import metrics
+import sqltrace
+import texts
+from broadcast import Broadcaster
+from archive import ArchiveJob
+from callbacks import Action
+from database import Database, AsyncDatabase
+from dispatch import OrderedDispatcher
+from fsm_storage import SQLiteStorage
+from router import Router
 from keyboards import *
 from utils import *
 
@@ -19,10 +29,22 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Инициализация
-bot = Bot(token=config.BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(bot, storage=storage)
-db = Database()
+bot = metrics.InstrumentedBot(token=config.BOT_TOKEN)
+db = AsyncDatabase(Database())
+storage = SQLiteStorage(db)
+dp = OrderedDispatcher(bot, storage=storage)
+# Кнопки меню и callback-запросы: один обработчик с таблицами маршрутов
+router = Router(dp)
+broadcaster = Broadcaster(bot, db)
+# Перенос старых операций в помесячные архивы
+archive_job = ArchiveJob(db)
+
+# Метрики /metrics: время обработчиков и значения, считаемые при запросе
+dp.middleware.setup(metrics.MetricsMiddleware())
+metrics.FSM_STATES.set_function(
+    lambda: {(state or 'none',): count for state, count in storage.state_counts().items()}
+)
+metrics.DISPATCH_QUEUE.set_function(lambda: sum(worker['depth'] for worker in dp.shards.metrics()))
 
 # Состояния FSM
 class DepositStates(StatesGroup):
@@ -37,6 +59,11 @@ class AdminStates(StatesGroup):
     waiting_broadcast = State()
     waiting_user_action = State()
 
+async def referral_link(user_id):
+    """Реферальная ссылка; данные бота (get_me) aiogram кеширует после первого запроса"""
+    me = await bot.me
+    return f"https://t.me/{me.username}?start=ref{user_id}"
+
 # ===== ОСНОВНЫЕ КОМАНДЫ =====
 @dp.message_handler(commands=['start'])
 async def cmd_start(message: types.Message):
@@ -55,26 +82,16 @@ async def cmd_start(message: types.Message):
             except:
                 pass
     
-    db.create_user(user_id, username, first_name, last_name, referrer_id)
+    await db.create_user(user_id, username, first_name, last_name, referrer_id)
     
-    # Приветственное сообщение
+    # Приветственное сообщение: готовый текст + личные код и ссылка
     welcome_text = (
-        f"🎉 Добро пожаловать в *{config.BOT_NAME}*!\n\n"
-        f"{config.BOT_DESCRIPTION}\n\n"
-        f"💎 *Наши преимущества:*\n"
-        f"• Мгновенные переводы\n"
-        f"• Низкие комиссии\n"
-        f"• Круглосуточная поддержка\n"
-        f"• Множество способов оплаты\n\n"
-        f"📊 *Быстрый старт:*\n"
-        f"1. Пополните баланс\n"
-        f"2. Выводите средства\n"
-        f"3. Приглашайте друзей\n\n"
+        f"{texts.WELCOME.get()}"
         f"💰 *Ваш реферальный код:* `ref{user_id}`\n"
-        f"🔗 *Ссылка:* https://t.me/{message.bot.username}?start=ref{user_id}"
+        f"🔗 *Ссылка:* {await referral_link(user_id)}"
     )
     
-    await message.answer(welcome_text, parse_mode=ParseMode.MARKDOWN, reply_markup=get_main_menu())
+    await message.answer(welcome_text, parse_mode=ParseMode.MARKDOWN, reply_markup=MAIN_MENU.get())
 
 @dp.message_handler(commands=['admin'])
 async def cmd_admin(message: types.Message):
@@ -82,7 +99,7 @@ async def cmd_admin(message: types.Message):
         await message.answer("⛔ У вас нет доступа к админ-панели")
         return
     
-    stats = db.get_bot_stats()
+    stats = await db.get_bot_stats()
     
     stats_text = (
         f"⚙️ *Панель администратора*\n\n"
@@ -96,12 +113,30 @@ async def cmd_admin(message: types.Message):
         f"⚡ *Быстрые действия:*"
     )
     
-    await message.answer(stats_text, parse_mode=ParseMode.MARKDOWN, reply_markup=get_admin_menu())
+    await message.answer(stats_text, parse_mode=ParseMode.MARKDOWN, reply_markup=ADMIN_MENU.get())
+
+@dp.message_handler(commands=['sqltop'])
+async def cmd_sqltop(message: types.Message):
+    """/sqltop [N] [total|mean|p99|count|rows] - самые тяжелые SQL выражения"""
+    if message.from_user.id not in config.ADMIN_IDS:
+        return
+    
+    if db.tracer is None:
+        await message.answer("Трассировка SQL выключена (DB_TRACE=1)")
+        return
+    
+    args = message.get_args().split()
+    limit = int(args[0]) if args and args[0].isdigit() else 10
+    order = args[1] if len(args) > 1 and args[1] in sqltrace.ORDERS else 'total'
+    
+    report = db.tracer.format_top(min(limit, 30), order, width=300)
+    # Без разметки: в SQL есть символы Markdown
+    await message.answer(report[:4000] or "Запросов пока не было")
 
 # ===== ОСНОВНОЕ МЕНЮ =====
-@dp.message_handler(lambda message: message.text == "💰 Мой баланс")
+@router.text("💰 Мой баланс")
 async def show_balance(message: types.Message):
-    user = db.get_user(message.from_user.id)
+    user = await db.get_user(message.from_user.id)
     
     if not user:
         await message.answer("Пользователь не найден. Нажмите /start")
@@ -118,19 +153,17 @@ async def show_balance(message: types.Message):
     
     await message.answer(balance_text, parse_mode=ParseMode.MARKDOWN)
 
-@dp.message_handler(lambda message: message.text == "📥 Пополнить")
+@router.text("📥 Пополнить")
 async def start_deposit(message: types.Message):
     await message.answer(
-        f"💳 *Выберите способ пополнения:*\n\n"
-        f"Минимальная сумма: {format_balance(config.MIN_DEPOSIT)}\n"
-        f"Максимальная сумма: {format_balance(config.MAX_DEPOSIT)}",
+        texts.DEPOSIT_METHODS.get(),
         parse_mode=ParseMode.MARKDOWN,
-        reply_markup=get_payment_methods()
+        reply_markup=PAYMENT_METHODS.get()
     )
 
-@dp.message_handler(lambda message: message.text == "📤 Вывести")
+@router.text("📤 Вывести")
 async def start_withdraw(message: types.Message):
-    user = db.get_user(message.from_user.id)
+    user = await db.get_user(message.from_user.id)
     
     if not user:
         await message.answer("Пользователь не найден")
@@ -152,27 +185,60 @@ async def start_withdraw(message: types.Message):
         f"🔢 Минимум: {format_balance(config.MIN_WITHDRAW)}\n\n"
         f"*Выберите способ вывода:*",
         parse_mode=ParseMode.MARKDOWN,
-        reply_markup=get_withdraw_methods()
+        reply_markup=WITHDRAW_METHODS.get()
     )
 
-@dp.message_handler(lambda message: message.text == "📊 История операций")
+@router.text("📊 История операций")
 async def show_history(message: types.Message):
-    transactions = db.get_user_transactions(message.from_user.id, limit=5)
+    transactions, newer, older = await db.get_user_transactions_page(
+        message.from_user.id, limit=config.HISTORY_PAGE_SIZE
+    )
     
     if not transactions:
         await message.answer("📭 У вас еще нет операций")
         return
     
-    history_text = "📊 *Последние операции:*\n\n"
+    await message.answer(
+        format_history_page(transactions),
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=get_page_keyboard(Action.HISTORY_PAGE, newer, older)
+    )
+
+@router.callback(Action.HISTORY_PAGE, state='*')
+async def process_history_page(callback_query: types.CallbackQuery, args):
+    direction, cursor = args
+    
+    transactions, newer, older = await db.get_user_transactions_page(
+        callback_query.from_user.id,
+        limit=config.HISTORY_PAGE_SIZE,
+        after=cursor if direction == 'next' else None,
+        before=cursor if direction == 'prev' else None
+    )
+    
+    if not transactions:
+        await bot.answer_callback_query(callback_query.id, "Больше операций нет")
+        return
+    
+    await bot.edit_message_text(
+        chat_id=callback_query.from_user.id,
+        message_id=callback_query.message.message_id,
+        text=format_history_page(transactions),
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=get_page_keyboard(Action.HISTORY_PAGE, newer, older)
+    )
+    await bot.answer_callback_query(callback_query.id)
+
+def format_history_page(transactions):
+    history_text = "📊 *Операции:*\n\n"
     
     for trans in transactions:
         history_text += f"{format_transaction(trans)}\n\n"
     
-    await message.answer(history_text, parse_mode=ParseMode.MARKDOWN)
+    return history_text
 
-@dp.message_handler(lambda message: message.text == "👤 Мой профиль")
+@router.text("👤 Мой профиль")
 async def show_profile(message: types.Message):
-    user = db.get_user(message.from_user.id)
+    user = await db.get_user(message.from_user.id)
     
     if not user:
         await message.answer("Пользователь не найден")
@@ -189,52 +255,22 @@ async def show_profile(message: types.Message):
         f"📤 Выводов: {format_balance(user[6])}\n"
         f"👥 Рефералов: {user[9]}\n\n"
         f"🔗 *Реферальная ссылка:*\n"
-        f"`https://t.me/{message.bot.username}?start=ref{user[0]}`"
+        f"`{await referral_link(user[0])}`"
     )
     
     await message.answer(profile_text, parse_mode=ParseMode.MARKDOWN)
 
-@dp.message_handler(lambda message: message.text == "🆘 Поддержка")
+@router.text("🆘 Поддержка")
 async def show_support(message: types.Message):
-    support_text = (
-        f"🆘 *Служба поддержки*\n\n"
-        f"📞 Техподдержка: {config.SUPPORT_USERNAME}\n"
-        f"📢 Новости: {config.CHANNEL_USERNAME}\n"
-        f"🌐 Сайт: {config.WEBSITE_URL}\n\n"
-        f"⏰ *Режим работы:*\n"
-        f"• Поддержка: 24/7\n"
-        f"• Выводы: 10:00-22:00 МСК\n\n"
-        f"📋 *Правила:*\n"
-        f"1. Минимальный вывод: {format_balance(config.MIN_WITHDRAW)}\n"
-        f"2. Комиссия на вывод: {config.WITHDRAW_FEE}%\n"
-        f"3. Верификация не требуется"
-    )
-    
-    await message.answer(support_text, parse_mode=ParseMode.MARKDOWN)
-
-@dp.message_handler(lambda message: message.text == "📈 Курсы")
+    await message.answer(texts.SUPPORT.get(), parse_mode=ParseMode.MARKDOWN)
+
+@router.text("📈 Курсы")
 async def show_rates(message: types.Message):
-    rates_text = (
-        f"📈 *Курсы обмена*\n\n"
-        f"💵 *Пополнение:*\n"
-        f"• Т-Банк: 1₽ = 1₽\n"
-        f"• СБП: 1₽ = 1₽\n"
-        f"• Банк. карта: 1₽ = 1₽\n"
-        f"• USDT: 1$ = ~95₽\n\n"
-        f"💸 *Вывод:*\n"
-        f"• Комиссия: {config.WITHDRAW_FEE}%\n"
-        f"• Минимум: {format_balance(config.MIN_WITHDRAW)}\n"
-        f"• Максимум: {format_balance(config.MAX_WITHDRAW)}\n\n"
-        f"⚡ *Сроки:*\n"
-        f"• Пополнение: мгновенно\n"
-        f"• Вывод: 5-60 минут"
-    )
-    
-    await message.answer(rates_text, parse_mode=ParseMode.MARKDOWN)
-
-@dp.message_handler(lambda message: message.text == "🎁 Реферальная программа")
+    await message.answer(texts.RATES.get(), parse_mode=ParseMode.MARKDOWN)
+
+@router.text("🎁 Реферальная программа")
 async def show_referral(message: types.Message):
-    user = db.get_user(message.from_user.id)
+    user = await db.get_user(message.from_user.id)
     
     referral_text = (
         f"🎁 *Реферальная программа*\n\n"
@@ -243,24 +279,20 @@ async def show_referral(message: types.Message):
         f"👥 Рефералов: {user[9]}\n"
         f"🆔 Ваш код: `ref{user[0]}`\n\n"
         f"🔗 *Ваша ссылка:*\n"
-        f"`https://t.me/{message.bot.username}?start=ref{user[0]}`\n\n"
-        f"📋 *Как работает:*\n"
-        f"1. Друг переходит по вашей ссылке\n"
-        f"2. Пополняет баланс\n"
-        f"3. Вы получаете 5% от его пополнения\n\n"
-        f"💡 *Совет:* Размещайте ссылку в соцсетях!"
+        f"`{await referral_link(user[0])}`\n\n"
+        f"{texts.REFERRAL_HOWTO.get()}"
     )
     
     await message.answer(referral_text, parse_mode=ParseMode.MARKDOWN)
 
-@dp.message_handler(lambda message: message.text == "🔙 В главное меню")
+@router.text("🔙 В главное меню")
 async def back_to_main(message: types.Message):
-    await message.answer("Возвращаемся в главное меню:", reply_markup=get_main_menu())
+    await message.answer("Возвращаемся в главное меню:", reply_markup=MAIN_MENU.get())
 
 # ===== CALLBACK ОБРАБОТЧИКИ =====
-@dp.callback_query_handler(lambda c: c.data.startswith('deposit_'))
-async def process_deposit_method(callback_query: types.CallbackQuery, state: FSMContext):
-    payment_method = callback_query.data.split('_')[1]
+@router.callback(Action.DEPOSIT_METHOD)
+async def process_deposit_method(callback_query: types.CallbackQuery, state: FSMContext, args):
+    payment_method, = args
     
     await state.update_data(payment_method=payment_method)
     
@@ -275,41 +307,39 @@ async def process_deposit_method(callback_query: types.CallbackQuery, state: FSM
             f"Пример: `1000` или `500.50`"
         ),
         parse_mode=ParseMode.MARKDOWN,
-        reply_markup=get_deposit_amounts()
+        reply_markup=DEPOSIT_AMOUNTS.get()
     )
     
     await DepositStates.waiting_amount.set()
 
-@dp.callback_query_handler(lambda c: c.data.startswith('amount_'))
-async def process_deposit_amount(callback_query: types.CallbackQuery, state: FSMContext):
-    amount_type = callback_query.data.split('_')[1]
-    
-    if amount_type == 'custom':
-        await bot.answer_callback_query(callback_query.id, "Введите сумму вручную")
-        return
-    
-    if amount_type == 'cancel':
-        await bot.delete_message(
-            chat_id=callback_query.from_user.id,
-            message_id=callback_query.message.message_id
-        )
-        await state.finish()
-        await callback_query.message.answer("Операция отменена", reply_markup=get_main_menu())
+@router.callback(Action.CANCEL, state='*')
+async def process_cancel(callback_query: types.CallbackQuery, state: FSMContext):
+    await bot.delete_message(
+        chat_id=callback_query.from_user.id,
+        message_id=callback_query.message.message_id
+    )
+    await state.finish()
+    await callback_query.message.answer("Операция отменена", reply_markup=MAIN_MENU.get())
+
+@router.callback(Action.DEPOSIT_CUSTOM, state=DepositStates.waiting_amount)
+async def process_deposit_custom(callback_query: types.CallbackQuery):
+    await bot.answer_callback_query(callback_query.id, "Введите сумму вручную")
+
+# Суммы кнопок быстрого выбора; другие значения в callback_data не принимаются
+DEPOSIT_PRESETS = (50, 100, 500, 1000, 5000)
+
+@router.callback(Action.DEPOSIT_AMOUNT, state=DepositStates.waiting_amount)
+async def process_deposit_amount(callback_query: types.CallbackQuery, state: FSMContext, args):
+    amount, = args
+    if amount not in DEPOSIT_PRESETS:
+        await bot.answer_callback_query(callback_query.id, "Некорректная сумма")
         return
     
-    # Стандартные суммы
-    amounts = {
-        '50': 50, '100': 100, '500': 500,
-        '1000': 1000, '5000': 5000
-    }
-    
-    amount = amounts.get(amount_type, 0)
-    
     user_data = await state.get_data()
     payment_method = user_data.get('payment_method')
     
     # Создаем транзакцию
-    trans_id = db.create_transaction(
+    trans_id = await db.create_transaction(
         callback_query.from_user.id,
         'deposit',
         amount,
@@ -374,9 +404,9 @@ async def process_deposit_amount(callback_query: types.CallbackQuery, state: FSM
     
     await state.finish()
 
-@dp.callback_query_handler(lambda c: c.data.startswith('withdraw_'))
-async def process_withdraw_method(callback_query: types.CallbackQuery, state: FSMContext):
-    payment_method = callback_query.data.split('_')[1]
+@router.callback(Action.WITHDRAW_METHOD)
+async def process_withdraw_method(callback_query: types.CallbackQuery, state: FSMContext, args):
+    payment_method, = args
     
     await state.update_data(payment_method=payment_method)
     
@@ -414,7 +444,7 @@ async def process_deposit_amount_message(message: types.Message, state: FSMConte
     payment_method = user_data.get('payment_method')
     
     # Создаем транзакцию
-    trans_id = db.create_transaction(
+    trans_id = await db.create_transaction(
         message.from_user.id,
         'deposit',
         amount,
@@ -463,7 +493,7 @@ async def process_deposit_amount_message(message: types.Message, state: FSMConte
 
 @dp.message_handler(state=WithdrawStates.waiting_amount)
 async def process_withdraw_amount_message(message: types.Message, state: FSMContext):
-    user = db.get_user(message.from_user.id)
+    user = await db.get_user(message.from_user.id)
     
     is_valid, result = validate_amount(
         message.text,
@@ -490,10 +520,10 @@ async def process_withdraw_amount_message(message: types.Message, state: FSMCont
     user_data = await state.get_data()
     payment_method = user_data.get('payment_method')
     
-    # Запрашиваем реквизиты
+    # Запрашиваем реквизиты (ключи - способы из callbacks.PAYMENT_METHODS)
     requisites_text = {
-        'Т-Банк': "📱 Введите номер QIWI (формат: 79123456789):",
-        'card': "💳 Введите номер карты (16-19 цифр):",
+        'qiwi': "📱 Введите номер QIWI (формат: 79123456789):",
+        'bank_card': "💳 Введите номер карты (16-19 цифр):",
         'crypto': "₿ Введите адрес крипто-кошелька (USDT TRC20):"
     }.get(payment_method, "📋 Введите реквизиты для вывода:")
     
@@ -518,17 +548,19 @@ async def process_withdraw_requisites(message: types.Message, state: FSMContext)
     net_amount = user_data.get('net_amount')
     payment_method = user_data.get('payment_method')
     
-    # Создаем транзакцию
-    trans_id = db.create_transaction(
+    # Создаем заявку и списываем средства одной транзакцией
+    trans_id = await db.create_withdrawal(
         message.from_user.id,
-        'withdraw',
         amount,
         payment_method,
         requisites
     )
     
-    # Списываем средства
-    db.update_balance(message.from_user.id, amount, 'withdraw')
+    if trans_id is None:
+        user = await db.get_user(message.from_user.id)
+        await message.answer(f"❌ Недостаточно средств. Доступно: {format_balance(user[4])}")
+        await state.finish()
+        return
     
     # Уведомляем пользователя
     await message.answer(
@@ -543,7 +575,7 @@ async def process_withdraw_requisites(message: types.Message, state: FSMContext)
     )
     
     # Уведомляем администраторов
-    user = db.get_user(message.from_user.id)
+    user = await db.get_user(message.from_user.id)
     
     for admin_id in config.ADMIN_IDS:
         try:
@@ -557,7 +589,7 @@ async def process_withdraw_requisites(message: types.Message, state: FSMContext)
                 f"📋 Способ: {config.PAYMENT_SYSTEMS.get(payment_method, payment_method)}\n"
                 f"📝 Реквизиты: `{requisites}`",
                 parse_mode=ParseMode.MARKDOWN,
-                reply_markup=get_confirmation_keyboard('withdraw', trans_id)
+                reply_markup=get_confirmation_keyboard(trans_id)
             )
         except:
             pass
@@ -565,15 +597,16 @@ async def process_withdraw_requisites(message: types.Message, state: FSMContext)
     await state.finish()
 
 # ===== АДМИН ФУНКЦИИ =====
-@dp.message_handler(lambda message: message.text == "📊 Статистика бота")
+@router.text("📊 Статистика бота")
 async def admin_bot_stats(message: types.Message):
     if message.from_user.id not in config.ADMIN_IDS:
         return
     
-    stats = db.get_bot_stats()
+    stats = await db.get_bot_stats()
+    cache_stats = db.user_cache.stats()
     
     # Получаем последние 5 пользователей
-    recent_users = db.get_all_users(limit=5)
+    recent_users = await db.get_all_users(limit=5)
     
     stats_text = (
         f"📊 *Статистика бота*\n\n"
@@ -585,6 +618,10 @@ async def admin_bot_stats(message: types.Message):
         f"• Всего пополнений: {format_balance(stats['total_deposits'])}\n"
         f"• Всего выводов: {format_balance(stats['total_withdrawals'])}\n"
         f"• Ожидают обработки: {stats['pending_transactions']}\n\n"
+        f"🗄 *Кеш пользователей:*\n"
+        f"• Записей: {cache_stats['size']}/{cache_stats['maxsize']}\n"
+        f"• Попаданий/промахов: {cache_stats['hits']}/{cache_stats['misses']}\n"
+        f"• Вытеснено: {cache_stats['evictions']}\n\n"
         f"👤 *Последние пользователи:*\n"
     )
     
@@ -594,11 +631,19 @@ async def admin_bot_stats(message: types.Message):
     
     await message.answer(stats_text, parse_mode=ParseMode.MARKDOWN)
 
-@dp.message_handler(lambda message: message.text == "👥 Управление пользователями")
+@router.text("👥 Управление пользователями")
 async def admin_users_management(message: types.Message):
     if message.from_user.id not in config.ADMIN_IDS:
         return
     
+    users, newer, older = await db.get_users_page(limit=config.USERS_PAGE_SIZE)
+    if users:
+        await message.answer(
+            format_users_page(users),
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=get_page_keyboard(Action.USERS_PAGE, newer, older)
+        )
+    
     await message.answer(
         "👥 *Управление пользователями*\n\n"
         "Для поиска пользователя отправьте:\n"
@@ -611,93 +656,233 @@ async def admin_users_management(message: types.Message):
     
     await AdminStates.waiting_user_action.set()
 
+@router.callback(Action.USERS_PAGE, state='*')
+async def admin_users_page(callback_query: types.CallbackQuery, args):
+    if callback_query.from_user.id not in config.ADMIN_IDS:
+        await bot.answer_callback_query(callback_query.id, "Нет доступа")
+        return
+    
+    direction, cursor = args
+    
+    users, newer, older = await db.get_users_page(
+        limit=config.USERS_PAGE_SIZE,
+        after=cursor if direction == 'next' else None,
+        before=cursor if direction == 'prev' else None
+    )
+    
+    if not users:
+        await bot.answer_callback_query(callback_query.id, "Больше пользователей нет")
+        return
+    
+    await bot.edit_message_text(
+        chat_id=callback_query.from_user.id,
+        message_id=callback_query.message.message_id,
+        text=format_users_page(users),
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=get_page_keyboard(Action.USERS_PAGE, newer, older)
+    )
+    await bot.answer_callback_query(callback_query.id)
+
+def format_users_page(users):
+    users_text = "👥 *Пользователи:*\n\n"
+    
+    for user_id, username, balance, created_at in users:
+        users_text += f"• `{user_id}` @{username or 'нет'}: {format_balance(balance)} ({format_date(created_at)})\n"
+    
+    return users_text
+
 @dp.message_handler(state=AdminStates.waiting_user_action)
 async def admin_search_user(message: types.Message, state: FSMContext):
+    await state.finish()
+    
     if message.from_user.id not in config.ADMIN_IDS:
-        await state.finish()
         return
     
     query = message.text.strip()
-    users = db.search_users(query)
+    users = await db.search_users(query, limit=config.SEARCH_PAGE_SIZE + 1)
     
     if not users:
         await message.answer("❌ Пользователь не найден")
-        await state.finish()
         return
     
-    # Показываем первого найденного пользователя
-    user = users[0]
+    if len(users) == 1:
+        user = users[0]
+        await message.answer(format_user_info(user), parse_mode=ParseMode.MARKDOWN, reply_markup=get_user_management_keyboard(user[0]))
+        return
     
-    user_info = (
-        f"👤 *Информация о пользователе*\n\n"
-        f"🆔 ID: `{user[0]}`\n"
-        f"👁‍🗨 Username: @{user[1] or 'нет'}\n"
-        f"👤 Имя: {user[2] or 'нет'} {user[3] or ''}\n"
-        f"💰 Баланс: {format_balance(user[4])}\n"
-        f"📥 Пополнено: {format_balance(user[5])}\n"
-        f"📤 Выведено: {format_balance(user[6])}\n"
-        f"👥 Рефералов: {user[9]}\n"
-        f"🚫 Заблокирован: {'Да' if user[10] else 'Нет'}\n"
-        f"👑 Админ: {'Да' if user[11] else 'Нет'}\n"
-        f"📅 Регистрация: {format_date(user[12])}\n"
-        f"🔥 Последняя активность: {format_date(user[13])}\n\n"
-        f"🔗 Реферальный код: `{user[7]}`"
+    # Запрос нужен для листания результатов
+    await state.update_data(search_query=query)
+    await message.answer(
+        f"🔎 Результаты поиска «{query}»:",
+        reply_markup=get_search_results_keyboard(
+            users[:config.SEARCH_PAGE_SIZE], 0, len(users) > config.SEARCH_PAGE_SIZE
+        )
+    )
+
+@router.callback(Action.SEARCH_PAGE, state='*')
+async def admin_search_page(callback_query: types.CallbackQuery, state: FSMContext, args):
+    if callback_query.from_user.id not in config.ADMIN_IDS:
+        await bot.answer_callback_query(callback_query.id, "Нет доступа")
+        return
+    
+    page, = args
+    query = (await state.get_data()).get('search_query')
+    if query is None:
+        await bot.answer_callback_query(callback_query.id, "Поиск устарел, повторите запрос")
+        return
+    
+    users = await db.search_users(
+        query, limit=config.SEARCH_PAGE_SIZE + 1, offset=page * config.SEARCH_PAGE_SIZE
     )
     
-    await message.answer(user_info, parse_mode=ParseMode.MARKDOWN, reply_markup=get_user_management_keyboard(user[0]))
-    await state.finish()
+    await bot.edit_message_reply_markup(
+        chat_id=callback_query.from_user.id,
+        message_id=callback_query.message.message_id,
+        reply_markup=get_search_results_keyboard(
+            users[:config.SEARCH_PAGE_SIZE], page, len(users) > config.SEARCH_PAGE_SIZE
+        )
+    )
+    await bot.answer_callback_query(callback_query.id)
 
-@dp.message_handler(lambda message: message.text == "💼 Управление заявками")
-async def admin_pending_withdrawals(message: types.Message):
+@router.callback(Action.SEARCH_USER, state='*')
+async def admin_search_show_user(callback_query: types.CallbackQuery, args):
+    if callback_query.from_user.id not in config.ADMIN_IDS:
+        await bot.answer_callback_query(callback_query.id, "Нет доступа")
+        return
+    
+    user = await db.get_user(args[0])
+    if not user:
+        await bot.answer_callback_query(callback_query.id, "Пользователь не найден")
+        return
+    
+    await bot.send_message(
+        callback_query.from_user.id,
+        format_user_info(user),
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=get_user_management_keyboard(user[0])
+    )
+    await bot.answer_callback_query(callback_query.id)
+
+@router.text("💼 Управление заявками")
+async def admin_pending_withdrawals(message: types.Message, state: FSMContext):
     if message.from_user.id not in config.ADMIN_IDS:
         return
     
-    withdrawals = db.get_pending_withdrawals()
+    # Новая консоль: первая страница, отметок нет
+    await state.update_data(withdraw_selected=[], withdraw_anchor=None)
+    text, keyboard = await render_withdrawals_console(state)
+    await message.answer(text, parse_mode=ParseMode.MARKDOWN, reply_markup=keyboard)
+
+async def render_withdrawals_console(state):
+    """Текст и клавиатура консоли заявок для текущей страницы и отметок из FSM"""
+    data = await state.get_data()
+    selected = data.get('withdraw_selected', [])
+    direction, cursor = data.get('withdraw_anchor') or (None, None)
+    
+    withdrawals, prev_cursor, next_cursor = await db.get_pending_withdrawals_page(
+        limit=config.WITHDRAWALS_PAGE_SIZE,
+        after=cursor if direction == 'next' else None,
+        before=cursor if direction == 'prev' else None
+    )
+    if not withdrawals and cursor is not None:
+        # Заявки страницы уже обработаны - возвращаемся к началу
+        await state.update_data(withdraw_anchor=None)
+        withdrawals, prev_cursor, next_cursor = await db.get_pending_withdrawals_page(
+            limit=config.WITHDRAWALS_PAGE_SIZE
+        )
     
     if not withdrawals:
-        await message.answer("✅ Нет ожидающих заявок на вывод")
-        return
-    
-    for withdraw in withdrawals:
-        w_id, trans_id, user_id, amount, fee, net_amount, method, requisites, status, comment, created_at, processed_at = withdraw
-        
-        withdraw_text = (
-            f"🔄 *Заявка на вывод #{w_id}*\n\n"
-            f"👤 Пользователь: ID `{user_id}`\n"
-            f"💵 Сумма: {format_balance(amount)}\n"
-            f"📉 Комиссия: {format_balance(fee)}\n"
-            f"💰 К выплате: {format_balance(net_amount)}\n"
-            f"📋 Способ: {config.PAYMENT_SYSTEMS.get(method, method)}\n"
-            f"📝 Реквизиты: `{requisites}`\n"
-            f"📅 Дата: {format_date(created_at)}"
+        return "✅ Нет ожидающих заявок на вывод", None
+    
+    withdrawals_text = "💼 *Заявки на вывод*\n\n"
+    for w_id, trans_id, user_id, amount, net_amount, method, requisites, created_at in withdrawals:
+        withdrawals_text += (
+            f"*#{trans_id}* · ID `{user_id}` · {format_date(created_at)}\n"
+            f"💵 {format_balance(amount)} → 💰 {format_balance(net_amount)}\n"
+            f"📋 {config.PAYMENT_SYSTEMS.get(method, method)}: `{requisites}`\n\n"
         )
-        
-        await message.answer(withdraw_text, parse_mode=ParseMode.MARKDOWN, reply_markup=get_transaction_actions(trans_id))
+    withdrawals_text += f"Отмечено: {len(selected)}"
+    
+    return withdrawals_text, get_withdrawals_console_keyboard(withdrawals, selected, prev_cursor, next_cursor)
+
+async def refresh_withdrawals_console(callback_query, state):
+    text, keyboard = await render_withdrawals_console(state)
+    try:
+        await bot.edit_message_text(
+            chat_id=callback_query.from_user.id,
+            message_id=callback_query.message.message_id,
+            text=text,
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=keyboard
+        )
+    except MessageNotModified:
+        pass
+
+@router.callback(Action.WITHDRAWALS_PAGE, state='*')
+async def admin_withdrawals_page(callback_query: types.CallbackQuery, state: FSMContext, args):
+    if callback_query.from_user.id not in config.ADMIN_IDS:
+        await bot.answer_callback_query(callback_query.id, "Нет доступа")
+        return
+    
+    await state.update_data(withdraw_anchor=list(args))
+    await refresh_withdrawals_console(callback_query, state)
+    await bot.answer_callback_query(callback_query.id)
+
+@router.callback(Action.WITHDRAWAL_TOGGLE, state='*')
+async def admin_withdrawal_toggle(callback_query: types.CallbackQuery, state: FSMContext, args):
+    if callback_query.from_user.id not in config.ADMIN_IDS:
+        await bot.answer_callback_query(callback_query.id, "Нет доступа")
+        return
+    
+    trans_id, = args
+    selected = (await state.get_data()).get('withdraw_selected', [])
+    if trans_id in selected:
+        selected.remove(trans_id)
+    else:
+        selected.append(trans_id)
+    
+    await state.update_data(withdraw_selected=selected)
+    await refresh_withdrawals_console(callback_query, state)
+    await bot.answer_callback_query(callback_query.id)
 
-@dp.callback_query_handler(lambda c: c.data.startswith('trans_'))
-async def process_transaction_action(callback_query: types.CallbackQuery):
+@router.callback(Action.WITHDRAWALS_BULK, state='*')
+async def admin_withdrawals_bulk(callback_query: types.CallbackQuery, state: FSMContext, args):
     if callback_query.from_user.id not in config.ADMIN_IDS:
         await bot.answer_callback_query(callback_query.id, "Нет доступа")
         return
     
-    action_parts = callback_query.data.split('_')
-    action = action_parts[1]
-    trans_id = int(action_parts[2])
+    new_status, = args
+    selected = (await state.get_data()).get('withdraw_selected', [])
+    if not selected:
+        await bot.answer_callback_query(callback_query.id, "Ничего не отмечено")
+        return
+    
+    # Все отмеченные заявки - одной транзакцией; уже обработанные пропускаются
+    changed = await db.bulk_update_transaction_status(selected, new_status, callback_query.from_user.id)
+    
+    await state.update_data(withdraw_selected=[])
+    await refresh_withdrawals_console(callback_query, state)
     
-    status_map = {
-        'complete': 'completed',
-        'cancel': 'cancelled',
-        'pending': 'pending'
-    }
+    status_text = '✅ Одобрено' if new_status == 'completed' else '❌ Отклонено'
+    await bot.answer_callback_query(callback_query.id, f"{status_text}: {changed} из {len(selected)}")
+
+@router.callback(Action.TRANS_STATUS)
+async def process_transaction_action(callback_query: types.CallbackQuery, args):
+    if callback_query.from_user.id not in config.ADMIN_IDS:
+        await bot.answer_callback_query(callback_query.id, "Нет доступа")
+        return
     
-    new_status = status_map.get(action, 'pending')
+    trans_id, new_status = args
     
-    db.update_transaction_status(trans_id, new_status, callback_query.from_user.id)
+    if not await db.update_transaction_status(trans_id, new_status, callback_query.from_user.id):
+        await bot.answer_callback_query(callback_query.id, "Заявка уже в архиве", show_alert=True)
+        return
     
     status_text = {
         'completed': '✅ Выполнено',
         'cancelled': '❌ Отменено',
-        'pending': '🕐 Отложено'
+        'pending': '🕐 Отложено',
+        'rejected': '❌ Отклонено'
     }.get(new_status, new_status)
     
     await bot.edit_message_text(
@@ -709,23 +894,87 @@ async def process_transaction_action(callback_query: types.CallbackQuery):
     
     await bot.answer_callback_query(callback_query.id, f"Статус изменен на: {status_text}")
 
+# ===== РАССЫЛКА =====
+@router.text("📢 Рассылка")
+async def admin_broadcast(message: types.Message):
+    if message.from_user.id not in config.ADMIN_IDS:
+        return
+    
+    await message.answer(
+        "📢 *Рассылка*\n\n"
+        "Отправьте сообщение, которое получат все пользователи.\n"
+        "Поддерживаются текст, фото и документы.\n\n"
+        "Для отмены отправьте /cancel",
+        parse_mode=ParseMode.MARKDOWN
+    )
+    
+    await AdminStates.waiting_broadcast.set()
+
+@dp.message_handler(state=AdminStates.waiting_broadcast, content_types=types.ContentTypes.ANY)
+async def admin_broadcast_message(message: types.Message, state: FSMContext):
+    await state.finish()
+    
+    if message.from_user.id not in config.ADMIN_IDS:
+        return
+    
+    if message.text == '/cancel':
+        await message.answer("Рассылка отменена", reply_markup=ADMIN_MENU.get())
+        return
+    
+    await broadcaster.start(
+        message.from_user.id,
+        message.chat.id,
+        message.message_id,
+        message.text or message.caption or ''
+    )
+
+@router.callback(Action.BROADCAST_STOP)
+async def admin_broadcast_stop(callback_query: types.CallbackQuery, args):
+    if callback_query.from_user.id not in config.ADMIN_IDS:
+        await bot.answer_callback_query(callback_query.id, "Нет доступа")
+        return
+    
+    broadcast_id, = args
+    stopped = broadcaster.cancel(broadcast_id)
+    
+    await bot.answer_callback_query(
+        callback_query.id,
+        "Рассылка останавливается" if stopped else "Рассылка уже завершена"
+    )
+
 # ===== ЗАПУСК БОТА =====
 # ===== ИСПРАВЛЕННЫЙ ЗАПУСК =====
 async def on_startup(dp):
     """Действия при запуске бота"""
     logger.info("Бот SofiaCash запущен!")
     
+    # Статические клавиатуры и тексты собираются до первого сообщения
+    assets.build_all()
+    metrics.loop_monitor.start()
+    archive_job.start()
+    
     # Отправляем сообщение админам
     for admin_id in config.ADMIN_IDS:
         try:
             await bot.send_message(admin_id, "✅ SofiaCash Bot запущен и работает!")
         except:
             pass
+    
+    # Продолжаем рассылки, прерванные перезапуском
+    await broadcaster.resume_all()
 
 async def on_shutdown(dp):
     """Действия при остановке бота"""
     logger.info("Бот SofiaCash останавливается...")
+    await broadcaster.stop()
+    await metrics.loop_monitor.stop()
+    await archive_job.stop()
+    # Дорабатываем уже принятые обновления
+    await dp.shards.stop()
     await bot.close()
+    # Сначала сохраняем состояния FSM, пока база еще открыта
+    await dp.storage.close()
+    db.close()
 
 if __name__ == '__main__':
     from aiogram import executor
@@ -0,0 +1,218 @@
+"""Рассылка сообщения всем пользователям бота.
+
+Получатели читаются из users пачками по курсору user_id (keyset), отправка
+ограничена общим token bucket и интервалом на чат, при RetryAfter все
+отправители ждут указанное Telegram время. Позиция курсора сохраняется в
+таблице broadcasts после каждой пачки, поэтому после перезапуска рассылка
+продолжается с места остановки (повторно может уйти не больше одной пачки).
+"""
+import asyncio
+import logging
+import time
+
+from aiogram.utils.exceptions import RetryAfter, TelegramAPIError
+
+import config
+from keyboards import get_broadcast_keyboard
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Ограничение средней частоты: rate токенов в секунду, запас до capacity"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = None
+
+    def pause(self, seconds):
+        """Остановить выдачу токенов (ответ RetryAfter от Telegram)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    self._updated = time.monotonic()
+                    continue
+
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class PerChatLimiter:
+    """Не чаще одного сообщения в interval секунд в один чат"""
+
+    def __init__(self, interval, max_chats=10000):
+        self.interval = interval
+        self.max_chats = max_chats
+        self._next_allowed = {}
+
+    def ready(self, chat_id):
+        return time.monotonic() >= self._next_allowed.get(chat_id, 0)
+
+    async def wait(self, chat_id):
+        delay = self._next_allowed.get(chat_id, 0) - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(self._next_allowed) >= self.max_chats:
+            self._next_allowed.clear()
+        self._next_allowed[chat_id] = time.monotonic() + self.interval
+
+
+class Broadcaster:
+    """Запуск, продолжение и остановка рассылок.
+
+    bot - aiogram Bot, db - AsyncDatabase.
+    """
+
+    def __init__(self, bot, db):
+        self.bot = bot
+        self.db = db
+        self.bucket = TokenBucket(config.BROADCAST_RATE)
+        self.chat_limiter = PerChatLimiter(config.BROADCAST_CHAT_INTERVAL)
+        self.progress_limiter = PerChatLimiter(config.BROADCAST_PROGRESS_INTERVAL)
+        self._tasks = {}
+        self._stopping = False
+
+    async def start(self, admin_id, from_chat_id, message_id, text):
+        """Создать рассылку сообщения message_id из чата from_chat_id"""
+        total = await self.db.count_users()
+        progress = await self.bot.send_message(
+            admin_id,
+            f"📢 Рассылка запускается...\nПолучателей: {total}"
+        )
+        broadcast_id = await self.db.create_broadcast(
+            admin_id, from_chat_id, message_id, text, total, progress.message_id
+        )
+        self._launch(broadcast_id)
+        return broadcast_id
+
+    async def resume_all(self):
+        """Продолжить рассылки, прерванные перезапуском"""
+        for broadcast in await self.db.get_unfinished_broadcasts():
+            logger.info(f"Продолжаем рассылку #{broadcast[0]}")
+            self._launch(broadcast[0])
+
+    def cancel(self, broadcast_id):
+        task = self._tasks.get(broadcast_id)
+        if task is None:
+            return False
+        task.cancel()
+        return True
+
+    async def stop(self):
+        """Остановить рассылки при завершении работы (статус остается running)"""
+        self._stopping = True
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _launch(self, broadcast_id):
+        if broadcast_id in self._tasks:
+            return
+        task = asyncio.get_running_loop().create_task(self._run(broadcast_id))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    async def _send(self, user_id, from_chat_id, message_id):
+        for _ in range(config.BROADCAST_MAX_RETRIES):
+            await self.chat_limiter.wait(user_id)
+            await self.bucket.acquire()
+            try:
+                await self.bot.copy_message(user_id, from_chat_id, message_id)
+                return True
+            except RetryAfter as e:
+                logger.warning(f"Рассылка: RetryAfter {e.timeout}s")
+                self.bucket.pause(e.timeout)
+            except TelegramAPIError:
+                # Бот заблокирован, чат удален и т.п. - повтор не поможет
+                return False
+        return False
+
+    async def _run(self, broadcast_id):
+        (_, admin_id, from_chat_id, message_id, text, status, last_user_id,
+         sent, failed, total, progress_message_id) = await self.db.get_broadcast(broadcast_id)
+
+        semaphore = asyncio.Semaphore(config.BROADCAST_CONCURRENCY)
+        started = time.monotonic()
+        done_at_start = sent + failed
+
+        async def send_one(user_id):
+            async with semaphore:
+                return await self._send(user_id, from_chat_id, message_id)
+
+        try:
+            while True:
+                user_ids = await self.db.get_user_ids_after(last_user_id, config.BROADCAST_BATCH)
+                if not user_ids:
+                    break
+
+                results = await asyncio.gather(*(send_one(user_id) for user_id in user_ids))
+                sent += sum(results)
+                failed += len(results) - sum(results)
+                last_user_id = user_ids[-1]
+
+                await self.db.update_broadcast_progress(broadcast_id, last_user_id, sent, failed)
+                await self._report(broadcast_id, admin_id, progress_message_id,
+                                   sent, failed, total, started, done_at_start)
+
+            await self.db.update_broadcast_progress(broadcast_id, last_user_id, sent, failed, 'done')
+            await self._report(broadcast_id, admin_id, progress_message_id,
+                               sent, failed, total, started, done_at_start, final="✅ Рассылка завершена")
+        except asyncio.CancelledError:
+            if not self._stopping:
+                await self.db.update_broadcast_progress(broadcast_id, last_user_id, sent, failed, 'cancelled')
+                await self._report(broadcast_id, admin_id, progress_message_id,
+                                   sent, failed, total, started, done_at_start, final="⏹ Рассылка остановлена")
+            raise
+        except Exception:
+            logger.exception(f"Ошибка рассылки #{broadcast_id}")
+
+    async def _report(self, broadcast_id, admin_id, message_id, sent, failed, total,
+                      started, done_at_start, final=None):
+        # Правим сообщение не чаще BROADCAST_PROGRESS_INTERVAL, кроме итогового
+        if final is None:
+            if not self.progress_limiter.ready(admin_id):
+                return
+            await self.progress_limiter.wait(admin_id)
+
+        done = sent + failed
+        elapsed = max(time.monotonic() - started, 1e-6)
+        speed = (done - done_at_start) / elapsed
+        remaining = max(total - done, 0)
+        eta = remaining / speed if speed > 0 else 0
+
+        text = (
+            f"📢 Рассылка #{broadcast_id}\n\n"
+            f"✅ Доставлено: {sent}\n"
+            f"❌ Ошибок: {failed}\n"
+            f"📊 Прогресс: {done}/{total}\n"
+            f"⚡ Скорость: {speed:.1f} сообщ./с\n"
+            f"⏳ Осталось: ~{int(eta // 60)} мин {int(eta % 60)} с"
+        )
+        if final:
+            text = f"{final}\n\n{text}"
+
+        try:
+            await self.bot.edit_message_text(
+                text, chat_id=admin_id, message_id=message_id,
+                reply_markup=None if final else get_broadcast_keyboard(broadcast_id)
+            )
+        except TelegramAPIError:
+            pass
@@ -0,0 +1,90 @@
+"""Ограниченный по размеру и времени жизни LRU-кеш.
+
+Используется для записей пользователей: читатели берут строку из кеша,
+изменяющие методы Database сбрасывают ее после коммита.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUTTLCache:
+    """Потокобезопасный LRU-кеш с TTL и счетчиками попаданий/промахов.
+
+    Чтобы читатель не положил в кеш строку, прочитанную до параллельного
+    изменения, запись выполняется через токен: token = cache.token() перед
+    чтением из базы, cache.set(key, value, token) после. Если между ними
+    был вызван invalidate(), значение не сохраняется.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def token(self):
+        return self._generation
+
+    def set(self, key, value, token=None):
+        with self._lock:
+            if token is not None and token != self._generation:
+                return False
+
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+            return True
+
+    def invalidate(self, *keys):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                if self._data.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,176 @@
+"""Компактный версионный формат callback_data.
+
+Вместо строк вида "trans_complete_15", которые разбираются split('_') и
+ломаются на значениях с подчеркиванием ("deposit_bank_card"), кнопки
+кодируются так:
+
+    base64url без "=" от [версия][действие][аргумент 1][аргумент 2]...
+
+Версия и действие занимают по байту, аргументы - беззнаковые varint
+(по 7 бит в байте, как в protobuf). Аргумент-перечисление передается
+индексом в кортеже его значений. Набор и типы аргументов каждого действия
+заданы в SPEC, поэтому unpack() проверяет версию, действие, число
+аргументов и диапазоны и возвращает уже готовые значения.
+
+Кортежи значений перечислений можно только дополнять: индексы уже
+отправленных кнопок должны сохранять смысл.
+"""
+import base64
+import binascii
+import string
+from enum import IntEnum
+
+VERSION = 1
+
+# Ограничение Telegram на callback_data, байт
+MAX_LENGTH = 64
+
+# Больше 10 байт varint не бывает для 64-битных чисел
+MAX_VARINT_BYTES = 10
+MAX_UINT = (1 << 64) - 1
+
+
+class CallbackDataError(ValueError):
+    """callback_data не в этом формате или не проходит проверку"""
+
+
+class Action(IntEnum):
+    DEPOSIT_METHOD = 1
+    DEPOSIT_AMOUNT = 2
+    DEPOSIT_CUSTOM = 3
+    WITHDRAW_METHOD = 4
+    CANCEL = 5
+    TRANS_STATUS = 6
+    ADMIN_USER = 7
+    HISTORY_PAGE = 8
+    USERS_PAGE = 9
+    SEARCH_PAGE = 10
+    SEARCH_USER = 11
+    BROADCAST_STOP = 12
+    WITHDRAWALS_PAGE = 13
+    WITHDRAWAL_TOGGLE = 14
+    WITHDRAWALS_BULK = 15
+
+
+# ===== ПЕРЕЧИСЛЕНИЯ =====
+PAYMENT_METHODS = ('qiwi', 'yoomoney', 'bank_card', 'crypto')
+TRANS_STATUSES = ('completed', 'cancelled', 'pending', 'rejected')
+ADMIN_OPS = ('add', 'sub', 'ban', 'unban', 'stats', 'msg')
+DIRECTIONS = ('prev', 'next')
+
+# Целое без ограничений (id, сумма, курсор)
+UINT = None
+
+SPEC = {
+    Action.DEPOSIT_METHOD: (PAYMENT_METHODS,),
+    Action.DEPOSIT_AMOUNT: (UINT,),
+    Action.DEPOSIT_CUSTOM: (),
+    Action.WITHDRAW_METHOD: (PAYMENT_METHODS,),
+    Action.CANCEL: (),
+    Action.TRANS_STATUS: (UINT, TRANS_STATUSES),
+    Action.ADMIN_USER: (UINT, ADMIN_OPS),
+    Action.HISTORY_PAGE: (DIRECTIONS, UINT),
+    Action.USERS_PAGE: (DIRECTIONS, UINT),
+    Action.SEARCH_PAGE: (UINT,),
+    Action.SEARCH_USER: (UINT,),
+    Action.BROADCAST_STOP: (UINT,),
+    Action.WITHDRAWALS_PAGE: (DIRECTIONS, UINT),
+    Action.WITHDRAWAL_TOGGLE: (UINT,),
+    Action.WITHDRAWALS_BULK: (TRANS_STATUSES,),
+}
+
+# base64url -> стандартный алфавит для binascii; проверка алфавита -
+# удаление допустимых символов (должна остаться пустая строка)
+_TO_STANDARD = bytes.maketrans(b'-_', b'+/')
+_URLSAFE_ALPHABET = (string.ascii_letters + string.digits + '-_').encode('ascii')
+
+# Проверка действия при разборе - один поиск в словаре по байту
+_ACTIONS = {int(action): (action, SPEC[action]) for action in Action}
+_ENUM_INDEX = {
+    values: {value: index for index, value in enumerate(values)}
+    for spec in SPEC.values() for values in spec if values is not UINT
+}
+
+
+def pack(action, *args):
+    """Закодировать действие и аргументы в строку callback_data"""
+    spec = SPEC[action]
+    if len(args) != len(spec):
+        raise CallbackDataError(f"{action.name}: ожидается аргументов {len(spec)}, получено {len(args)}")
+
+    out = bytearray((VERSION, action))
+    for kind, value in zip(spec, args):
+        if kind is not UINT:
+            try:
+                value = _ENUM_INDEX[kind][value]
+            except KeyError:
+                raise CallbackDataError(f"{action.name}: недопустимое значение {value!r}") from None
+        elif not isinstance(value, int) or not 0 <= value <= MAX_UINT:
+            raise CallbackDataError(f"{action.name}: аргумент должен быть целым 0..2^64-1, получено {value!r}")
+
+        while value > 0x7f:
+            out.append((value & 0x7f) | 0x80)
+            value >>= 7
+        out.append(value)
+
+    data = base64.urlsafe_b64encode(out).rstrip(b'=').decode('ascii')
+    if len(data) > MAX_LENGTH:
+        raise CallbackDataError(f"{action.name}: {len(data)} байт больше лимита {MAX_LENGTH}")
+    return data
+
+
+def unpack(data):
+    """Разобрать callback_data: (Action, кортеж аргументов).
+
+    Аргументы-перечисления возвращаются значениями (например, 'bank_card').
+    Любые некорректные данные - CallbackDataError.
+    """
+    if not data or len(data) > MAX_LENGTH:
+        raise CallbackDataError("пустые данные или длиннее лимита")
+    try:
+        encoded = data.encode('ascii')
+        if encoded.translate(None, _URLSAFE_ALPHABET):
+            raise ValueError
+        raw = binascii.a2b_base64(encoded.translate(_TO_STANDARD) + b'=='[:-len(encoded) % 4])
+    except (binascii.Error, ValueError):
+        raise CallbackDataError("не base64url") from None
+
+    if len(raw) < 2 or raw[0] != VERSION:
+        raise CallbackDataError("неизвестная версия")
+    entry = _ACTIONS.get(raw[1])
+    if entry is None:
+        raise CallbackDataError("неизвестное действие")
+    action, spec = entry
+
+    args = []
+    pos, end = 2, len(raw)
+    for kind in spec:
+        if pos >= end:
+            raise CallbackDataError("не хватает аргументов")
+        value = raw[pos]
+        pos += 1
+        if value > 0x7f:
+            # Многобайтовый varint
+            value &= 0x7f
+            shift = 7
+            while True:
+                if pos >= end or shift >= 7 * MAX_VARINT_BYTES:
+                    raise CallbackDataError("оборванный varint")
+                byte = raw[pos]
+                pos += 1
+                value |= (byte & 0x7f) << shift
+                if byte < 0x80:
+                    break
+                shift += 7
+            if value > MAX_UINT:
+                raise CallbackDataError("число вне диапазона")
+
+        if kind is not UINT:
+            if value >= len(kind):
+                raise CallbackDataError("значение перечисления вне диапазона")
+            value = kind[value]
+        args.append(value)
+
+    if pos != end:
+        raise CallbackDataError("лишние байты")
+    return action, tuple(args)
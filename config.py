@@ -1,4 +1,5 @@
 import os
+import secrets
 
 # ===== ОСНОВНЫЕ НАСТРОЙКИ =====
 BOT_TOKEN = os.getenv('BOT_TOKEN', '7479880371:AAHemgaC1OO2Ni-8ClbH9aYG4c8_FXoIQik')
@@ -31,3 +32,104 @@ WEBSITE_URL = "https://sofiacash.win"
 # ===== НАДПИСИ И ТЕКСТЫ =====
 BOT_NAME = "SofiaCash"
 BOT_DESCRIPTION = "💎 Быстрые переводы и надежные транзакции"
+
+# Размер страницы в листаемых списках
+HISTORY_PAGE_SIZE = 5       # операций в истории
+USERS_PAGE_SIZE = 10        # пользователей в списке админа
+SEARCH_PAGE_SIZE = 8        # результатов поиска пользователей
+WITHDRAWALS_PAGE_SIZE = 8   # заявок в консоли выводов
+
+# ===== БАЗА ДАННЫХ =====
+DB_NAME = os.getenv('DB_NAME', 'database.db')
+
+# Количество потоков для выполнения запросов к SQLite вне event loop
+DB_EXECUTOR_WORKERS = int(os.getenv('DB_EXECUTOR_WORKERS', '4'))
+
+# Пул соединений: по одному на поток пула хватает, больше не нужно
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', str(DB_EXECUTOR_WORKERS)))
+DB_BUSY_TIMEOUT = float(os.getenv('DB_BUSY_TIMEOUT', '5'))      # секунды ожидания блокировки
+DB_CACHED_STATEMENTS = int(os.getenv('DB_CACHED_STATEMENTS', '256'))
+
+# PRAGMA, применяемые к каждому соединению при открытии
+DB_PRAGMAS = {
+    'journal_mode': os.getenv('DB_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.getenv('DB_SYNCHRONOUS', 'NORMAL'),
+    'mmap_size': int(os.getenv('DB_MMAP_SIZE', str(64 * 1024 * 1024))),
+    'cache_size': int(os.getenv('DB_CACHE_SIZE', '-8000')),    # отрицательное значение - в КиБ
+    'temp_store': 'MEMORY',
+}
+
+# Кеш записей пользователей
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))     # максимум записей
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '60'))         # секунды
+
+# Групповой коммит: записи параллельных обработчиков коммитятся одной транзакцией
+DB_BATCH_WRITES = os.getenv('DB_BATCH_WRITES', '1') == '1'
+DB_BATCH_WINDOW_MS = float(os.getenv('DB_BATCH_WINDOW_MS', '2'))     # ожидание пакета, мс
+DB_BATCH_MAX_SIZE = int(os.getenv('DB_BATCH_MAX_SIZE', '64'))        # операций в пакете
+
+# Журнал движения средств: снимок баланса пользователя каждые N проводок
+LEDGER_SNAPSHOT_EVERY = int(os.getenv('LEDGER_SNAPSHOT_EVERY', '50'))
+
+# Трассировка SQL (sqltrace): статистика выражений и журнал медленных запросов
+DB_TRACE = os.getenv('DB_TRACE', '0') == '1'
+DB_SLOW_QUERY_MS = float(os.getenv('DB_SLOW_QUERY_MS', '100'))      # порог медленного запроса, мс
+DB_TRACE_SAMPLES = int(os.getenv('DB_TRACE_SAMPLES', '1000'))       # длительностей на выражение для p50/p99
+DB_SLOW_LOG_SIZE = int(os.getenv('DB_SLOW_LOG_SIZE', '100'))        # последних медленных запросов в памяти
+
+# Архив операций (archive): завершенные операции старше N дней уходят в помесячные файлы
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', '')                          # пусто - <DB_NAME без расширения>-archive
+ARCHIVE_AFTER_DAYS = float(os.getenv('ARCHIVE_AFTER_DAYS', '90'))
+ARCHIVE_INTERVAL = float(os.getenv('ARCHIVE_INTERVAL', str(6 * 60 * 60)))  # секунды между запусками, 0 - выключено
+ARCHIVE_BATCH = int(os.getenv('ARCHIVE_BATCH', '5000'))             # операций в одной транзакции переноса
+
+# Выгрузка таблиц через HTTP (/admin/export): строк в одной пачке чтения и записи в ответ
+EXPORT_BATCH = int(os.getenv('EXPORT_BATCH', '1000'))
+
+# ===== СОСТОЯНИЯ FSM =====
+FSM_HOT_SIZE = int(os.getenv('FSM_HOT_SIZE', '5000'))                # диалогов в памяти
+FSM_TTL = float(os.getenv('FSM_TTL', str(24 * 60 * 60)))            # брошенный диалог, секунды
+FSM_FLUSH_INTERVAL = float(os.getenv('FSM_FLUSH_INTERVAL', '1'))    # задержка записи в базу, секунды
+FSM_FLUSH_BATCH = int(os.getenv('FSM_FLUSH_BATCH', '100'))           # сброс без ожидания при N изменениях
+FSM_SWEEP_INTERVAL = float(os.getenv('FSM_SWEEP_INTERVAL', '600'))  # период очистки, секунды
+
+# ===== РЕЖИМ РАБОТЫ =====
+PORT = int(os.getenv('PORT', '10000'))
+
+# Публичный адрес сервиса; на Render подставляется автоматически
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST') or os.getenv('RENDER_EXTERNAL_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_URL = f"{WEBHOOK_HOST.rstrip('/')}{WEBHOOK_PATH}"
+
+# 'webhook' - обновления приходят на HTTP сервер, 'polling' - резервный long polling
+BOT_MODE = os.getenv('BOT_MODE', 'webhook' if WEBHOOK_HOST else 'polling')
+
+# Секрет заголовка X-Telegram-Bot-Api-Secret-Token (без переменной - новый при каждом запуске)
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+
+# Обработка обновлений: воркеры с очередями, порядок сохраняется для каждого пользователя
+DISPATCH_WORKERS = int(os.getenv('DISPATCH_WORKERS', '32'))
+DISPATCH_QUEUE_SIZE = int(os.getenv('DISPATCH_QUEUE_SIZE', '100'))   # на воркера
+
+# ===== МЕТРИКИ =====
+# Токен служебных HTTP эндпоинтов (заголовок Authorization: Bearer <токен>); пусто - выключены
+ADMIN_HTTP_TOKEN = os.getenv('ADMIN_HTTP_TOKEN', '')
+
+METRICS_PATH = os.getenv('METRICS_PATH', '/metrics')
+METRICS_LOOP_LAG_INTERVAL = float(os.getenv('METRICS_LOOP_LAG_INTERVAL', '0.5'))   # период замера задержки loop, секунды
+LOOP_BLOCK_THRESHOLD = float(os.getenv('LOOP_BLOCK_THRESHOLD', '0.5'))  # стек в лог, если loop занят дольше, секунды; 0 - выключено
+
+# Проверки /health и /ready
+HEALTH_MAX_LOOP_LAG = float(os.getenv('HEALTH_MAX_LOOP_LAG', '2'))          # допустимая задержка loop, секунды
+HEALTH_DB_TIMEOUT = float(os.getenv('HEALTH_DB_TIMEOUT', '2'))              # /ready: ожидание запроса к базе, секунды
+HEALTH_POLLING_STALE = float(os.getenv('HEALTH_POLLING_STALE', '90'))       # polling: последний getUpdates не старше, секунды
+HEALTH_MAX_UPDATE_AGE = float(os.getenv('HEALTH_MAX_UPDATE_AGE', '0'))      # /ready: последнее обновление не старше, секунды; 0 - не проверять
+
+# ===== РАССЫЛКА =====
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '25'))                  # сообщений в секунду всего
+BROADCAST_CHAT_INTERVAL = 1.0                                              # секунд между сообщениями в один чат
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '10'))      # одновременных запросов
+BROADCAST_BATCH = int(os.getenv('BROADCAST_BATCH', '200'))                 # получателей в пачке
+BROADCAST_PROGRESS_INTERVAL = 5.0                                          # секунд между обновлениями прогресса
+BROADCAST_MAX_RETRIES = 3
@@ -1,297 +1,1378 @@
+import asyncio
+import functools
+import logging
+import os
+import queue
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+import archive
 import config
+import metrics
+import migrations
+from cache import LRUTTLCache
+from sqltrace import QueryTracer, TracedConnection
 
-class Database:
-    def __init__(self, db_name="database.db"):
+logger = logging.getLogger(__name__)
+
+USER_COLUMNS = (
+    'user_id', 'username', 'first_name', 'last_name', 'balance', 'total_deposited', 'total_withdrawn',
+    'referral_id', 'referrer_id', 'referrals_count', 'is_banned', 'is_admin', 'created_at', 'last_active',
+)
+
+# Выгрузка: таблица -> (колонки, второй ключ порядка после created_at, допустимые статусы)
+EXPORT_TABLES = {
+    'transactions': (archive.TRANSACTION_COLUMNS, 'id', ('pending',) + archive.FINAL_STATUSES),
+    'withdrawals': (archive.WITHDRAWAL_COLUMNS, 'id', ('pending',) + archive.FINAL_STATUSES),
+    'users': (USER_COLUMNS, 'user_id', ()),
+}
+
+
+def to_kopecks(amount):
+    """Сумма в рублях -> целое число копеек"""
+    return int(round(amount * 100))
+
+
+class ConnectionPool:
+    """Небольшой пул долгоживущих соединений SQLite.
+
+    Соединения создаются лениво (не больше size), настраиваются PRAGMA один
+    раз при открытии и переиспользуются между вызовами, поэтому кеш
+    подготовленных выражений sqlite3 (cached_statements) действительно
+    работает. Если все соединения заняты, вызывающий поток ждет освобождения.
+    """
+
+    def __init__(self, db_name, size, pragmas=None, cached_statements=None, timeout=None, tracer=None):
         self.db_name = db_name
+        # QueryTracer: соединения открываются с трассировкой (см. sqltrace)
+        self.tracer = tracer
+        self.size = size
+        self.pragmas = pragmas or {}
+        self.cached_statements = cached_statements or config.DB_CACHED_STATEMENTS
+        self.timeout = timeout or config.DB_BUSY_TIMEOUT
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._all = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_name,
+            timeout=self.timeout,
+            cached_statements=self.cached_statements,
+            check_same_thread=False,
+            factory=TracedConnection if self.tracer is not None else sqlite3.Connection
+        )
+        if self.tracer is not None:
+            conn.install(self.tracer)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+
+        if not can_create:
+            return self._idle.get()
+
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+        with self._lock:
+            self._all.append(conn)
+        return conn
+
+    def release(self, conn):
+        if self.tracer is not None:
+            self.tracer.flush(conn)
+        # Незавершенная транзакция не должна перейти к следующему владельцу
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        with self._lock:
+            connections, self._all = self._all, []
+            self._created = 0
+        self._idle = queue.LifoQueue()
+        for conn in connections:
+            conn.close()
+
+
+class Database:
+    def __init__(self, db_name=None, pool_size=None):
+        self.db_name = db_name or config.DB_NAME
+        self.tracer = QueryTracer() if config.DB_TRACE else None
+        self.pool = ConnectionPool(
+            self.db_name,
+            size=pool_size or config.DB_POOL_SIZE,
+            pragmas=config.DB_PRAGMAS,
+            tracer=self.tracer
+        )
+        # Кеш строк users по user_id; сбрасывается изменяющими методами после коммита
+        self.user_cache = LRUTTLCache(config.USER_CACHE_SIZE, config.USER_CACHE_TTL)
+        # Помесячные файлы старых операций (см. archive)
+        self.archive_dir = archive.archive_dir(self.db_name)
+        # Текущая транзакция записи потока (см. transaction)
+        self._local = threading.local()
         self.init_db()
+        
+        with self.connection() as conn:
+            self.has_search_index = migrations.has_users_search(conn)
     
-    def get_connection(self):
-        return sqlite3.connect(self.db_name)
+    def connection(self):
+        """Соединение из пула (контекстный менеджер)"""
+        return self.pool.connection()
     
-    def init_db(self):
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    @contextmanager
+    def transaction(self):
+        """Транзакция записи: BEGIN IMMEDIATE ... COMMIT, отдает курсор.
         
-        # Пользователи
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                balance REAL DEFAULT 0,
-                total_deposited REAL DEFAULT 0,
-                total_withdrawn REAL DEFAULT 0,
-                referral_id TEXT UNIQUE,
-                referrer_id INTEGER,
-                referrals_count INTEGER DEFAULT 0,
-                is_banned BOOLEAN DEFAULT 0,
-                is_admin BOOLEAN DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        Вложенный вызов в том же потоке (например, операция внутри пакета
+        WriteBatcher) выполняется как SAVEPOINT: ошибка откатывает только
+        его изменения. Сброс кеша пользователей откладывается до коммита
+        внешней транзакции.
+        """
+        local = self._local
         
-        # Транзакции
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS transactions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                type TEXT, -- 'deposit', 'withdraw', 'bonus', 'referral'
-                amount REAL,
-                status TEXT DEFAULT 'pending', -- 'pending', 'completed', 'rejected', 'cancelled'
-                payment_method TEXT,
-                details TEXT,
-                admin_id INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                completed_at TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
-        
-        # Выводы (отдельная таблица для лучшей структуры)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS withdrawals (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                transaction_id INTEGER,
-                user_id INTEGER,
-                amount REAL,
-                fee REAL DEFAULT 0,
-                net_amount REAL,
-                payment_method TEXT,
-                requisites TEXT,
-                status TEXT DEFAULT 'pending',
-                admin_comment TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                processed_at TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id),
-                FOREIGN KEY (transaction_id) REFERENCES transactions (id)
-            )
-        ''')
+        if getattr(local, 'conn', None) is not None:
+            local.depth += 1
+            savepoint = f'sp{local.depth}'
+            cursor = local.conn.cursor()
+            cursor.execute(f'SAVEPOINT {savepoint}')
+            try:
+                yield cursor
+            except BaseException:
+                cursor.execute(f'ROLLBACK TO {savepoint}')
+                cursor.execute(f'RELEASE {savepoint}')
+                raise
+            else:
+                cursor.execute(f'RELEASE {savepoint}')
+            finally:
+                local.depth -= 1
+            return
         
-        # Реферальные выплаты
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS referral_payments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                referrer_id INTEGER,
-                referral_id INTEGER,
-                amount REAL,
-                transaction_id INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (referrer_id) REFERENCES users (user_id),
-                FOREIGN KEY (referral_id) REFERENCES users (user_id)
-            )
-        ''')
-        
-        # Настройки
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS settings (
-                key TEXT PRIMARY KEY,
-                value TEXT
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        local.invalidated = set()
+        try:
+            with self.connection() as conn:
+                local.conn, local.depth = conn, 0
+                try:
+                    cursor = conn.cursor()
+                    cursor.execute('BEGIN IMMEDIATE')
+                    yield cursor
+                    conn.commit()
+                finally:
+                    local.conn = None
+        finally:
+            invalidated, local.invalidated = local.invalidated, None
+            if invalidated:
+                self.user_cache.invalidate(*invalidated)
+    
+    def close(self):
+        self.pool.close()
+    
+    def ping(self):
+        """Запрос к базе через пул для проверки готовности"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1 FROM bot_stats WHERE id = 1')
+            cursor.fetchone()
+        return True
+    
+    def init_db(self):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            # Пользователи
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    user_id INTEGER PRIMARY KEY,
+                    username TEXT,
+                    first_name TEXT,
+                    last_name TEXT,
+                    balance REAL DEFAULT 0,
+                    total_deposited REAL DEFAULT 0,
+                    total_withdrawn REAL DEFAULT 0,
+                    referral_id TEXT UNIQUE,
+                    referrer_id INTEGER,
+                    referrals_count INTEGER DEFAULT 0,
+                    is_banned BOOLEAN DEFAULT 0,
+                    is_admin BOOLEAN DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # Транзакции
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS transactions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    type TEXT, -- 'deposit', 'withdraw', 'bonus', 'referral'
+                    amount REAL,
+                    status TEXT DEFAULT 'pending', -- 'pending', 'completed', 'rejected', 'cancelled'
+                    payment_method TEXT,
+                    details TEXT,
+                    admin_id INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    completed_at TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (user_id)
+                )
+            ''')
+            
+            # Выводы (отдельная таблица для лучшей структуры)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS withdrawals (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    transaction_id INTEGER,
+                    user_id INTEGER,
+                    amount REAL,
+                    fee REAL DEFAULT 0,
+                    net_amount REAL,
+                    payment_method TEXT,
+                    requisites TEXT,
+                    status TEXT DEFAULT 'pending',
+                    admin_comment TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    processed_at TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (user_id),
+                    FOREIGN KEY (transaction_id) REFERENCES transactions (id)
+                )
+            ''')
+            
+            # Реферальные выплаты
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS referral_payments (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    referrer_id INTEGER,
+                    referral_id INTEGER,
+                    amount REAL,
+                    transaction_id INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (referrer_id) REFERENCES users (user_id),
+                    FOREIGN KEY (referral_id) REFERENCES users (user_id)
+                )
+            ''')
+            
+            # Настройки
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS settings (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            ''')
+            
+            conn.commit()
+            
+            migrations.migrate(conn)
     
     # ===== ПОЛЬЗОВАТЕЛИ =====
     def create_user(self, user_id, username, first_name, last_name, referrer_id=None):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Генерируем реферальный ID
-        referral_id = f"REF{user_id}{datetime.now().strftime('%m%d')}"
-        
-        cursor.execute('''
-            INSERT OR IGNORE INTO users 
-            (user_id, username, first_name, last_name, referral_id, referrer_id) 
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (user_id, username, first_name, last_name, referral_id, referrer_id))
-        
-        # Если есть реферер, увеличиваем его счетчик
-        if referrer_id:
-            cursor.execute('UPDATE users SET referrals_count = referrals_count + 1 WHERE user_id = ?', (referrer_id,))
+        with self.transaction() as cursor:
+            # Генерируем реферальный ID
+            referral_id = f"REF{user_id}{datetime.now().strftime('%m%d')}"
+            
+            cursor.execute('''
+                INSERT OR IGNORE INTO users 
+                (user_id, username, first_name, last_name, referral_id, referrer_id) 
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (user_id, username, first_name, last_name, referral_id, referrer_id))
+            
+            # Если есть реферер, увеличиваем его счетчик
+            if referrer_id:
+                cursor.execute('UPDATE users SET referrals_count = referrals_count + 1 WHERE user_id = ?', (referrer_id,))
         
-        conn.commit()
-        conn.close()
+        self.invalidate_user(user_id, referrer_id)
     
     def get_user(self, user_id):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-        user = cursor.fetchone()
-        conn.close()
+        user = self.user_cache.get(user_id)
+        if user is not None:
+            return user
+        return self._fetch_user(user_id)
+    
+    def _fetch_user(self, user_id):
+        """Прочитать пользователя из базы и положить в кеш"""
+        token = self.user_cache.token()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
+            user = cursor.fetchone()
+        
+        if user is not None:
+            self.user_cache.set(user_id, user, token)
         return user
     
+    def invalidate_user(self, *user_ids):
+        """Сбросить кеш пользователей (вызывать после изменения строк users).
+        
+        Внутри transaction() сброс выполняется после коммита.
+        """
+        user_ids = [user_id for user_id in user_ids if user_id]
+        invalidated = getattr(self._local, 'invalidated', None)
+        if invalidated is not None:
+            invalidated.update(user_ids)
+        else:
+            self.user_cache.invalidate(*user_ids)
+    
     def update_balance(self, user_id, amount, operation='deposit'):
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.transaction() as cursor:
+            if operation == 'deposit':
+                cursor.execute('''
+                    UPDATE users 
+                    SET balance = balance + ?, 
+                        total_deposited = total_deposited + ?,
+                        last_active = CURRENT_TIMESTAMP
+                    WHERE user_id = ?
+                ''', (amount, amount, user_id))
+            elif operation == 'withdraw':
+                cursor.execute('''
+                    UPDATE users 
+                    SET balance = balance - ?, 
+                        total_withdrawn = total_withdrawn + ?,
+                        last_active = CURRENT_TIMESTAMP
+                    WHERE user_id = ?
+                ''', (amount, amount, user_id))
+            elif operation == 'bonus':
+                cursor.execute('''
+                    UPDATE users 
+                    SET balance = balance + ?,
+                        last_active = CURRENT_TIMESTAMP
+                    WHERE user_id = ?
+                ''', (amount, user_id))
+            else:
+                return
+            
+            if cursor.rowcount:
+                delta = to_kopecks(amount)
+                self._append_ledger(cursor, user_id, -delta if operation == 'withdraw' else delta, operation)
         
-        if operation == 'deposit':
+        self.invalidate_user(user_id)
+    
+    # ===== ТРАНЗАКЦИИ =====
+    def create_transaction(self, user_id, trans_type, amount, payment_method=None, details=None):
+        with self.transaction() as cursor:
             cursor.execute('''
-                UPDATE users 
-                SET balance = balance + ?, 
-                    total_deposited = total_deposited + ?,
-                    last_active = CURRENT_TIMESTAMP
-                WHERE user_id = ?
-            ''', (amount, amount, user_id))
-        elif operation == 'withdraw':
+                INSERT INTO transactions 
+                (user_id, type, amount, payment_method, details) 
+                VALUES (?, ?, ?, ?, ?)
+            ''', (user_id, trans_type, amount, payment_method, details))
+            
+            trans_id = cursor.lastrowid
+            
+            # Если это пополнение, создаем запись на вывод
+            if trans_type == 'withdraw':
+                fee = amount * (config.WITHDRAW_FEE / 100)
+                net_amount = amount - fee
+                
+                cursor.execute('''
+                    INSERT INTO withdrawals 
+                    (transaction_id, user_id, amount, fee, net_amount, payment_method) 
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (trans_id, user_id, amount, fee, net_amount, payment_method))
+            
+        return trans_id
+    
+    def create_withdrawal(self, user_id, amount, payment_method=None, requisites=None):
+        """Создать заявку на вывод и списать баланс одной транзакцией.
+        
+        Проверка баланса выполняется условием UPDATE ... WHERE balance >= ?,
+        поэтому параллельные заявки не могут увести баланс в минус.
+        Возвращает id транзакции или None, если средств недостаточно.
+        """
+        fee = amount * (config.WITHDRAW_FEE / 100)
+        net_amount = amount - fee
+        
+        with self.transaction() as cursor:
             cursor.execute('''
                 UPDATE users 
                 SET balance = balance - ?, 
                     total_withdrawn = total_withdrawn + ?,
                     last_active = CURRENT_TIMESTAMP
-                WHERE user_id = ?
-            ''', (amount, amount, user_id))
-        elif operation == 'bonus':
+                WHERE user_id = ? AND balance >= ?
+            ''', (amount, amount, user_id, amount))
+            
+            if cursor.rowcount == 0:
+                return None
+            
             cursor.execute('''
-                UPDATE users 
-                SET balance = balance + ?,
-                    last_active = CURRENT_TIMESTAMP
-                WHERE user_id = ?
-            ''', (amount, user_id))
+                INSERT INTO transactions 
+                (user_id, type, amount, payment_method, details) 
+                VALUES (?, 'withdraw', ?, ?, ?)
+            ''', (user_id, amount, payment_method, requisites))
+            
+            trans_id = cursor.lastrowid
+            
+            cursor.execute('''
+                INSERT INTO withdrawals 
+                (transaction_id, user_id, amount, fee, net_amount, payment_method, requisites) 
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (trans_id, user_id, amount, fee, net_amount, payment_method, requisites))
+            
+            self._append_ledger(cursor, user_id, -to_kopecks(amount), 'withdraw', trans_id)
         
-        conn.commit()
-        conn.close()
+        self.invalidate_user(user_id)
+        return trans_id
     
-    # ===== ТРАНЗАКЦИИ =====
-    def create_transaction(self, user_id, trans_type, amount, payment_method=None, details=None):
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    # ===== ЖУРНАЛ СРЕДСТВ =====
+    def _append_ledger(self, cursor, user_id, delta, kind, transaction_id=None):
+        """Добавить проводку (в копейках) в текущей транзакции.
         
+        Каждые LEDGER_SNAPSHOT_EVERY проводок пользователя сохраняется снимок
+        баланса, поэтому расчет баланса по журналу читает только его хвост.
+        """
         cursor.execute('''
-            INSERT INTO transactions 
-            (user_id, type, amount, payment_method, details) 
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, trans_type, amount, payment_method, details))
+            INSERT INTO ledger (user_id, delta, kind, transaction_id) 
+            VALUES (?, ?, ?, ?)
+        ''', (user_id, delta, kind, transaction_id))
         
-        trans_id = cursor.lastrowid
+        snapshot_id, snapshot_balance = self._last_snapshot(cursor, user_id)
+        cursor.execute('''
+            SELECT COUNT(*), COALESCE(SUM(delta), 0), MAX(id) FROM ledger 
+            WHERE user_id = ? AND id > ?
+        ''', (user_id, snapshot_id))
+        count, tail, last_id = cursor.fetchone()
         
-        # Если это пополнение, создаем запись на вывод
-        if trans_type == 'withdraw':
-            fee = amount * (config.WITHDRAW_FEE / 100)
-            net_amount = amount - fee
-            
+        if count >= config.LEDGER_SNAPSHOT_EVERY:
             cursor.execute('''
-                INSERT INTO withdrawals 
-                (transaction_id, user_id, amount, fee, net_amount, payment_method) 
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (trans_id, user_id, amount, fee, net_amount, payment_method))
-        
-        conn.commit()
-        conn.close()
-        return trans_id
+                INSERT INTO balance_snapshots (user_id, ledger_id, balance) 
+                VALUES (?, ?, ?)
+            ''', (user_id, last_id, snapshot_balance + tail))
     
-    def get_user_transactions(self, user_id, limit=10):
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def _last_snapshot(self, cursor, user_id):
         cursor.execute('''
-            SELECT * FROM transactions 
+            SELECT ledger_id, balance FROM balance_snapshots 
             WHERE user_id = ? 
-            ORDER BY created_at DESC 
-            LIMIT ?
-        ''', (user_id, limit))
-        transactions = cursor.fetchall()
-        conn.close()
+            ORDER BY ledger_id DESC 
+            LIMIT 1
+        ''', (user_id,))
+        return cursor.fetchone() or (0, 0)
+    
+    def get_ledger_balance(self, user_id):
+        """Баланс пользователя по журналу, в копейках"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            snapshot_id, balance = self._last_snapshot(cursor, user_id)
+            cursor.execute(
+                'SELECT COALESCE(SUM(delta), 0) FROM ledger WHERE user_id = ? AND id > ?',
+                (user_id, snapshot_id)
+            )
+            return balance + cursor.fetchone()[0]
+    
+    def verify_ledger(self):
+        """Проиграть журнал заново и сверить с users.balance и снимками.
+        
+        Возвращает (расхождения балансов, неверные снимки):
+        [(user_id, баланс в users, по журналу)] и
+        [(user_id, ledger_id, в снимке, по журналу)], все суммы в копейках.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN')  # один снимок базы на все запросы
+            try:
+                cursor.execute('''
+                    SELECT user_id, stored, replayed FROM (
+                        SELECT u.user_id, CAST(ROUND(u.balance * 100) AS INTEGER) AS stored, 
+                               COALESCE(l.total, 0) AS replayed
+                        FROM users u
+                        LEFT JOIN (
+                            SELECT user_id, SUM(delta) AS total FROM ledger GROUP BY user_id
+                        ) l ON l.user_id = u.user_id
+                    )
+                    WHERE stored != replayed
+                    ORDER BY user_id
+                ''')
+                balances = cursor.fetchall()
+                
+                cursor.execute('''
+                    SELECT user_id, ledger_id, balance, replayed FROM (
+                        SELECT s.user_id, s.ledger_id, s.balance, 
+                               (SELECT COALESCE(SUM(delta), 0) FROM ledger 
+                                WHERE user_id = s.user_id AND id <= s.ledger_id) AS replayed
+                        FROM balance_snapshots s
+                    )
+                    WHERE balance != replayed
+                    ORDER BY user_id, ledger_id
+                ''')
+                snapshots = cursor.fetchall()
+            finally:
+                conn.rollback()
+        
+        return balances, snapshots
+    
+    def get_user_transactions(self, user_id, limit=10):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            months = self._archived_months(cursor, user_id)
+            if months:
+                return self._history_rows(conn, user_id, months, limit)
+            
+            cursor.execute('''
+                SELECT * FROM transactions 
+                WHERE user_id = ? 
+                ORDER BY created_at DESC 
+                LIMIT ?
+            ''', (user_id, limit))
+            transactions = cursor.fetchall()
         return transactions
     
+    def get_user_transactions_page(self, user_id, limit=5, after=None, before=None):
+        """Страница истории операций, от новых к старым.
+        
+        after - id последней строки предыдущей страницы (листаем к старым),
+        before - id первой строки (листаем к новым). Возвращает
+        (строки, курсор к новым, курсор к старым); курсор None - дальше пусто.
+        Если у пользователя есть операции в архиве, страница собирается из
+        основной таблицы и нужных месяцев архива.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            months = self._archived_months(cursor, user_id)
+            if months:
+                bound_id = before if before is not None else after
+                bound = None
+                if bound_id is not None:
+                    bound = self._transaction_bound(conn, bound_id, months)
+                    if bound is None:
+                        return [], None, None
+                rows = self._history_rows(conn, user_id, months, limit + 1, bound, older=before is None)
+                return self._page_cursors(rows, limit, after, before)
+        
+        return self._keyset_page('transactions', 'id', '*', 'user_id = ?', (user_id,), limit, after, before)
+    
+    def _keyset_page(self, table, key, columns, where, params, limit, after=None, before=None,
+                     oldest_first=False):
+        """Keyset-пагинация по (created_at, key), по умолчанию от новых к старым.
+        
+        Граница задается id строки, ее created_at читается по первичному
+        ключу, поэтому стоимость страницы не зависит от ее номера.
+        Курсоры в ответе - к предыдущей и следующей странице.
+        """
+        forward_op, forward_order = ('>', 'ASC') if oldest_first else ('<', 'DESC')
+        backward_op, backward_order = ('<', 'DESC') if oldest_first else ('>', 'ASC')
+        if before is not None:
+            bound, op, order = before, backward_op, backward_order
+        else:
+            bound, op, order = after, forward_op, forward_order
+        
+        sql = f'SELECT {columns} FROM {table} WHERE {where}'
+        if bound is not None:
+            sql += (
+                f' AND (created_at, {key}) {op} '
+                f'(SELECT created_at, {key} FROM {table} WHERE {key} = ?)'
+            )
+            params = params + (bound,)
+        sql += f' ORDER BY created_at {order}, {key} {order} LIMIT ?'
+        
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params + (limit + 1,))
+            rows = cursor.fetchall()
+        
+        return self._page_cursors(rows, limit, after, before)
+    
+    def _page_cursors(self, rows, limit, after, before):
+        """До limit + 1 строк в порядке выборки -> (страница, курсор назад, курсор вперед)"""
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if before is not None:
+            rows.reverse()
+            has_prev, has_next = more, True
+        else:
+            has_prev, has_next = after is not None, more
+        
+        if not rows:
+            return rows, None, None
+        return rows, rows[0][0] if has_prev else None, rows[-1][0] if has_next else None
+    
     def get_pending_withdrawals(self):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT w.*, u.username, u.user_id 
-            FROM withdrawals w
-            JOIN users u ON w.user_id = u.user_id
-            WHERE w.status = 'pending'
-            ORDER BY w.created_at
-        ''')
-        withdrawals = cursor.fetchall()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT w.*, u.username, u.user_id 
+                FROM withdrawals w
+                JOIN users u ON w.user_id = u.user_id
+                WHERE w.status = 'pending'
+                ORDER BY w.created_at
+            ''')
+            withdrawals = cursor.fetchall()
         return withdrawals
     
+    def get_pending_withdrawals_page(self, limit=8, after=None, before=None):
+        """Страница ожидающих заявок на вывод, от старых к новым (см. _keyset_page)"""
+        return self._keyset_page(
+            'withdrawals', 'id',
+            'id, transaction_id, user_id, amount, net_amount, payment_method, requisites, created_at',
+            "status = 'pending'", (), limit, after, before, oldest_first=True
+        )
+    
+    def bulk_update_transaction_status(self, trans_ids, status, admin_id=None):
+        """Сменить статус нескольких ожидающих заявок на вывод одной транзакцией.
+        
+        Уже обработанные заявки не трогаются. Возвращает число измененных.
+        """
+        with self.transaction() as cursor:
+            cursor.executemany('''
+                UPDATE transactions 
+                SET status = ?, admin_id = ?, completed_at = CURRENT_TIMESTAMP 
+                WHERE id = ? AND type = 'withdraw' AND status = 'pending'
+            ''', [(status, admin_id, trans_id) for trans_id in trans_ids])
+            changed = cursor.rowcount
+            
+            cursor.executemany('''
+                UPDATE withdrawals 
+                SET status = ?, processed_at = CURRENT_TIMESTAMP 
+                WHERE transaction_id = ? AND status = 'pending'
+            ''', [(status, trans_id) for trans_id in trans_ids])
+        
+        return changed
+    
     # ===== СТАТИСТИКА =====
     def get_bot_stats(self):
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        """Статистика из счетчиков bot_stats (поддерживаются триггерами)"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(
+                'SELECT {} FROM bot_stats WHERE id = 1'.format(', '.join(migrations.STATS_COLUMNS))
+            )
+            stats = dict(zip(migrations.STATS_COLUMNS, cursor.fetchone()))
+            for column in migrations.STATS_MONEY_COLUMNS:
+                stats[column] /= 100  # копейки -> рубли
+            
+            # Диапазон по индексу idx_users_last_active
+            cursor.execute("SELECT COUNT(*) FROM users WHERE last_active >= DATE('now')")
+            stats['active_today'] = cursor.fetchone()[0]
         
-        cursor.execute('SELECT COUNT(*) FROM users')
-        total_users = cursor.fetchone()[0]
+        return stats
+    
+    def rebuild_stats(self, fix=True):
+        """Пересчитать счетчики статистики с нуля.
         
-        cursor.execute('SELECT COUNT(*) FROM users WHERE DATE(last_active) = DATE("now")')
-        active_today = cursor.fetchone()[0]
+        Возвращает расхождения {счетчик: (сохранено, фактически)},
+        денежные счетчики - в копейках. Обороты операций, перенесенных в
+        архив, берутся из итогов каталога archives.
+        При fix=True сохраненные значения заменяются пересчитанными.
+        """
+        columns = migrations.STATS_COLUMNS
         
-        cursor.execute('SELECT SUM(balance) FROM users')
-        total_balance = cursor.fetchone()[0] or 0
+        with self.transaction() as cursor:
+            # Один снимок на чтение и запись, чтобы не потерять параллельные изменения
+            cursor.execute('SELECT {} FROM bot_stats WHERE id = 1'.format(', '.join(columns)))
+            stored = cursor.fetchone()
+            cursor.execute(migrations.STATS_RECOMPUTE_SQL)
+            actual = dict(zip(columns, cursor.fetchone()))
+            cursor.execute('SELECT COALESCE(SUM(deposits), 0), COALESCE(SUM(withdrawn), 0) FROM archives')
+            archived_deposits, archived_withdrawn = cursor.fetchone()
+            actual['total_deposits'] += archived_deposits
+            actual['total_withdrawals'] += archived_withdrawn
+            actual = tuple(actual[column] for column in columns)
+            
+            drift = {
+                column: (stored_value, actual_value)
+                for column, stored_value, actual_value in zip(columns, stored, actual)
+                if stored_value != actual_value
+            }
+            
+            if fix and drift:
+                cursor.execute(
+                    'UPDATE bot_stats SET {} WHERE id = 1'.format(', '.join(f'{c} = ?' for c in columns)),
+                    actual
+                )
         
-        cursor.execute('SELECT SUM(amount) FROM transactions WHERE type = "deposit" AND status = "completed"')
-        total_deposits = cursor.fetchone()[0] or 0
+        return drift
+    
+    # ===== АДМИН ФУНКЦИИ =====
+    def get_all_users(self, limit=100, offset=0):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT user_id, username, balance, created_at 
+                FROM users 
+                ORDER BY created_at DESC 
+                LIMIT ? OFFSET ?
+            ''', (limit, offset))
+            users = cursor.fetchall()
+        return users
+    
+    def get_users_page(self, limit=10, after=None, before=None):
+        """Страница списка пользователей, от новых к старым (см. _keyset_page)"""
+        return self._keyset_page(
+            'users', 'user_id', 'user_id, username, balance, created_at', '1', (), limit, after, before
+        )
+    
+    def update_transaction_status(self, trans_id, status, admin_id=None):
+        """Сменить статус операции.
         
-        cursor.execute('SELECT SUM(amount) FROM transactions WHERE type = "withdraw" AND status = "completed"')
-        total_withdrawals = cursor.fetchone()[0] or 0
+        Возвращает False, если операции нет в основной базе: она перенесена
+        в архив, а кнопка в старом сообщении админа осталась.
+        """
+        with self.transaction() as cursor:
+            cursor.execute('''
+                UPDATE transactions 
+                SET status = ?, admin_id = ?, completed_at = CURRENT_TIMESTAMP 
+                WHERE id = ?
+            ''', (status, admin_id, trans_id))
+            if not cursor.rowcount:
+                return False
+            
+            # Если это вывод, обновляем и таблицу withdrawals
+            cursor.execute('SELECT type FROM transactions WHERE id = ?', (trans_id,))
+            trans_type = cursor.fetchone()[0]
+            
+            if trans_type == 'withdraw':
+                cursor.execute('''
+                    UPDATE withdrawals 
+                    SET status = ?, processed_at = CURRENT_TIMESTAMP 
+                    WHERE transaction_id = ?
+                ''', (status, trans_id))
         
-        cursor.execute('SELECT COUNT(*) FROM transactions WHERE status = "pending"')
-        pending_transactions = cursor.fetchone()[0]
+        return True
+    
+    def search_users(self, query, limit=10, offset=0):
+        """Поиск пользователей по ID, username, имени и реферальному коду.
         
-        conn.close()
+        Сначала точные совпадения ID и реферального кода, затем username,
+        затем совпадения по подстроке (FTS5 trigram, без него - LIKE),
+        упорядоченные по релевантности.
+        """
+        query = query.strip().lstrip('@')
+        if not query:
+            return []
         
-        return {
-            'total_users': total_users,
-            'active_today': active_today,
-            'total_balance': total_balance,
-            'total_deposits': total_deposits,
-            'total_withdrawals': total_withdrawals,
-            'pending_transactions': pending_transactions
-        }
-    
-    # ===== АДМИН ФУНКЦИИ =====
-    def get_all_users(self, limit=100, offset=0):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT user_id, username, balance, created_at 
-            FROM users 
-            ORDER BY created_at DESC 
+        # (SQL, параметры): grp - группа ранжирования, score - релевантность
+        # внутри группы; чем меньше, тем выше
+        parts = [
+            ("SELECT user_id, 0 AS grp, 0.0 AS score FROM users WHERE referral_id = ?", (query,)),
+            ("SELECT user_id, 1, 0.0 FROM users WHERE username = ? COLLATE NOCASE", (query,)),
+        ]
+        if query.isdigit():
+            parts.append(("SELECT user_id, 0, 0.0 FROM users WHERE user_id = ?", (int(query),)))
+        
+        if self.has_search_index:
+            # Триграммам нужно не меньше трех символов
+            if len(query) >= 3:
+                phrase = '"{}"'.format(query.replace('"', '""'))
+                parts.append(("SELECT rowid, 2, rank FROM users_fts WHERE users_fts MATCH ?", (phrase,)))
+        else:
+            like = f"%{query}%"
+            parts.append((
+                "SELECT user_id, 2, 0.0 FROM users "
+                "WHERE username LIKE ? OR first_name LIKE ? OR last_name LIKE ?",
+                (like, like, like)
+            ))
+        
+        sql = '''
+            SELECT u.* FROM ({}) m
+            JOIN users u ON u.user_id = m.user_id
+            GROUP BY m.user_id
+            ORDER BY MIN(m.grp), MIN(m.score), m.user_id
             LIMIT ? OFFSET ?
-        ''', (limit, offset))
-        users = cursor.fetchall()
-        conn.close()
+        '''.format(' UNION ALL '.join(part_sql for part_sql, _ in parts))
+        params = tuple(p for _, part_params in parts for p in part_params) + (limit, offset)
+        
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            users = cursor.fetchall()
         return users
     
-    def update_transaction_status(self, trans_id, status, admin_id=None):
-        conn = self.get_connection()
+    def rebuild_search_index(self):
+        """Перестроить users_fts по таблице users (после массовой загрузки)"""
+        if not self.has_search_index:
+            return False
+        with self.transaction() as cursor:
+            cursor.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+        return True
+
+
+    # ===== АРХИВ =====
+    def archive_path(self, month):
+        return os.path.join(self.archive_dir, f'{month}.db')
+    
+    def _archived_months(self, cursor, user_id):
+        """Месяцы архива с операциями пользователя, от новых к старым"""
+        cursor.execute(
+            'SELECT month FROM archived_user_months WHERE user_id = ? ORDER BY month DESC', (user_id,)
+        )
+        return [row[0] for row in cursor.fetchall()]
+    
+    def _history_rows(self, conn, user_id, months, count, bound=None, older=True):
+        """count операций пользователя по обе стороны архива, ближайших к bound.
+        
+        bound - (created_at, id) границы, older - в сторону старых (от новых
+        к старым) или новых (от старых к новым). Основная таблица читается
+        всегда (в ней остаются старые ожидающие операции), месяц архива -
+        только если его строки могут попасть в первые count.
+        """
+        op, order = ('<', 'DESC') if older else ('>', 'ASC')
+        where, params = 'user_id = ?', (user_id,)
+        if bound is not None:
+            where += f' AND (created_at, id) {op} (?, ?)'
+            params += tuple(bound)
+        sql = (
+            f"SELECT {', '.join(archive.TRANSACTION_COLUMNS)} FROM {{}}transactions WHERE {where} "
+            f"ORDER BY created_at {order}, id {order} LIMIT ?"
+        )
+        created = archive.TRANSACTION_COLUMNS.index('created_at')
+        
         cursor = conn.cursor()
+        cursor.execute(sql.format(''), params + (count,))
+        rows = cursor.fetchall()
         
-        cursor.execute('''
-            UPDATE transactions 
-            SET status = ?, admin_id = ?, completed_at = CURRENT_TIMESTAMP 
-            WHERE id = ?
-        ''', (status, admin_id, trans_id))
+        for month in (months if older else reversed(months)):
+            if len(rows) >= count:
+                edge = rows[count - 1][created]
+                # Все строки месяца дальше уже набранных
+                if older and edge >= archive.month_end(month) or not older and edge < archive.month_start(month):
+                    break
+            try:
+                with archive.attached(conn, self.archive_path(month)):
+                    cursor.execute(sql.format('archive.'), params + (count,))
+                    rows.extend(cursor.fetchall())
+            except FileNotFoundError as e:
+                logger.warning(f"Нет файла архива {e}")
+                continue
+            rows.sort(key=lambda row: (row[created], row[0]), reverse=older)
+            del rows[count:]
+        return rows
+    
+    def _transaction_bound(self, conn, trans_id, months):
+        """(created_at, id) операции-курсора из основной таблицы или архива"""
+        cursor = conn.cursor()
+        cursor.execute('SELECT created_at, id FROM transactions WHERE id = ?', (trans_id,))
+        row = cursor.fetchone()
+        for month in months:
+            if row is not None:
+                break
+            try:
+                with archive.attached(conn, self.archive_path(month)):
+                    cursor.execute('SELECT created_at, id FROM archive.transactions WHERE id = ?', (trans_id,))
+                    row = cursor.fetchone()
+            except FileNotFoundError:
+                continue
+        return row
+    
+    def archive_transactions(self, before, limit=None):
+        """Перенести в архив до limit завершенных операций старше before.
+        
+        Вместе с операциями переносятся их заявки на вывод. Возвращает число
+        перенесенных операций; 0 - переносить больше нечего.
+        """
+        limit = limit or config.ARCHIVE_BATCH
+        statuses = ', '.join(f"'{status}'" for status in archive.FINAL_STATUSES)
         
-        # Если это вывод, обновляем и таблицу withdrawals
-        cursor.execute('SELECT type FROM transactions WHERE id = ?', (trans_id,))
-        trans_type = cursor.fetchone()[0]
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT id, created_at FROM transactions 
+                WHERE status IN ({statuses}) AND created_at < ? 
+                LIMIT ?
+            ''', (before, limit))
+            by_month = {}
+            for trans_id, created_at in cursor.fetchall():
+                by_month.setdefault(archive.month_of(created_at), []).append((trans_id,))
+            
+            if by_month:
+                os.makedirs(self.archive_dir, exist_ok=True)
+                cursor.execute('CREATE TEMP TABLE IF NOT EXISTS archive_batch (id INTEGER PRIMARY KEY)')
+            
+            moved = 0
+            for month, ids in sorted(by_month.items()):
+                moved += self._archive_month(conn, month, ids)
+        return moved
+    
+    def _archive_month(self, conn, month, ids):
+        transaction_columns = ', '.join(archive.TRANSACTION_COLUMNS)
+        withdrawal_columns = ', '.join(archive.WITHDRAWAL_COLUMNS)
+        statuses = ', '.join(f"'{status}'" for status in archive.FINAL_STATUSES)
         
-        if trans_type == 'withdraw':
+        with archive.attached(conn, self.archive_path(month), create=True):
+            cursor = conn.cursor()
+            
+            # Шаг 1: копия в архиве; транзакция пишет только в файл архива.
+            # REPLACE обновляет копию, оставшуюся от прерванного переноса
+            cursor.execute('BEGIN')
+            cursor.execute('DELETE FROM temp.archive_batch')
+            cursor.executemany('INSERT INTO temp.archive_batch (id) VALUES (?)', ids)
+            cursor.execute(f'''
+                INSERT OR REPLACE INTO archive.transactions ({transaction_columns}) 
+                SELECT {transaction_columns} FROM main.transactions 
+                WHERE id IN (SELECT id FROM temp.archive_batch)
+            ''')
+            cursor.execute(f'''
+                INSERT OR REPLACE INTO archive.withdrawals ({withdrawal_columns}) 
+                SELECT {withdrawal_columns} FROM main.withdrawals 
+                WHERE transaction_id IN (SELECT id FROM temp.archive_batch)
+            ''')
+            conn.commit()
+            
+            # Шаг 2: удаление из основной базы и учет в каталоге
+            cursor.execute('BEGIN IMMEDIATE')
+            # Между шагами статус мог смениться (update_transaction_status):
+            # такие операции остаются в основной базе, их копии удаляются
+            # из архива, следующий запуск перенесет их заново
+            cursor.execute(f'''
+                SELECT id FROM main.transactions 
+                WHERE id IN (SELECT id FROM temp.archive_batch) AND status NOT IN ({statuses}) 
+                UNION 
+                SELECT id FROM (
+                    SELECT {transaction_columns} FROM main.transactions 
+                    WHERE id IN (SELECT id FROM temp.archive_batch) 
+                    EXCEPT 
+                    SELECT {transaction_columns} FROM archive.transactions 
+                    WHERE id IN (SELECT id FROM temp.archive_batch)
+                ) 
+                UNION 
+                SELECT transaction_id FROM (
+                    SELECT {withdrawal_columns} FROM main.withdrawals 
+                    WHERE transaction_id IN (SELECT id FROM temp.archive_batch) 
+                    EXCEPT 
+                    SELECT {withdrawal_columns} FROM archive.withdrawals 
+                    WHERE transaction_id IN (SELECT id FROM temp.archive_batch)
+                )
+            ''')
+            changed = cursor.fetchall()
+            if changed:
+                cursor.executemany('DELETE FROM temp.archive_batch WHERE id = ?', changed)
+                cursor.executemany('DELETE FROM archive.transactions WHERE id = ?', changed)
+                cursor.executemany('DELETE FROM archive.withdrawals WHERE transaction_id = ?', changed)
             cursor.execute('''
-                UPDATE withdrawals 
-                SET status = ?, processed_at = CURRENT_TIMESTAMP 
-                WHERE transaction_id = ?
-            ''', (status, trans_id))
+                SELECT 
+                    COUNT(*),
+                    COALESCE(SUM(CASE WHEN type = 'deposit' AND status = 'completed' 
+                        THEN CAST(ROUND(amount * 100) AS INTEGER) ELSE 0 END), 0),
+                    COALESCE(SUM(CASE WHEN type = 'withdraw' AND status = 'completed' 
+                        THEN CAST(ROUND(amount * 100) AS INTEGER) ELSE 0 END), 0)
+                FROM main.transactions 
+                WHERE id IN (SELECT id FROM temp.archive_batch)
+            ''')
+            moved, deposits, withdrawn = cursor.fetchone()
+            cursor.execute('''
+                INSERT OR IGNORE INTO archived_user_months (user_id, month) 
+                SELECT DISTINCT user_id, ? FROM main.transactions 
+                WHERE id IN (SELECT id FROM temp.archive_batch)
+            ''', (month,))
+            cursor.execute('''
+                DELETE FROM main.withdrawals 
+                WHERE transaction_id IN (SELECT id FROM temp.archive_batch)
+            ''')
+            withdrawals = cursor.rowcount
+            # Триггеров на удаление нет: счетчики bot_stats не меняются
+            cursor.execute('DELETE FROM main.transactions WHERE id IN (SELECT id FROM temp.archive_batch)')
+            cursor.execute('''
+                INSERT INTO archives (month, transactions, withdrawals, deposits, withdrawn) 
+                VALUES (?, ?, ?, ?, ?) 
+                ON CONFLICT (month) DO UPDATE SET 
+                    transactions = transactions + excluded.transactions, 
+                    withdrawals = withdrawals + excluded.withdrawals, 
+                    deposits = deposits + excluded.deposits, 
+                    withdrawn = withdrawn + excluded.withdrawn, 
+                    updated_at = CURRENT_TIMESTAMP
+            ''', (month, moved, withdrawals, deposits, withdrawn))
+            cursor.execute('DELETE FROM temp.archive_batch')
+            conn.commit()
         
-        conn.commit()
-        conn.close()
+        return moved
     
-    def search_users(self, query):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT * FROM users 
-            WHERE user_id = ? OR username LIKE ? OR referral_id = ?
-        ''', (query if query.isdigit() else 0, f"%{query}%", query))
+    def get_archives(self):
+        """Каталог архива: [(месяц, операций, заявок на вывод, обновлен)]"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT month, transactions, withdrawals, updated_at FROM archives ORDER BY month')
+            archives = cursor.fetchall()
+        return archives
+    
+    
+    # ===== ВЫГРУЗКА =====
+    def open_export(self, table, status=None, date_from=None, date_to=None):
+        """Потоковая выгрузка таблицы (см. Export).
         
-        users = cursor.fetchall()
-        conn.close()
-        return users
+        status - точное значение (для transactions и withdrawals), date_from
+        и date_to - границы created_at [from, to). ValueError - неизвестная
+        таблица или статус.
+        """
+        if table not in EXPORT_TABLES:
+            raise ValueError(f"таблица: одна из {', '.join(EXPORT_TABLES)}")
+        statuses = EXPORT_TABLES[table][2]
+        if status is not None and status not in statuses:
+            raise ValueError(f"статус: один из {', '.join(statuses)}" if statuses else "статус не поддерживается")
+        return Export(self, table, status, date_from, date_to)
+
+
+    # ===== РАССЫЛКИ =====
+    def count_users(self):
+        """Число получателей рассылки: тот же фильтр, что в get_user_ids_after"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            # Заблокированные не получают рассылку, поэтому счетчик total_users не подходит;
+            # COUNT читает узкий частичный индекс idx_users_recipients
+            cursor.execute('SELECT COUNT(*) FROM users WHERE is_banned = 0')
+            total = cursor.fetchone()[0]
+        return total
+    
+    def get_user_ids_after(self, last_user_id, limit):
+        """Следующая пачка получателей по курсору user_id (без OFFSET)"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT user_id FROM users 
+                WHERE user_id > ? AND is_banned = 0 
+                ORDER BY user_id 
+                LIMIT ?
+            ''', (last_user_id, limit))
+            user_ids = [row[0] for row in cursor.fetchall()]
+        return user_ids
+    
+    def create_broadcast(self, admin_id, from_chat_id, message_id, text, total, progress_message_id):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO broadcasts 
+                (admin_id, from_chat_id, message_id, text, total, progress_message_id) 
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (admin_id, from_chat_id, message_id, text, total, progress_message_id))
+            broadcast_id = cursor.lastrowid
+            conn.commit()
+        return broadcast_id
+    
+    def get_broadcast(self, broadcast_id):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, admin_id, from_chat_id, message_id, text, status, 
+                       last_user_id, sent, failed, total, progress_message_id 
+                FROM broadcasts WHERE id = ?
+            ''', (broadcast_id,))
+            broadcast = cursor.fetchone()
+        return broadcast
+    
+    def get_unfinished_broadcasts(self):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id FROM broadcasts WHERE status = 'running' ORDER BY id")
+            broadcasts = cursor.fetchall()
+        return broadcasts
+    
+    def update_broadcast_progress(self, broadcast_id, last_user_id, sent, failed, status=None):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE broadcasts 
+                SET last_user_id = ?, sent = ?, failed = ?, 
+                    status = COALESCE(?, status), 
+                    updated_at = CURRENT_TIMESTAMP 
+                WHERE id = ?
+            ''', (last_user_id, sent, failed, status, broadcast_id))
+            conn.commit()
+    
+    # ===== СОСТОЯНИЯ FSM =====
+    def fsm_load(self, chat, user):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT state, data, bucket, updated_at 
+                FROM fsm_storage 
+                WHERE chat = ? AND user = ?
+            ''', (chat, user))
+            row = cursor.fetchone()
+        return row
+    
+    def fsm_save(self, rows, deleted=()):
+        """Сохранить пачку состояний и удалить опустевшие одним коммитом"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if rows:
+                cursor.executemany('''
+                    INSERT OR REPLACE INTO fsm_storage 
+                    (chat, user, state, data, bucket, updated_at) 
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', rows)
+            if deleted:
+                cursor.executemany('DELETE FROM fsm_storage WHERE chat = ? AND user = ?', deleted)
+            conn.commit()
+    
+    def fsm_delete_expired(self, before):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM fsm_storage WHERE updated_at < ?', (before,))
+            removed = cursor.rowcount
+            conn.commit()
+        return removed
+
+
+class Export:
+    """Чтение строк выгрузки пачками курсором SQLite.
+
+    Отдельное соединение только для чтения, не из пула: долгая выгрузка не
+    занимает соединения обработчиков. Условия по status и created_at
+    обслуживаются индексами, а порядок (created_at, ключ) совпадает с
+    порядком индекса, поэтому SQLite не сортирует и не накапливает строки -
+    память не зависит от размера таблицы. Сначала идут подходящие по датам
+    месяцы архива (файл подключается на время чтения), затем основная таблица.
+    """
+
+    def __init__(self, database, table, status=None, date_from=None, date_to=None):
+        columns, key, _ = EXPORT_TABLES[table]
+
+        where, params = [], []
+        if status is not None:
+            where.append('status = ?')
+            params.append(status)
+        if date_from is not None:
+            where.append('created_at >= ?')
+            params.append(date_from)
+        if date_to is not None:
+            where.append('created_at < ?')
+            params.append(date_to)
+        self._sql = (
+            f"SELECT {', '.join(columns)} FROM {{}}{table} WHERE {' AND '.join(where) or '1'} "
+            f"ORDER BY created_at, {key}"
+        )
+        self._params = tuple(params)
+
+        self._conn = sqlite3.connect(database.db_name, timeout=database.pool.timeout, check_same_thread=False)
+        self._conn.execute('PRAGMA query_only = ON')
+
+        # Ожидающие операции в архив не попадают
+        months = []
+        if table != 'users' and (status is None or status in archive.FINAL_STATUSES):
+            months = [
+                row[0] for row in self._conn.execute('SELECT month FROM archives ORDER BY month')
+                if (date_from is None or archive.month_end(row[0]) > date_from)
+                and (date_to is None or archive.month_start(row[0]) < date_to)
+            ]
+        self._sources = [database.archive_path(month) for month in months] + [None]
+        self._cursor = None
+        self._attached = False
+
+    def _open(self, path):
+        prefix = ''
+        if path is not None:
+            if not os.path.exists(path):
+                logger.warning(f"Нет файла архива {path}, месяц пропущен в выгрузке")
+                return
+            self._conn.execute('ATTACH DATABASE ? AS archive', (path,))
+            self._attached = True
+            prefix = 'archive.'
+        self._cursor = self._conn.execute(self._sql.format(prefix), self._params)
+
+    def _close_source(self):
+        if self._cursor is not None:
+            self._cursor.close()
+            self._cursor = None
+        if self._attached:
+            self._conn.execute('DETACH DATABASE archive')
+            self._attached = False
+
+    def fetchmany(self, size):
+        """Следующие до size строк; пустой список - выгрузка закончена"""
+        while self._sources or self._cursor is not None:
+            if self._cursor is None:
+                self._open(self._sources.pop(0))
+                continue
+            rows = self._cursor.fetchmany(size)
+            if rows:
+                return rows
+            self._close_source()
+        return []
+
+    def close(self):
+        self._sources = []
+        self._close_source()
+        self._conn.close()
+
+
+class WriteBatcher:
+    """Групповой коммит записей из параллельных обработчиков.
+
+    Операции копятся window секунд или до max_size штук и выполняются в
+    одной транзакции SQLite, каждая в своем SAVEPOINT (ошибка одной не
+    откатывает остальные). Одновременно коммитится не больше одного пакета:
+    пока он пишется, следующий набирается. Вызывающий получает результат
+    своей операции после коммита всего пакета.
+    """
+
+    def __init__(self, database, executor, window=None, max_size=None):
+        self.database = database
+        self.executor = executor
+        self.window = window if window is not None else config.DB_BATCH_WINDOW_MS / 1000
+        self.max_size = max_size or config.DB_BATCH_MAX_SIZE
+        self._pending = []
+        self._timer = None
+        self._inflight = False
+        self.batches = 0
+        self.operations = 0
+
+    async def submit(self, method, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((method, args, kwargs, future))
+
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None and not self._inflight:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._inflight or not self._pending:
+            return
+
+        batch, self._pending = self._pending[:self.max_size], self._pending[self.max_size:]
+        self._inflight = True
+        loop = asyncio.get_running_loop()
+        commit = loop.run_in_executor(self.executor, self._commit, batch)
+        commit.add_done_callback(lambda done: self._committed(batch, done))
+
+    def _commit(self, batch):
+        """Выполнить пакет в потоке пула; вернуть [(результат, исключение)]"""
+        results = []
+        with self.database.transaction():
+            for method, args, kwargs, future in batch:
+                try:
+                    results.append((method(*args, **kwargs), None))
+                except Exception as e:
+                    results.append((None, e))
+        return results
+
+    def _committed(self, batch, done):
+        self._inflight = False
+        self.batches += 1
+        self.operations += len(batch)
+
+        error = done.exception()
+        results = done.result() if error is None else [(None, error)] * len(batch)
+        for (method, args, kwargs, future), (result, exception) in zip(batch, results):
+            if future.cancelled():
+                continue
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+
+        # Накопившееся за время коммита уходит следующим пакетом сразу
+        if self._pending:
+            self._flush()
+
+
+class AsyncDatabase:
+    """Асинхронный доступ к Database без блокировки event loop.
+
+    Каждый публичный метод Database доступен как корутина с той же сигнатурой
+    и выполняется в ограниченном пуле потоков, поэтому медленный fsync одного
+    запроса не задерживает обработку обновлений остальных пользователей.
+    """
+
+    # Записи, которые при включенном DB_BATCH_WRITES идут через групповой коммит
+    BATCHED_METHODS = frozenset({
+        'create_user', 'update_balance', 'create_transaction',
+        'create_withdrawal', 'update_transaction_status',
+    })
+
+    def __init__(self, database, max_workers=None, batch_writes=None):
+        self.sync = database
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or config.DB_EXECUTOR_WORKERS,
+            thread_name_prefix='db'
+        )
+        if batch_writes is None:
+            batch_writes = config.DB_BATCH_WRITES
+        self.batcher = WriteBatcher(database, self._executor) if batch_writes else None
+
+        self._fetch_user = database._fetch_user
+        if database.tracer is not None:
+            self._fetch_user = database.tracer.wrap_method('get_user', self._fetch_user)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        method = getattr(self.sync, name)
+        if not callable(method):
+            return method
+        if self.sync.tracer is not None:
+            method = self.sync.tracer.wrap_method(name, method)
+
+        if self.batcher is not None and name in self.BATCHED_METHODS:
+            @functools.wraps(method)
+            async def call(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await self.batcher.submit(method, *args, **kwargs)
+                finally:
+                    metrics.DB_DURATION.observe(time.perf_counter() - started, name)
+        else:
+            @functools.wraps(method)
+            async def call(*args, **kwargs):
+                started = time.perf_counter()
+                loop = asyncio.get_running_loop()
+                try:
+                    return await loop.run_in_executor(self._executor, functools.partial(method, *args, **kwargs))
+                finally:
+                    metrics.DB_DURATION.observe(time.perf_counter() - started, name)
+
+        # Кешируем обертку, чтобы __getattr__ вызывался только один раз на метод
+        setattr(self, name, call)
+        return call
+
+    async def get_user(self, user_id):
+        # Попадание в кеш обслуживается без перехода в пул потоков
+        started = time.perf_counter()
+        user = self.sync.user_cache.get(user_id)
+        if user is None:
+            loop = asyncio.get_running_loop()
+            user = await loop.run_in_executor(self._executor, self._fetch_user, user_id)
+        metrics.DB_DURATION.observe(time.perf_counter() - started, 'get_user')
+        return user
+
+    async def export(self, table, batch_size=None, **filters):
+        """Асинхронный генератор пачек строк выгрузки (см. Database.open_export).
+
+        Каждая пачка читается отдельным вызовом в пуле потоков; генератор
+        нужно закрыть (aclose), если выгрузка прервана.
+        """
+        batch_size = batch_size or config.EXPORT_BATCH
+        loop = asyncio.get_running_loop()
+        export = await loop.run_in_executor(
+            self._executor, functools.partial(self.sync.open_export, table, **filters)
+        )
+        try:
+            while True:
+                rows = await loop.run_in_executor(self._executor, export.fetchmany, batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            await loop.run_in_executor(self._executor, export.close)
+
+    def close(self):
+        """Дождаться завершения запросов, остановить пул потоков и закрыть соединения"""
+        self._executor.shutdown(wait=True)
+        self.sync.close()
@@ -0,0 +1,227 @@
+"""Параллельная обработка обновлений с сохранением порядка для пользователя.
+
+Обновления раскладываются по N воркерам по хешу from_user.id: шаги одного
+диалога (например, сумма вывода -> реквизиты) выполняются строго по очереди,
+а разные пользователи обслуживаются параллельно. Очереди воркеров
+ограничены, поэтому при перегрузке submit() ждет (backpressure).
+
+Все обновления попадают в очереди из одной точки: в long polling цикл
+сам ставит пакет в очереди и только потом запрашивает следующий
+getUpdates. В aiogram каждый пакет обрабатывается отдельной задачей, и
+пока пакет N ждал места в полной очереди, пакет N+1 мог поставить более
+позднее обновление того же пользователя раньше, а опрос продолжался бы
+без ограничения.
+"""
+import asyncio
+import logging
+import time
+
+import aiohttp
+from aiogram import Bot, Dispatcher
+from aiohttp.helpers import sentinel
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Поля Update, в которых есть отправитель (from_user или user)
+UPDATE_FIELDS = (
+    'message', 'edited_message', 'callback_query', 'inline_query',
+    'chosen_inline_result', 'shipping_query', 'pre_checkout_query',
+    'poll_answer', 'my_chat_member', 'chat_member', 'chat_join_request',
+    'channel_post', 'edited_channel_post',
+)
+
+
+def update_user_key(update):
+    """Ключ очередности: id пользователя, иначе id чата, иначе update_id"""
+    for field in UPDATE_FIELDS:
+        event = getattr(update, field, None)
+        if event is None:
+            continue
+        user = getattr(event, 'from_user', None) or getattr(event, 'user', None)
+        if user is not None:
+            return user.id
+        chat = getattr(event, 'chat', None)
+        if chat is not None:
+            return chat.id
+    return update.update_id
+
+
+class WorkerStats:
+    __slots__ = ('processed', 'errors', 'max_depth', 'busy_time', 'wait_time')
+
+    def __init__(self):
+        self.processed = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.busy_time = 0.0
+        self.wait_time = 0.0
+
+
+class ShardedDispatcher:
+    """N воркеров, у каждого своя ограниченная очередь.
+
+    handler - корутина-функция, принимающая одно обновление; key - функция,
+    возвращающая ключ очередности (обновления с одинаковым ключом всегда
+    попадают к одному воркеру).
+    """
+
+    def __init__(self, handler, workers=None, queue_size=None, key=update_user_key):
+        self.handler = handler
+        self.workers = workers or config.DISPATCH_WORKERS
+        self.queue_size = queue_size or config.DISPATCH_QUEUE_SIZE
+        self.key = key
+        self.stats = [WorkerStats() for _ in range(self.workers)]
+        self._queues = None
+        self._tasks = []
+
+    def start(self):
+        # Очереди создаются внутри работающего event loop
+        if self._queues is not None:
+            return
+        self._queues = [asyncio.Queue(self.queue_size) for _ in range(self.workers)]
+        self._tasks = [
+            asyncio.get_running_loop().create_task(self._worker(index))
+            for index in range(self.workers)
+        ]
+
+    def shard_for(self, update):
+        return hash(self.key(update)) % self.workers
+
+    async def submit(self, update):
+        """Поставить обновление в очередь; ждет, если очередь воркера полна"""
+        self.start()
+        index = self.shard_for(update)
+        queue = self._queues[index]
+        await queue.put((time.perf_counter(), update))
+
+        stats = self.stats[index]
+        if queue.qsize() > stats.max_depth:
+            stats.max_depth = queue.qsize()
+
+    async def _worker(self, index):
+        queue = self._queues[index]
+        stats = self.stats[index]
+        while True:
+            queued_at, update = await queue.get()
+            started = time.perf_counter()
+            stats.wait_time += started - queued_at
+            try:
+                await self.handler(update)
+            except Exception:
+                stats.errors += 1
+                logger.exception(f"Ошибка обработки обновления в воркере {index}")
+            finally:
+                stats.processed += 1
+                stats.busy_time += time.perf_counter() - started
+                queue.task_done()
+
+    async def stop(self, drain=True):
+        """Остановить воркеры, по умолчанию дождавшись обработки очередей"""
+        if self._queues is None:
+            return
+        if drain:
+            await asyncio.gather(*(queue.join() for queue in self._queues))
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._queues = None
+        self._tasks = []
+
+    def dead_workers(self):
+        """Номера воркеров, чьи задачи завершились (воркер сам не выходит)"""
+        return [index for index, task in enumerate(self._tasks) if task.done()]
+
+    def metrics(self):
+        """Состояние воркеров: глубина очереди и накопленные счетчики"""
+        return [
+            {
+                'worker': index,
+                'depth': self._queues[index].qsize() if self._queues else 0,
+                'max_depth': stats.max_depth,
+                'processed': stats.processed,
+                'errors': stats.errors,
+                'busy_time': stats.busy_time,
+                'wait_time': stats.wait_time,
+            }
+            for index, stats in enumerate(self.stats)
+        ]
+
+
+class OrderedDispatcher(Dispatcher):
+    """Dispatcher, который обрабатывает пакеты обновлений через ShardedDispatcher.
+
+    Используется и в long polling (start_polling ставит пакет в очереди
+    сам, до следующего getUpdates), и в webhook (server.webhook_handler
+    вызывает shards.submit).
+    """
+
+    def __init__(self, *args, workers=None, queue_size=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.shards = ShardedDispatcher(self._process_in_worker, workers, queue_size)
+
+    async def _process_in_worker(self, update):
+        Bot.set_current(self.bot)
+        Dispatcher.set_current(self)
+        # Отдельная задача - отдельная копия контекста: aiogram кеширует
+        # в contextvars состояние FSM (StateFilter.ctx_state) и объекты
+        # обновления, и без копии они переходили бы к следующим обновлениям.
+        # Через updates_handler, как в Dispatcher.process_updates, - чтобы
+        # срабатывали middleware уровня update
+        await asyncio.get_running_loop().create_task(self.updates_handler.notify(update))
+
+    async def process_updates(self, updates, fast=True):
+        for update in updates:
+            await self.shards.submit(update)
+        return []
+
+    async def start_polling(self, timeout=20, relax=0.1, limit=None, reset_webhook=None,
+                            fast=True, error_sleep=5, allowed_updates=None):
+        """Long polling, как в Dispatcher.start_polling, но без задачи на пакет.
+
+        Пакет ставится в очереди воркеров в самом цикле опроса: следующий
+        getUpdates уходит, только когда все обновления пакета приняты, -
+        порядок обновлений сохраняется, а полные очереди тормозят опрос.
+        """
+        if self._polling:
+            raise RuntimeError('Polling already started')
+
+        logger.info("Запуск polling")
+        Dispatcher.set_current(self)
+        Bot.set_current(self.bot)
+
+        if reset_webhook is None:
+            await self.reset_webhook(check=False)
+        if reset_webhook:
+            await self.reset_webhook(check=True)
+
+        self._polling = True
+        offset = None
+        try:
+            request_timeout = None
+            if self.bot.timeout is not sentinel and timeout is not None:
+                request_timeout = aiohttp.ClientTimeout(total=self.bot.timeout.total + timeout or 1)
+
+            while self._polling:
+                try:
+                    with self.bot.request_timeout(request_timeout):
+                        updates = await self.bot.get_updates(
+                            limit=limit, offset=offset, timeout=timeout, allowed_updates=allowed_updates
+                        )
+                except asyncio.CancelledError:
+                    break
+                except Exception:
+                    logger.exception("Ошибка получения обновлений")
+                    await asyncio.sleep(error_sleep)
+                    continue
+
+                if updates:
+                    offset = updates[-1].update_id + 1
+                    await self.process_updates(updates, fast)
+
+                if relax:
+                    await asyncio.sleep(relax)
+        finally:
+            self._close_waiter.set_result(None)
+            logger.warning("Polling остановлен")
@@ -0,0 +1,227 @@
+"""Хранилище состояний FSM в SQLite вместо MemoryStorage.
+
+Состояния переживают перезапуск процесса. Последние активные диалоги
+держатся в ограниченном кеше в памяти, изменения записываются в базу
+пачками в фоне (write-behind), а брошенные диалоги удаляются по TTL.
+"""
+import asyncio
+import copy
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram.dispatcher.storage import BaseStorage
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM storage поверх Database.
+
+    db - AsyncDatabase. Изменения попадают в базу не позже чем через
+    flush_interval секунд или сразу при накоплении flush_batch изменений;
+    close() сбрасывает все несохраненное.
+    """
+
+    def __init__(self, db, hot_size=None, ttl=None, flush_interval=None, flush_batch=None, sweep_interval=None):
+        self.db = db
+        self.hot_size = hot_size or config.FSM_HOT_SIZE
+        self.ttl = ttl or config.FSM_TTL
+        self.flush_interval = flush_interval or config.FSM_FLUSH_INTERVAL
+        self.flush_batch = flush_batch or config.FSM_FLUSH_BATCH
+        self.sweep_interval = sweep_interval or config.FSM_SWEEP_INTERVAL
+
+        # (chat, user) -> {'state', 'data', 'bucket', 'touched'}
+        self._hot = OrderedDict()
+        # Измененные, но еще не записанные в базу записи
+        self._dirty = {}
+        # Создаются при первом изменении, уже внутри работающего event loop
+        self._flush_requested = None
+        self._worker = None
+        self._last_sweep = time.time()
+        self._closed = False
+
+    # ===== ВНУТРЕННЕЕ =====
+    def _key(self, chat, user):
+        chat, user = self.check_address(chat=chat, user=user)
+        return str(chat), str(user)
+
+    def _is_expired(self, record, now):
+        return record['touched'] < now - self.ttl
+
+    async def _record(self, chat, user):
+        key = self._key(chat, user)
+        now = time.time()
+
+        record = self._hot.get(key) or self._dirty.get(key)
+        if record is None:
+            row = await self.db.fsm_load(*key)
+            # Пока ждали базу, запись могла появиться
+            record = self._hot.get(key) or self._dirty.get(key)
+            if record is None:
+                if row is not None and row[3] >= now - self.ttl:
+                    state, data, bucket, touched = row
+                    record = {
+                        'state': state,
+                        'data': json.loads(data) if data else {},
+                        'bucket': json.loads(bucket) if bucket else {},
+                        'touched': touched,
+                    }
+                else:
+                    record = {'state': None, 'data': {}, 'bucket': {}, 'touched': now}
+
+        if self._is_expired(record, now):
+            record.update(state=None, data={}, bucket={})
+            self._mark_dirty(key, record)
+
+        record['touched'] = now
+        self._hot[key] = record
+        self._hot.move_to_end(key)
+        self._evict()
+        return key, record
+
+    def _evict(self):
+        # Несохраненные записи остаются в _dirty до ближайшего сброса
+        while len(self._hot) > self.hot_size:
+            self._hot.popitem(last=False)
+
+    def _mark_dirty(self, key, record):
+        self._dirty[key] = record
+        self._ensure_worker()
+        if len(self._dirty) >= self.flush_batch and self._flush_requested is not None:
+            self._flush_requested.set()
+
+    def _ensure_worker(self):
+        if self._worker is None and not self._closed:
+            self._flush_requested = asyncio.Event()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+
+            try:
+                await self.flush()
+                if time.time() - self._last_sweep >= self.sweep_interval:
+                    await self.sweep()
+            except Exception:
+                logger.exception("Ошибка сохранения состояний FSM")
+
+    async def flush(self):
+        """Записать накопленные изменения одной транзакцией"""
+        if not self._dirty:
+            return
+
+        dirty, self._dirty = self._dirty, {}
+        rows, deleted = [], []
+        for (chat, user), record in dirty.items():
+            if record['state'] is None and not record['data'] and not record['bucket']:
+                deleted.append((chat, user))
+            else:
+                rows.append((
+                    chat, user, record['state'],
+                    json.dumps(record['data'], ensure_ascii=False),
+                    json.dumps(record['bucket'], ensure_ascii=False),
+                    record['touched'],
+                ))
+
+        try:
+            await self.db.fsm_save(rows, deleted)
+        except Exception:
+            # Вернуть несохраненное, не затирая более свежие изменения
+            for key, record in dirty.items():
+                self._dirty.setdefault(key, record)
+            raise
+
+    async def sweep(self):
+        """Удалить диалоги, неактивные дольше TTL"""
+        now = time.time()
+        self._last_sweep = now
+        for key in [key for key, record in self._hot.items() if self._is_expired(record, now)]:
+            if key not in self._dirty:
+                del self._hot[key]
+        removed = await self.db.fsm_delete_expired(now - self.ttl)
+        if removed:
+            logger.info(f"Удалено брошенных диалогов FSM: {removed}")
+
+    # ===== BaseStorage =====
+    async def get_state(self, *, chat=None, user=None, default=None):
+        key, record = await self._record(chat, user)
+        return record['state'] if record['state'] is not None else self.resolve_state(default)
+
+    async def get_data(self, *, chat=None, user=None, default=None):
+        key, record = await self._record(chat, user)
+        return copy.deepcopy(record['data'])
+
+    async def set_state(self, *, chat=None, user=None, state=None):
+        key, record = await self._record(chat, user)
+        record['state'] = self.resolve_state(state)
+        self._mark_dirty(key, record)
+
+    async def set_data(self, *, chat=None, user=None, data=None):
+        key, record = await self._record(chat, user)
+        record['data'] = copy.deepcopy(data or {})
+        self._mark_dirty(key, record)
+
+    async def update_data(self, *, chat=None, user=None, data=None, **kwargs):
+        key, record = await self._record(chat, user)
+        record['data'].update(data or {}, **kwargs)
+        self._mark_dirty(key, record)
+
+    async def reset_state(self, *, chat=None, user=None, with_data=True):
+        key, record = await self._record(chat, user)
+        record['state'] = None
+        if with_data:
+            record['data'] = {}
+        self._mark_dirty(key, record)
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *, chat=None, user=None, default=None):
+        key, record = await self._record(chat, user)
+        return copy.deepcopy(record['bucket'])
+
+    async def set_bucket(self, *, chat=None, user=None, bucket=None):
+        key, record = await self._record(chat, user)
+        record['bucket'] = copy.deepcopy(bucket or {})
+        self._mark_dirty(key, record)
+
+    async def update_bucket(self, *, chat=None, user=None, bucket=None, **kwargs):
+        key, record = await self._record(chat, user)
+        record['bucket'].update(bucket or {}, **kwargs)
+        self._mark_dirty(key, record)
+
+    def state_counts(self):
+        """Диалоги в памяти по состояниям (None - без состояния)"""
+        now = time.time()
+        records = dict(self._dirty)
+        records.update(self._hot)
+        counts = {}
+        for record in records.values():
+            if not self._is_expired(record, now):
+                counts[record['state']] = counts.get(record['state'], 0) + 1
+        return counts
+
+    async def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+        self._hot.clear()
+
+    async def wait_closed(self):
+        pass
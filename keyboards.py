@@ -1,5 +1,9 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 
+from assets import markup
+from callbacks import Action, pack
+from utils import format_balance
+
 # ===== ОСНОВНЫЕ КЛАВИАТУРЫ =====
 def get_main_menu():
     """Главное меню для пользователей"""
@@ -34,10 +38,10 @@ def get_payment_methods():
     """Выбор способа оплаты"""
     keyboard = InlineKeyboardMarkup(row_width=2)
     keyboard.add(
-        InlineKeyboardButton("Т-Банк", callback_data="deposit_qiwi"),
-        InlineKeyboardButton("💳 СБП", callback_data="deposit_yoomoney"),
-        InlineKeyboardButton("💳 Банк. карта", callback_data="deposit_card"),
-        InlineKeyboardButton("₿ USDT", callback_data="deposit_crypto")
+        InlineKeyboardButton("Т-Банк", callback_data=pack(Action.DEPOSIT_METHOD, 'qiwi')),
+        InlineKeyboardButton("💳 СБП", callback_data=pack(Action.DEPOSIT_METHOD, 'yoomoney')),
+        InlineKeyboardButton("💳 Банк. карта", callback_data=pack(Action.DEPOSIT_METHOD, 'bank_card')),
+        InlineKeyboardButton("₿ USDT", callback_data=pack(Action.DEPOSIT_METHOD, 'crypto'))
     )
     return keyboard
 
@@ -45,56 +49,129 @@ def get_deposit_amounts():
     """Быстрый выбор суммы пополнения"""
     keyboard = InlineKeyboardMarkup(row_width=3)
     keyboard.add(
-        InlineKeyboardButton("50₽", callback_data="amount_50"),
-        InlineKeyboardButton("100₽", callback_data="amount_100"),
-        InlineKeyboardButton("500₽", callback_data="amount_500"),
-        InlineKeyboardButton("1000₽", callback_data="amount_1000"),
-        InlineKeyboardButton("5000₽", callback_data="amount_5000"),
-        InlineKeyboardButton("Другая", callback_data="amount_custom")
+        InlineKeyboardButton("50₽", callback_data=pack(Action.DEPOSIT_AMOUNT, 50)),
+        InlineKeyboardButton("100₽", callback_data=pack(Action.DEPOSIT_AMOUNT, 100)),
+        InlineKeyboardButton("500₽", callback_data=pack(Action.DEPOSIT_AMOUNT, 500)),
+        InlineKeyboardButton("1000₽", callback_data=pack(Action.DEPOSIT_AMOUNT, 1000)),
+        InlineKeyboardButton("5000₽", callback_data=pack(Action.DEPOSIT_AMOUNT, 5000)),
+        InlineKeyboardButton("Другая", callback_data=pack(Action.DEPOSIT_CUSTOM))
     )
-    keyboard.add(InlineKeyboardButton("❌ Отмена", callback_data="cancel"))
+    keyboard.add(InlineKeyboardButton("❌ Отмена", callback_data=pack(Action.CANCEL)))
     return keyboard
 
 def get_withdraw_methods():
     """Выбор способа вывода"""
     keyboard = InlineKeyboardMarkup(row_width=2)
     keyboard.add(
-        InlineKeyboardButton("Т-Банк", callback_data="withdraw_qiwi"),
-        InlineKeyboardButton("💳 На карту", callback_data="withdraw_card"),
-        InlineKeyboardButton("₿ На крипто", callback_data="withdraw_crypto")
+        InlineKeyboardButton("Т-Банк", callback_data=pack(Action.WITHDRAW_METHOD, 'qiwi')),
+        InlineKeyboardButton("💳 На карту", callback_data=pack(Action.WITHDRAW_METHOD, 'bank_card')),
+        InlineKeyboardButton("₿ На крипто", callback_data=pack(Action.WITHDRAW_METHOD, 'crypto'))
     )
-    keyboard.add(InlineKeyboardButton("❌ Отмена", callback_data="cancel"))
+    keyboard.add(InlineKeyboardButton("❌ Отмена", callback_data=pack(Action.CANCEL)))
     return keyboard
 
-def get_confirmation_keyboard(action, data_id):
-    """Клавиатура подтверждения для админа"""
+def get_confirmation_keyboard(transaction_id):
+    """Клавиатура подтверждения заявки для админа"""
     keyboard = InlineKeyboardMarkup()
     keyboard.add(
-        InlineKeyboardButton("✅ Подтвердить", callback_data=f"confirm_{action}_{data_id}"),
-        InlineKeyboardButton("❌ Отклонить", callback_data=f"reject_{action}_{data_id}")
+        InlineKeyboardButton("✅ Подтвердить", callback_data=pack(Action.TRANS_STATUS, transaction_id, 'completed')),
+        InlineKeyboardButton("❌ Отклонить", callback_data=pack(Action.TRANS_STATUS, transaction_id, 'rejected'))
     )
     return keyboard
 
+def get_page_keyboard(action, newer, older):
+    """Листание страниц: курсоры - id граничных строк, None - кнопки нет"""
+    buttons = []
+    if newer is not None:
+        buttons.append(InlineKeyboardButton("◀️", callback_data=pack(action, 'prev', newer)))
+    if older is not None:
+        buttons.append(InlineKeyboardButton("▶️", callback_data=pack(action, 'next', older)))
+    
+    if not buttons:
+        return None
+    
+    keyboard = InlineKeyboardMarkup()
+    keyboard.row(*buttons)
+    return keyboard
+
 # ===== КЛАВИАТУРЫ ДЛЯ АДМИНА =====
 def get_user_management_keyboard(user_id):
     """Управление конкретным пользователем"""
     keyboard = InlineKeyboardMarkup(row_width=2)
     keyboard.add(
-        InlineKeyboardButton("➕ Начислить", callback_data=f"admin_add_{user_id}"),
-        InlineKeyboardButton("➖ Списать", callback_data=f"admin_sub_{user_id}"),
-        InlineKeyboardButton("🔒 Заблокировать", callback_data=f"admin_ban_{user_id}"),
-        InlineKeyboardButton("🔓 Разблокировать", callback_data=f"admin_unban_{user_id}"),
-        InlineKeyboardButton("📊 Статистика", callback_data=f"admin_stats_{user_id}"),
-        InlineKeyboardButton("💬 Написать", callback_data=f"admin_msg_{user_id}")
+        InlineKeyboardButton("➕ Начислить", callback_data=pack(Action.ADMIN_USER, user_id, 'add')),
+        InlineKeyboardButton("➖ Списать", callback_data=pack(Action.ADMIN_USER, user_id, 'sub')),
+        InlineKeyboardButton("🔒 Заблокировать", callback_data=pack(Action.ADMIN_USER, user_id, 'ban')),
+        InlineKeyboardButton("🔓 Разблокировать", callback_data=pack(Action.ADMIN_USER, user_id, 'unban')),
+        InlineKeyboardButton("📊 Статистика", callback_data=pack(Action.ADMIN_USER, user_id, 'stats')),
+        InlineKeyboardButton("💬 Написать", callback_data=pack(Action.ADMIN_USER, user_id, 'msg'))
     )
     return keyboard
 
+def get_search_results_keyboard(users, page, has_more):
+    """Результаты поиска пользователей: кнопка на каждого и листание"""
+    keyboard = InlineKeyboardMarkup(row_width=1)
+    for user in users:
+        user_id, username, first_name = user[0], user[1], user[2]
+        title = f"@{username}" if username else (first_name or str(user_id))
+        keyboard.add(InlineKeyboardButton(f"{title} · {user_id}", callback_data=pack(Action.SEARCH_USER, user_id)))
+    
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("◀️", callback_data=pack(Action.SEARCH_PAGE, page - 1)))
+    if has_more:
+        buttons.append(InlineKeyboardButton("▶️", callback_data=pack(Action.SEARCH_PAGE, page + 1)))
+    if buttons:
+        keyboard.row(*buttons)
+    return keyboard
+
 def get_transaction_actions(transaction_id):
     """Действия с транзакцией"""
     keyboard = InlineKeyboardMarkup(row_width=2)
     keyboard.add(
-        InlineKeyboardButton("✅ Выполнено", callback_data=f"trans_complete_{transaction_id}"),
-        InlineKeyboardButton("❌ Отменить", callback_data=f"trans_cancel_{transaction_id}"),
-        InlineKeyboardButton("🕐 Отложить", callback_data=f"trans_pending_{transaction_id}")
+        InlineKeyboardButton("✅ Выполнено", callback_data=pack(Action.TRANS_STATUS, transaction_id, 'completed')),
+        InlineKeyboardButton("❌ Отменить", callback_data=pack(Action.TRANS_STATUS, transaction_id, 'cancelled')),
+        InlineKeyboardButton("🕐 Отложить", callback_data=pack(Action.TRANS_STATUS, transaction_id, 'pending'))
     )
     return keyboard
+
+def get_withdrawals_console_keyboard(withdrawals, selected, prev_cursor, next_cursor):
+    """Консоль заявок на вывод: отметка заявок, листание и действия над отмеченными"""
+    keyboard = InlineKeyboardMarkup(row_width=1)
+    for withdrawal in withdrawals:
+        trans_id, amount = withdrawal[1], withdrawal[3]
+        mark = "☑️" if trans_id in selected else "⬜"
+        keyboard.add(InlineKeyboardButton(
+            f"{mark} #{trans_id} · {format_balance(amount)}",
+            callback_data=pack(Action.WITHDRAWAL_TOGGLE, trans_id)
+        ))
+    
+    buttons = []
+    if prev_cursor is not None:
+        buttons.append(InlineKeyboardButton("◀️", callback_data=pack(Action.WITHDRAWALS_PAGE, 'prev', prev_cursor)))
+    if next_cursor is not None:
+        buttons.append(InlineKeyboardButton("▶️", callback_data=pack(Action.WITHDRAWALS_PAGE, 'next', next_cursor)))
+    if buttons:
+        keyboard.row(*buttons)
+    
+    if selected:
+        keyboard.row(
+            InlineKeyboardButton(f"✅ Одобрить ({len(selected)})", callback_data=pack(Action.WITHDRAWALS_BULK, 'completed')),
+            InlineKeyboardButton(f"❌ Отклонить ({len(selected)})", callback_data=pack(Action.WITHDRAWALS_BULK, 'rejected'))
+        )
+    return keyboard
+
+def get_broadcast_keyboard(broadcast_id):
+    """Управление идущей рассылкой"""
+    keyboard = InlineKeyboardMarkup()
+    keyboard.add(InlineKeyboardButton("⏹ Остановить", callback_data=pack(Action.BROADCAST_STOP, broadcast_id)))
+    return keyboard
+
+# ===== ГОТОВЫЕ КЛАВИАТУРЫ =====
+# Неизменяемые клавиатуры собираются один раз и отдаются как готовый JSON:
+# reply_markup=MAIN_MENU.get()
+MAIN_MENU = markup()(get_main_menu)
+ADMIN_MENU = markup()(get_admin_menu)
+PAYMENT_METHODS = markup()(get_payment_methods)
+DEPOSIT_AMOUNTS = markup()(get_deposit_amounts)
+WITHDRAW_METHODS = markup()(get_withdraw_methods)
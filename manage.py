@@ -0,0 +1,131 @@
+"""Служебные команды обслуживания базы данных.
+
+    python manage.py migrate        - применить миграции схемы
+    python manage.py check-plans    - проверить, что горячие запросы идут по индексам
+    python manage.py stats-verify   - сверить счетчики статистики с данными
+    python manage.py stats-rebuild  - пересчитать счетчики статистики
+    python manage.py ledger-verify  - сверить балансы с журналом движения средств
+    python manage.py search-rebuild - перестроить поисковый индекс пользователей
+    python manage.py archive [--days N] - перенести старые операции в архив
+"""
+import argparse
+import sys
+import time
+
+import config
+import migrations
+from database import Database
+
+
+def cmd_migrate(db, args):
+    with db.connection() as conn:
+        version = migrations.get_schema_version(conn)
+    print(f"Версия схемы: {version}")
+    return 0
+
+
+def cmd_check_plans(db, args):
+    with db.connection() as conn:
+        problems = migrations.find_full_scans(conn)
+
+    if not problems:
+        print(f"OK: {len(migrations.HOT_QUERIES)} запросов используют индексы")
+        return 0
+
+    for name, detail in problems:
+        print(f"FAIL {name}: {detail}")
+    return 1
+
+
+def _print_drift(drift):
+    for column, (stored, actual) in sorted(drift.items()):
+        print(f"{column}: сохранено {stored}, фактически {actual}")
+
+
+def cmd_stats_verify(db, args):
+    drift = db.rebuild_stats(fix=False)
+    if not drift:
+        print("OK: счетчики статистики совпадают с данными")
+        return 0
+
+    _print_drift(drift)
+    return 1
+
+
+def cmd_stats_rebuild(db, args):
+    drift = db.rebuild_stats(fix=True)
+    _print_drift(drift)
+    print(f"Счетчики пересчитаны, исправлено: {len(drift)}")
+    return 0
+
+
+def _rub(kopecks):
+    return f"{kopecks / 100:.2f}"
+
+
+def cmd_ledger_verify(db, args):
+    balances, snapshots = db.verify_ledger()
+    if not balances and not snapshots:
+        print("OK: балансы и снимки совпадают с журналом")
+        return 0
+
+    for user_id, stored, replayed in balances:
+        print(f"user {user_id}: баланс {_rub(stored)}, по журналу {_rub(replayed)}")
+    for user_id, ledger_id, stored, replayed in snapshots:
+        print(f"user {user_id} снимок #{ledger_id}: {_rub(stored)}, по журналу {_rub(replayed)}")
+    return 1
+
+
+def cmd_search_rebuild(db, args):
+    if not db.rebuild_search_index():
+        print("Поисковый индекс не поддерживается этой сборкой SQLite, поиск через LIKE")
+        return 1
+    print("Поисковый индекс перестроен")
+    return 0
+
+
+def cmd_archive(db, args):
+    days = config.ARCHIVE_AFTER_DAYS if args.days is None else args.days
+    before = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(time.time() - days * 86400))
+    total = 0
+    while True:
+        moved = db.archive_transactions(before)
+        if not moved:
+            break
+        total += moved
+        print(f"\rПеренесено операций: {total}", end='', flush=True)
+    print(f"\rПеренесено операций старше {before}: {total}")
+
+    for month, transactions, withdrawals, updated_at in db.get_archives():
+        print(f"{month}: операций {transactions}, выводов {withdrawals} ({db.archive_path(month)})")
+    return 0
+
+
+COMMANDS = {
+    'migrate': cmd_migrate,
+    'check-plans': cmd_check_plans,
+    'stats-verify': cmd_stats_verify,
+    'stats-rebuild': cmd_stats_rebuild,
+    'ledger-verify': cmd_ledger_verify,
+    'search-rebuild': cmd_search_rebuild,
+    'archive': cmd_archive,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Обслуживание базы данных SofiaCash")
+    parser.add_argument('command', choices=sorted(COMMANDS))
+    parser.add_argument('--db', help="путь к файлу базы (по умолчанию config.DB_NAME)")
+    parser.add_argument('--days', type=float, help="archive: возраст операций в днях (по умолчанию ARCHIVE_AFTER_DAYS)")
+    args = parser.parse_args(argv)
+
+    # Миграции применяются при открытии базы
+    db = Database(args.db)
+    try:
+        return COMMANDS[args.command](db, args)
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,343 @@
+"""Метрики в текстовом формате Prometheus для /metrics.
+
+Счетчики и гистограммы живут в памяти процесса и обновляются из event
+loop без блокировок: запись - поиск в словаре по кортежу меток и
+увеличение чисел, бакет гистограммы ищется бинарным поиском. Значения,
+которые дешевле посчитать при чтении (состояния FSM, очереди воркеров),
+задаются функцией у Gauge и вычисляются только при запросе /metrics.
+"""
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from bisect import bisect_left
+
+from aiogram import Bot
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+import config
+from dispatch import UPDATE_FIELDS
+
+logger = logging.getLogger(__name__)
+
+# Все объявленные метрики, в порядке объявления
+_registry = []
+
+# Бакеты по умолчанию, секунды: от миллисекунды до десятков секунд
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        _registry.append(self)
+
+    def _labels_text(self, values, extra=()):
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labels, values)]
+        pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def samples(self):
+        """Строки с значениями (без HELP/TYPE)"""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        for labels, value in list(self._values.items()):
+            yield f'{self.name}{self._labels_text(labels)} {_format_value(value)}'
+
+
+class Gauge(Metric):
+    """Текущее значение; с function - вычисляется при чтении.
+
+    function возвращает число (метрика без меток) или словарь
+    {кортеж значений меток: число}.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        super().__init__(name, documentation, labels)
+        self._values = {}
+        self.function = function
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def value(self, *labels):
+        return self._values.get(labels)
+
+    def samples(self):
+        values = self._values
+        if self.function is not None:
+            try:
+                values = self.function()
+            except Exception:
+                logger.exception(f"Ошибка вычисления метрики {self.name}")
+                return
+            if not isinstance(values, dict):
+                values = {(): values}
+        for labels, value in list(values.items()):
+            yield f'{self.name}{self._labels_text(labels)} {_format_value(value)}'
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # метки -> [счетчики по бакетам (последний - +Inf), сумма, количество]
+        self._series = {}
+
+    def observe(self, value, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def count(self, *labels):
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def totals(self):
+        """{метки: (количество, сумма)} по всем сериям"""
+        return {labels: (series[2], series[1]) for labels, series in list(self._series.items())}
+
+    def samples(self):
+        bounds = self.buckets + (float('inf'),)
+        for labels, (counts, total, count) in list(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                le = (('le', _format_value(bound)),)
+                yield f'{self.name}_bucket{self._labels_text(labels, le)} {cumulative}'
+            yield f'{self.name}_sum{self._labels_text(labels)} {_format_value(total)}'
+            yield f'{self.name}_count{self._labels_text(labels)} {count}'
+
+
+def render():
+    """Все метрики в текстовом формате Prometheus"""
+    return '\n'.join(metric.render() for metric in _registry) + '\n'
+
+
+# ===== МЕТРИКИ БОТА =====
+HANDLER_DURATION = Histogram(
+    'bot_handler_duration_seconds', 'Время работы обработчика обновления', ('handler',)
+)
+UPDATES = Counter('bot_updates_total', 'Полученные обновления по типу', ('type',))
+DB_DURATION = Histogram(
+    'bot_db_call_duration_seconds', 'Время вызова метода Database с учетом ожидания пула', ('method',)
+)
+API_DURATION = Histogram(
+    'bot_api_request_duration_seconds', 'Время запроса к Telegram Bot API', ('method',)
+)
+API_ERRORS = Counter('bot_api_errors_total', 'Ошибки запросов к Telegram Bot API', ('method', 'error'))
+FSM_STATES = Gauge('bot_fsm_states', 'Диалоги в памяти хранилища FSM по состояниям', ('state',))
+DISPATCH_QUEUE = Gauge('bot_dispatch_queue_depth', 'Обновления в очередях воркеров')
+LOOP_LAG = Gauge('bot_event_loop_lag_seconds', 'Последняя измеренная задержка event loop')
+LOOP_LAG_HISTOGRAM = Histogram(
+    'bot_event_loop_lag_distribution_seconds', 'Задержка event loop',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+)
+LOOP_BLOCKED = Counter('bot_event_loop_blocked_total', 'Случаи, когда event loop был занят дольше LOOP_BLOCK_THRESHOLD')
+LAST_UPDATE = Gauge('bot_last_update_timestamp_seconds', 'Время окончания обработки последнего обновления (unix)')
+API_LAST_SUCCESS = Gauge(
+    'bot_api_last_success_timestamp_seconds', 'Время последнего успешного запроса к Bot API (unix)', ('method',)
+)
+
+
+# ===== СБОР =====
+def handler_name(handler):
+    return getattr(handler, '__qualname__', None) or repr(handler)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Время обработчиков сообщений и callback-запросов.
+
+    Отсчет начинается, когда фильтры пройдены и выбран обработчик. Для
+    маршрутов Router в данные фильтра попадает Route, и в метку идет имя
+    настоящего обработчика, а не общего Router._on_update.
+    """
+
+    async def on_pre_process_update(self, update, data):
+        for field in UPDATE_FIELDS:
+            if getattr(update, field, None) is not None:
+                UPDATES.inc(field)
+                return
+        UPDATES.inc('other')
+
+    async def on_post_process_update(self, update, results, data):
+        LAST_UPDATE.set(time.time())
+
+    def _start(self, data):
+        route = data.get('route')
+        handler = route.handler if route is not None else current_handler.get(None)
+        data['metrics_handler'] = handler_name(handler)
+        data['metrics_started'] = time.perf_counter()
+
+    def _finish(self, data):
+        started = data.get('metrics_started')
+        if started is not None:
+            HANDLER_DURATION.observe(time.perf_counter() - started, data['metrics_handler'])
+
+    async def on_process_message(self, message, data):
+        self._start(data)
+
+    async def on_post_process_message(self, message, results, data):
+        self._finish(data)
+
+    async def on_process_callback_query(self, callback_query, data):
+        self._start(data)
+
+    async def on_post_process_callback_query(self, callback_query, results, data):
+        self._finish(data)
+
+
+class InstrumentedBot(Bot):
+    """Bot, который замеряет время и ошибки запросов к Bot API"""
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            result = await super().request(method, data, files, **kwargs)
+            API_LAST_SUCCESS.set(time.time(), method)
+            return result
+        except Exception as e:
+            API_ERRORS.inc(method, type(e).__name__)
+            raise
+        finally:
+            API_DURATION.observe(time.perf_counter() - started, method)
+
+
+def format_callback_stack(frame):
+    """Стек потока loop без кадров самого asyncio: от колбэка, который сейчас выполняется"""
+    if frame is None:
+        return '    стек недоступен'
+    frames = traceback.extract_stack(frame)
+    for index in range(len(frames) - 1, -1, -1):
+        if frames[index].filename == asyncio.events.__file__:
+            frames = frames[index + 1:]
+            break
+    return ''.join(traceback.format_list(frames)).rstrip()
+
+
+class LoopLagMonitor:
+    """Фоновая задача: насколько позже запланированного просыпается sleep().
+
+    Каждое пробуждение задачи - отметка, что loop свободен. Сторожевой поток
+    проверяет возраст отметки: если loop не возвращался к задаче дольше
+    block_threshold, поток снимает стек потока loop (sys._current_frames) и
+    пишет его в лог. Это стек того синхронного вызова, который держит loop,
+    пока тот еще выполняется, - один раз на каждый случай.
+    """
+
+    def __init__(self, interval=None, block_threshold=None):
+        self.interval = interval or config.METRICS_LOOP_LAG_INTERVAL
+        self.block_threshold = config.LOOP_BLOCK_THRESHOLD if block_threshold is None else block_threshold
+        self.last_lag = 0.0
+        self._task = None
+        self._heartbeat = None
+        self._loop_thread_id = None
+        self._watchdog = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._heartbeat = time.perf_counter()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        if self.block_threshold > 0:
+            self._loop_thread_id = threading.get_ident()
+            self._stopping.clear()
+            self._watchdog = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+            self._watchdog.start()
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def current_lag(self):
+        """Задержка с учетом текущей: растет, пока loop занят, еще до следующего замера"""
+        if self._heartbeat is None:
+            return 0.0
+        return max(self.last_lag, time.perf_counter() - self._heartbeat - self.interval)
+
+    async def _run(self):
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            self._heartbeat = now
+            lag = max(0.0, now - expected)
+            self.last_lag = lag
+            LOOP_LAG.set(lag)
+            LOOP_LAG_HISTOGRAM.observe(lag)
+
+    def _watch(self):
+        reported = None
+        period = min(self.interval, self.block_threshold) / 2
+        while not self._stopping.wait(period):
+            heartbeat = self._heartbeat
+            blocked = time.perf_counter() - heartbeat - self.interval
+            if blocked < self.block_threshold or heartbeat == reported:
+                continue
+            reported = heartbeat
+            LOOP_BLOCKED.inc()
+            frame = sys._current_frames().get(self._loop_thread_id)
+            logger.warning(f"Event loop занят уже {blocked:.2f} с, сейчас выполняется:\n{format_callback_stack(frame)}")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        if self._watchdog is not None:
+            self._stopping.set()
+            self._watchdog.join()
+            self._watchdog = None
+
+
+loop_monitor = LoopLagMonitor()
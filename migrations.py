@@ -0,0 +1,511 @@
+"""Версионные миграции схемы базы данных.
+
+Текущая версия схемы хранится в таблице settings (ключ schema_version).
+При запуске применяются по порядку все миграции с номером больше текущего,
+каждая - в отдельной транзакции. Шаг миграции - SQL-строка или функция,
+принимающая соединение.
+"""
+import logging
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION_KEY = 'schema_version'
+
+# Счетчики статистики, пересчитанные с нуля. Используется при создании
+# таблицы bot_stats и командой сверки (Database.rebuild_stats).
+# Денежные суммы - целые копейки: общий баланс складывается из проводок
+# журнала ledger, обороты - из округленных до копейки сумм транзакций.
+STATS_RECOMPUTE_SQL = '''
+    SELECT
+        (SELECT COUNT(*) FROM users),
+        (SELECT COALESCE(SUM(delta), 0) FROM ledger),
+        (SELECT COALESCE(SUM(CAST(ROUND(amount * 100) AS INTEGER)), 0) FROM transactions WHERE type = 'deposit' AND status = 'completed'),
+        (SELECT COALESCE(SUM(CAST(ROUND(amount * 100) AS INTEGER)), 0) FROM transactions WHERE type = 'withdraw' AND status = 'completed'),
+        (SELECT COUNT(*) FROM transactions WHERE status = 'pending')
+'''
+
+STATS_COLUMNS = ('total_users', 'total_balance', 'total_deposits', 'total_withdrawals', 'pending_transactions')
+
+# Счетчики bot_stats, которые хранятся в копейках
+STATS_MONEY_COLUMNS = ('total_balance', 'total_deposits', 'total_withdrawals')
+
+# Пересчет для миграции 3 (суммы в рублях, до появления журнала).
+# Зафиксирован, чтобы старые миграции не зависели от текущей схемы.
+_STATS_RECOMPUTE_SQL_V3 = '''
+    SELECT
+        (SELECT COUNT(*) FROM users),
+        (SELECT COALESCE(SUM(balance), 0) FROM users),
+        (SELECT COALESCE(SUM(amount), 0) FROM transactions WHERE type = 'deposit' AND status = 'completed'),
+        (SELECT COALESCE(SUM(amount), 0) FROM transactions WHERE type = 'withdraw' AND status = 'completed'),
+        (SELECT COUNT(*) FROM transactions WHERE status = 'pending')
+'''
+
+# Поиск по подстроке: FTS5 с триграммным токенизатором (SQLite >= 3.34).
+# Таблица внешнего содержимого - текст хранится только в users.
+USERS_SEARCH_COLUMNS = ('username', 'first_name', 'last_name', 'referral_id')
+
+_USERS_SEARCH_SQL = [
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+        {cols}, content='users', content_rowid='user_id', tokenize='trigram'
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_users_fts_insert AFTER INSERT ON users BEGIN
+        INSERT INTO users_fts (rowid, {cols}) VALUES (NEW.user_id, {new});
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_users_fts_delete AFTER DELETE ON users BEGIN
+        INSERT INTO users_fts (users_fts, rowid, {cols}) VALUES ('delete', OLD.user_id, {old});
+    END
+    ''',
+    # Изменения баланса и активности индекс не трогают
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_users_fts_update AFTER UPDATE OF {cols} ON users BEGIN
+        INSERT INTO users_fts (users_fts, rowid, {cols}) VALUES ('delete', OLD.user_id, {old});
+        INSERT INTO users_fts (rowid, {cols}) VALUES (NEW.user_id, {new});
+    END
+    ''',
+    "INSERT INTO users_fts (users_fts) VALUES ('rebuild')",
+]
+
+
+def create_users_search(conn):
+    """Создать поисковый индекс users_fts, если SQLite его поддерживает.
+
+    Без FTS5 или токенизатора trigram миграция проходит, а поиск
+    (Database.search_users) работает через LIKE.
+    """
+    fmt = {
+        'cols': ', '.join(USERS_SEARCH_COLUMNS),
+        'new': ', '.join('NEW.' + c for c in USERS_SEARCH_COLUMNS),
+        'old': ', '.join('OLD.' + c for c in USERS_SEARCH_COLUMNS),
+    }
+    try:
+        conn.execute(_USERS_SEARCH_SQL[0].format(**fmt))
+    except sqlite3.OperationalError as e:
+        logger.warning(f"Поисковый индекс недоступен ({e}), поиск пользователей через LIKE")
+        return
+
+    for sql in _USERS_SEARCH_SQL[1:]:
+        conn.execute(sql.format(**fmt))
+
+
+def has_users_search(conn):
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users_fts'"
+    ).fetchone()
+    return row is not None
+
+
+MIGRATIONS = [
+    (1, "Индексы для истории операций и заявок на вывод", [
+        # get_user_transactions: WHERE user_id = ? ORDER BY created_at DESC
+        'CREATE INDEX IF NOT EXISTS idx_transactions_user_created ON transactions (user_id, created_at)',
+        # get_bot_stats: суммы по type/status и количество ожидающих (покрывающий индекс)
+        'CREATE INDEX IF NOT EXISTS idx_transactions_status_type ON transactions (status, type, amount)',
+        # get_pending_withdrawals: WHERE status = 'pending' ORDER BY created_at
+        'CREATE INDEX IF NOT EXISTS idx_withdrawals_status_created ON withdrawals (status, created_at)',
+        # update_transaction_status: UPDATE withdrawals ... WHERE transaction_id = ?
+        'CREATE INDEX IF NOT EXISTS idx_withdrawals_transaction ON withdrawals (transaction_id)',
+    ]),
+    (2, "Индексы для списка пользователей и активности", [
+        # get_all_users: ORDER BY created_at DESC
+        'CREATE INDEX IF NOT EXISTS idx_users_created ON users (created_at)',
+        # get_bot_stats: активные сегодня (last_active >= начало дня)
+        'CREATE INDEX IF NOT EXISTS idx_users_last_active ON users (last_active)',
+    ]),
+    (3, "Счетчики статистики, обновляемые триггерами", [
+        '''
+        CREATE TABLE IF NOT EXISTS bot_stats (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_users INTEGER NOT NULL DEFAULT 0,
+            total_balance REAL NOT NULL DEFAULT 0,
+            total_deposits REAL NOT NULL DEFAULT 0,
+            total_withdrawals REAL NOT NULL DEFAULT 0,
+            pending_transactions INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        'INSERT OR REPLACE INTO bot_stats (id, {}) SELECT 1, * FROM ({})'.format(', '.join(STATS_COLUMNS), _STATS_RECOMPUTE_SQL_V3),
+        # Триггеры выполняются в той же транзакции, что и изменяющий запрос
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_users_insert AFTER INSERT ON users BEGIN
+            UPDATE bot_stats SET
+                total_users = total_users + 1,
+                total_balance = total_balance + COALESCE(NEW.balance, 0)
+            WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_users_delete AFTER DELETE ON users BEGIN
+            UPDATE bot_stats SET
+                total_users = total_users - 1,
+                total_balance = total_balance - COALESCE(OLD.balance, 0)
+            WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_users_balance AFTER UPDATE OF balance ON users
+        WHEN NEW.balance IS NOT OLD.balance BEGIN
+            UPDATE bot_stats SET
+                total_balance = total_balance + COALESCE(NEW.balance, 0) - COALESCE(OLD.balance, 0)
+            WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_transactions_insert AFTER INSERT ON transactions BEGIN
+            UPDATE bot_stats SET
+                total_deposits = total_deposits
+                    + CASE WHEN NEW.type = 'deposit' AND NEW.status = 'completed' THEN NEW.amount ELSE 0 END,
+                total_withdrawals = total_withdrawals
+                    + CASE WHEN NEW.type = 'withdraw' AND NEW.status = 'completed' THEN NEW.amount ELSE 0 END,
+                pending_transactions = pending_transactions + (NEW.status = 'pending')
+            WHERE id = 1;
+        END
+        ''',
+        # Удаление транзакций счетчики не уменьшает: удаленные строки
+        # уходят в архив и продолжают входить в итоги
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_transactions_update AFTER UPDATE OF type, amount, status ON transactions BEGIN
+            UPDATE bot_stats SET
+                total_deposits = total_deposits
+                    - CASE WHEN OLD.type = 'deposit' AND OLD.status = 'completed' THEN OLD.amount ELSE 0 END
+                    + CASE WHEN NEW.type = 'deposit' AND NEW.status = 'completed' THEN NEW.amount ELSE 0 END,
+                total_withdrawals = total_withdrawals
+                    - CASE WHEN OLD.type = 'withdraw' AND OLD.status = 'completed' THEN OLD.amount ELSE 0 END
+                    + CASE WHEN NEW.type = 'withdraw' AND NEW.status = 'completed' THEN NEW.amount ELSE 0 END,
+                pending_transactions = pending_transactions - (OLD.status = 'pending') + (NEW.status = 'pending')
+            WHERE id = 1;
+        END
+        ''',
+    ]),
+    (4, "Хранилище состояний FSM", [
+        '''
+        CREATE TABLE IF NOT EXISTS fsm_storage (
+            chat TEXT NOT NULL,
+            user TEXT NOT NULL,
+            state TEXT,
+            data TEXT,
+            bucket TEXT,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (chat, user)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated ON fsm_storage (updated_at)',
+    ]),
+    (5, "Рассылки с сохранением прогресса", [
+        '''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER,
+            from_chat_id INTEGER,
+            message_id INTEGER,
+            text TEXT,
+            status TEXT DEFAULT 'running', -- 'running', 'done', 'cancelled'
+            last_user_id INTEGER DEFAULT 0,
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            total INTEGER DEFAULT 0,
+            progress_message_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts (status)',
+    ]),
+    (6, "Журнал движения средств в копейках и счетчики в копейках", [
+        # Только добавление: баланс пользователя - сумма его проводок
+        '''
+        CREATE TABLE IF NOT EXISTS ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            delta INTEGER NOT NULL, -- копейки, со знаком
+            kind TEXT NOT NULL, -- 'opening', 'deposit', 'withdraw', 'bonus'
+            transaction_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_ledger_user ON ledger (user_id, id)',
+        # Баланс после проводки ledger_id: сверка читает только хвост журнала
+        '''
+        CREATE TABLE IF NOT EXISTS balance_snapshots (
+            user_id INTEGER NOT NULL,
+            ledger_id INTEGER NOT NULL,
+            balance INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, ledger_id)
+        ) WITHOUT ROWID
+        ''',
+        # Входящие остатки для уже существующих балансов
+        '''
+        INSERT INTO ledger (user_id, delta, kind)
+        SELECT user_id, CAST(ROUND(balance * 100) AS INTEGER), 'opening'
+        FROM users
+        WHERE CAST(ROUND(balance * 100) AS INTEGER) != 0
+        ORDER BY user_id
+        ''',
+        '''
+        INSERT INTO balance_snapshots (user_id, ledger_id, balance)
+        SELECT user_id, id, delta FROM ledger WHERE kind = 'opening'
+        ''',
+        # REAL-колонки приводят целые к float, поэтому таблица пересоздается
+        'DROP TRIGGER IF EXISTS trg_stats_users_insert',
+        'DROP TRIGGER IF EXISTS trg_stats_users_delete',
+        'DROP TRIGGER IF EXISTS trg_stats_users_balance',
+        'DROP TRIGGER IF EXISTS trg_stats_transactions_insert',
+        'DROP TRIGGER IF EXISTS trg_stats_transactions_update',
+        'DROP TABLE IF EXISTS bot_stats',
+        '''
+        CREATE TABLE bot_stats (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_users INTEGER NOT NULL DEFAULT 0,
+            total_balance INTEGER NOT NULL DEFAULT 0,
+            total_deposits INTEGER NOT NULL DEFAULT 0,
+            total_withdrawals INTEGER NOT NULL DEFAULT 0,
+            pending_transactions INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        'INSERT INTO bot_stats (id, {}) SELECT 1, * FROM ({})'.format(', '.join(STATS_COLUMNS), STATS_RECOMPUTE_SQL),
+        '''
+        CREATE TRIGGER trg_stats_users_insert AFTER INSERT ON users BEGIN
+            UPDATE bot_stats SET total_users = total_users + 1 WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER trg_stats_users_delete AFTER DELETE ON users BEGIN
+            UPDATE bot_stats SET total_users = total_users - 1 WHERE id = 1;
+        END
+        ''',
+        # Общий баланс ведется по журналу, а не по users.balance
+        '''
+        CREATE TRIGGER trg_stats_ledger_insert AFTER INSERT ON ledger BEGIN
+            UPDATE bot_stats SET total_balance = total_balance + NEW.delta WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER trg_stats_transactions_insert AFTER INSERT ON transactions BEGIN
+            UPDATE bot_stats SET
+                total_deposits = total_deposits
+                    + CASE WHEN NEW.type = 'deposit' AND NEW.status = 'completed'
+                        THEN CAST(ROUND(NEW.amount * 100) AS INTEGER) ELSE 0 END,
+                total_withdrawals = total_withdrawals
+                    + CASE WHEN NEW.type = 'withdraw' AND NEW.status = 'completed'
+                        THEN CAST(ROUND(NEW.amount * 100) AS INTEGER) ELSE 0 END,
+                pending_transactions = pending_transactions + (NEW.status = 'pending')
+            WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER trg_stats_transactions_update AFTER UPDATE OF type, amount, status ON transactions BEGIN
+            UPDATE bot_stats SET
+                total_deposits = total_deposits
+                    - CASE WHEN OLD.type = 'deposit' AND OLD.status = 'completed'
+                        THEN CAST(ROUND(OLD.amount * 100) AS INTEGER) ELSE 0 END
+                    + CASE WHEN NEW.type = 'deposit' AND NEW.status = 'completed'
+                        THEN CAST(ROUND(NEW.amount * 100) AS INTEGER) ELSE 0 END,
+                total_withdrawals = total_withdrawals
+                    - CASE WHEN OLD.type = 'withdraw' AND OLD.status = 'completed'
+                        THEN CAST(ROUND(OLD.amount * 100) AS INTEGER) ELSE 0 END
+                    + CASE WHEN NEW.type = 'withdraw' AND NEW.status = 'completed'
+                        THEN CAST(ROUND(NEW.amount * 100) AS INTEGER) ELSE 0 END,
+                pending_transactions = pending_transactions - (OLD.status = 'pending') + (NEW.status = 'pending')
+            WHERE id = 1;
+        END
+        ''',
+    ]),
+    (7, "Поисковый индекс пользователей", [
+        # Точное совпадение username без учета регистра
+        'CREATE INDEX IF NOT EXISTS idx_users_username ON users (username COLLATE NOCASE)',
+        create_users_search,
+    ]),
+    (8, "Архив операций: каталог месяцев и индекс по дате", [
+        # Месяцы в архиве; итоги - в копейках, для пересчета статистики
+        '''
+        CREATE TABLE IF NOT EXISTS archives (
+            month TEXT PRIMARY KEY, -- 'YYYY-MM', файл <ARCHIVE_DIR>/YYYY-MM.db
+            transactions INTEGER NOT NULL DEFAULT 0,
+            withdrawals INTEGER NOT NULL DEFAULT 0,
+            deposits INTEGER NOT NULL DEFAULT 0,
+            withdrawn INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # Какие архивы подключать для истории пользователя
+        '''
+        CREATE TABLE IF NOT EXISTS archived_user_months (
+            user_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            PRIMARY KEY (user_id, month)
+        ) WITHOUT ROWID
+        ''',
+        # Диапазоны created_at без условия на статус
+        'CREATE INDEX IF NOT EXISTS idx_transactions_created ON transactions (created_at)',
+    ]),
+    (9, "Индексы выгрузки по статусу и дате", [
+        # Выгрузка: WHERE status = ? AND created_at >= ? ORDER BY created_at, id;
+        # кандидаты в архив: WHERE status IN (...) AND created_at < ?
+        'CREATE INDEX IF NOT EXISTS idx_transactions_status_created ON transactions (status, created_at)',
+        # Выгрузка выводов только по дате (по статусу - idx_withdrawals_status_created)
+        'CREATE INDEX IF NOT EXISTS idx_withdrawals_created ON withdrawals (created_at)',
+    ]),
+    (10, "Индекс получателей рассылки", [
+        # count_users и get_user_ids_after: WHERE is_banned = 0
+        'CREATE INDEX IF NOT EXISTS idx_users_recipients ON users (user_id) WHERE is_banned = 0',
+    ]),
+]
+
+# Горячие запросы, которые не должны читать таблицы целиком.
+# SQL повторяет запросы из database.py; параметры нужны только для плана.
+HOT_QUERIES = [
+    ('get_user_transactions', '''
+        SELECT * FROM transactions
+        WHERE user_id = ?
+        ORDER BY created_at DESC
+        LIMIT ?
+    ''', (1, 10)),
+    ('get_pending_withdrawals', '''
+        SELECT w.*, u.username, u.user_id
+        FROM withdrawals w
+        JOIN users u ON w.user_id = u.user_id
+        WHERE w.status = 'pending'
+        ORDER BY w.created_at
+    ''', ()),
+    ('update_transaction_status', '''
+        UPDATE withdrawals
+        SET status = ?, processed_at = CURRENT_TIMESTAMP
+        WHERE transaction_id = ?
+    ''', ('completed', 1)),
+    ('get_all_users', '''
+        SELECT user_id, username, balance, created_at
+        FROM users
+        ORDER BY created_at DESC
+        LIMIT ? OFFSET ?
+    ''', (100, 0)),
+    ('get_user_transactions_page', '''
+        SELECT * FROM transactions
+        WHERE user_id = ?
+          AND (created_at, id) < (SELECT created_at, id FROM transactions WHERE id = ?)
+        ORDER BY created_at DESC, id DESC
+        LIMIT ?
+    ''', (1, 1, 6)),
+    ('get_users_page', '''
+        SELECT user_id, username, balance, created_at
+        FROM users
+        WHERE (created_at, user_id) > (SELECT created_at, user_id FROM users WHERE user_id = ?)
+        ORDER BY created_at ASC, user_id ASC
+        LIMIT ?
+    ''', (1, 11)),
+    ('get_pending_withdrawals_page', '''
+        SELECT id, transaction_id, user_id, amount, net_amount, payment_method, requisites, created_at
+        FROM withdrawals
+        WHERE status = 'pending'
+          AND (created_at, id) > (SELECT created_at, id FROM withdrawals WHERE id = ?)
+        ORDER BY created_at ASC, id ASC
+        LIMIT ?
+    ''', (1, 9)),
+    ('get_bot_stats.active_today', '''
+        SELECT COUNT(*) FROM users WHERE last_active >= DATE('now')
+    ''', ()),
+    ('search_users.username', '''
+        SELECT user_id FROM users WHERE username = ? COLLATE NOCASE
+    ''', ('name',)),
+    ('search_users.referral', '''
+        SELECT user_id FROM users WHERE referral_id = ?
+    ''', ('REF1',)),
+    ('export.transactions', '''
+        SELECT * FROM transactions
+        WHERE status = ? AND created_at >= ? AND created_at < ?
+        ORDER BY created_at, id
+    ''', ('completed', '2024-01-01', '2024-02-01')),
+    ('export.withdrawals', '''
+        SELECT * FROM withdrawals
+        WHERE created_at >= ? AND created_at < ?
+        ORDER BY created_at, id
+    ''', ('2024-01-01', '2024-02-01')),
+    ('export.users', '''
+        SELECT * FROM users
+        WHERE created_at >= ?
+        ORDER BY created_at, user_id
+    ''', ('2024-01-01',)),
+    ('ledger.last_snapshot', '''
+        SELECT ledger_id, balance FROM balance_snapshots
+        WHERE user_id = ?
+        ORDER BY ledger_id DESC
+        LIMIT 1
+    ''', (1,)),
+    ('archive_transactions', '''
+        SELECT id, created_at FROM transactions
+        WHERE status IN ('completed', 'rejected', 'cancelled') AND created_at < ?
+        LIMIT ?
+    ''', ('2024-01-01', 5000)),
+    ('archive.user_months', '''
+        SELECT month FROM archived_user_months WHERE user_id = ? ORDER BY month DESC
+    ''', (1,)),
+    ('count_users', '''
+        SELECT COUNT(*) FROM users WHERE is_banned = 0
+    ''', ()),
+    ('ledger.tail', '''
+        SELECT COUNT(*), COALESCE(SUM(delta), 0), MAX(id) FROM ledger
+        WHERE user_id = ? AND id > ?
+    ''', (1, 0)),
+]
+
+
+def get_schema_version(conn):
+    row = conn.execute('SELECT value FROM settings WHERE key = ?', (SCHEMA_VERSION_KEY,)).fetchone()
+    return int(row[0]) if row else 0
+
+
+def migrate(conn):
+    """Применить недостающие миграции. Возвращает итоговую версию схемы."""
+    version = get_schema_version(conn)
+
+    for number, description, steps in MIGRATIONS:
+        if number <= version:
+            continue
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Другой процесс мог успеть применить миграцию, пока мы ждали блокировку
+            if get_schema_version(conn) >= number:
+                conn.rollback()
+                continue
+
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+
+            conn.execute(
+                'INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)',
+                (SCHEMA_VERSION_KEY, str(number))
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        version = number
+        logger.info(f"Применена миграция {number}: {description}")
+
+    return version
+
+
+def find_full_scans(conn):
+    """Проверить планы горячих запросов.
+
+    Возвращает список (имя запроса, строка плана) для полных сканирований
+    таблиц и сортировок во временном B-дереве. Пустой список - все пути
+    обслуживаются индексами.
+    """
+    problems = []
+    for name, sql, params in HOT_QUERIES:
+        for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params):
+            detail = row[-1]
+            full_scan = detail.startswith('SCAN') and 'INDEX' not in detail
+            if full_scan or 'TEMP B-TREE' in detail:
+                problems.append((name, detail))
+    return problems
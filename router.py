@@ -0,0 +1,143 @@
+"""Табличная маршрутизация кнопок меню и callback-запросов.
+
+Вместо цепочки lambda-фильтров, которые aiogram проверяет по очереди для
+каждого обновления, Router регистрирует в Dispatcher по одному обработчику
+на сообщения и на callback-запросы - первыми в цепочке. Текст кнопки меню
+ищется в словаре. callback_data в формате callbacks разбирается один раз и
+маршрутизируется по действию, прочие строки - по таблице префиксов (самый
+длинный префикс по границам "_"). Если маршрута нет или состояние FSM не
+подходит, обновление уходит дальше по обычной цепочке aiogram.
+
+Обработчик получает аргументы только тех имен, что есть в его сигнатуре:
+state (FSMContext) и args (разобранные аргументы callback_data).
+"""
+import inspect
+
+from aiogram.dispatcher.filters.builtin import StateFilter
+from aiogram.dispatcher.filters.state import State, StatesGroup
+from aiogram.types import CallbackQuery
+
+import callbacks
+from callbacks import Action, CallbackDataError
+
+
+class Route:
+    __slots__ = ('handler', 'states', 'pass_state', 'pass_args')
+
+    def __init__(self, handler, state=None):
+        self.handler = handler
+        # None в states - «нет состояния», как у фильтров aiogram по умолчанию;
+        # states = None - любое состояние (state='*')
+        self.states = self._normalize(state)
+        parameters = inspect.signature(handler).parameters
+        self.pass_state = 'state' in parameters
+        self.pass_args = 'args' in parameters
+
+    @staticmethod
+    def _normalize(state):
+        if state == '*':
+            return None
+        if not isinstance(state, (list, set, tuple, frozenset)):
+            state = [state]
+        states = set()
+        for item in state:
+            if isinstance(item, State):
+                states.add(item.state)
+            elif inspect.isclass(item) and issubclass(item, StatesGroup):
+                states.update(item.all_states_names)
+            else:
+                states.add(item)
+        return frozenset(states)
+
+
+class Router:
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+        self.texts = {}
+        self.actions = {}
+        self.callbacks = {}
+
+        dispatcher.register_message_handler(self._on_update, self._match_message, state='*')
+        dispatcher.register_callback_query_handler(self._on_update, self._match_callback, state='*')
+
+    # ===== РЕГИСТРАЦИЯ =====
+    def text(self, *texts, state=None):
+        """Декоратор: обработчик кнопок меню с указанным текстом"""
+        def decorator(handler):
+            route = Route(handler, state)
+            for text in texts:
+                self._add(self.texts, text, route)
+            return handler
+        return decorator
+
+    def callback(self, *keys, state=None):
+        """Декоратор: обработчик действий callbacks.Action или строковых
+        префиксов callback_data ("<префикс>" или "<префикс>_...")"""
+        def decorator(handler):
+            route = Route(handler, state)
+            for key in keys:
+                if isinstance(key, Action):
+                    self._add(self.actions, key, route)
+                else:
+                    self._add(self.callbacks, key.rstrip('_'), route)
+            return handler
+        return decorator
+
+    @staticmethod
+    def _add(table, key, route):
+        if key in table:
+            raise ValueError(f"Маршрут {key!r} уже зарегистрирован")
+        table[key] = route
+
+    # ===== ПОИСК =====
+    def resolve_callback(self, data):
+        """Маршрут для callback_data: самый длинный зарегистрированный префикс"""
+        callbacks = self.callbacks
+        key = data
+        while key:
+            route = callbacks.get(key)
+            if route is not None:
+                return route
+            key = key.rpartition('_')[0]
+        return None
+
+    async def _match_message(self, message):
+        route = self.texts.get(message.text)
+        if route is None or not await self._state_allowed(route, message):
+            return False
+        return {'route': route}
+
+    async def _match_callback(self, callback_query):
+        data = callback_query.data or ''
+        try:
+            action, args = callbacks.unpack(data)
+        except CallbackDataError:
+            route, args = self.resolve_callback(data), ()
+        else:
+            route = self.actions.get(action)
+
+        if route is None or not await self._state_allowed(route, callback_query):
+            return False
+        return {'route': route, 'args': args}
+
+    async def _state_allowed(self, route, obj):
+        if route.states is None:
+            return True
+        # Тот же кеш состояния на обновление, что у StateFilter aiogram
+        try:
+            state = StateFilter.ctx_state.get()
+        except LookupError:
+            message = obj.message if isinstance(obj, CallbackQuery) else obj
+            chat = message.chat.id if message is not None else None
+            user = obj.from_user.id if obj.from_user is not None else None
+            state = await self.dispatcher.storage.get_state(chat=chat, user=user)
+            StateFilter.ctx_state.set(state)
+        return state in route.states
+
+    async def _on_update(self, obj, route, state, args=()):
+        kwargs = {}
+        if route.pass_state:
+            kwargs['state'] = state
+        if route.pass_args:
+            kwargs['args'] = args
+        return await route.handler(obj, **kwargs)
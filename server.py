@@ -1,15 +1,92 @@
 import asyncio
+import csv
+import functools
+import hmac
+import io
+import json
 import logging
-import threading
+import time
+from datetime import datetime, timezone
 from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+
+import config
+import metrics
+import sqltrace
+from database import EXPORT_TABLES
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Простой HTTP сервер для health check
+# ===== ПРОВЕРКИ ЗДОРОВЬЯ =====
+def check_loop():
+    """Event loop: задача замера задержки жива, задержка в пределах HEALTH_MAX_LOOP_LAG"""
+    monitor = metrics.loop_monitor
+    lag = monitor.current_lag()
+    return {
+        'ok': monitor.running and lag <= config.HEALTH_MAX_LOOP_LAG,
+        'monitor_running': monitor.running,
+        'lag_seconds': round(lag, 4),
+    }
+
+def check_bot(app):
+    """Воркеры обработки живы; в polling - getUpdates недавно отвечал"""
+    dp = app.get('dp')
+    if dp is None:
+        return None
+    
+    now = time.time()
+    dead = dp.shards.dead_workers()
+    result = {'ok': not dead, 'mode': 'polling' if app['polling'] else 'webhook', 'dead_workers': dead}
+    if app['polling']:
+        # До первого ответа getUpdates отсчет идет от запуска сервера
+        last_poll = metrics.API_LAST_SUCCESS.value('getUpdates') or app['started_at']
+        result['last_poll_seconds_ago'] = round(now - last_poll, 1)
+        result['ok'] = result['ok'] and now - last_poll <= config.HEALTH_POLLING_STALE
+    
+    last_update = metrics.LAST_UPDATE.value()
+    result['last_update_seconds_ago'] = round(now - last_update, 1) if last_update is not None else None
+    return result
+
+async def check_db(app):
+    """Запрос к базе через пул потоков и соединений, не дольше HEALTH_DB_TIMEOUT"""
+    db = app.get('db')
+    if db is None:
+        return None
+    
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(db.ping(), config.HEALTH_DB_TIMEOUT)
+    except asyncio.TimeoutError:
+        return {'ok': False, 'error': f"нет ответа за {config.HEALTH_DB_TIMEOUT} с"}
+    except Exception as e:
+        return {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+    return {'ok': True, 'seconds': round(time.perf_counter() - started, 4)}
+
+def health_response(checks):
+    checks = {name: result for name, result in checks.items() if result is not None}
+    healthy = all(result['ok'] for result in checks.values())
+    return web.json_response(
+        {'status': 'ok' if healthy else 'fail', 'checks': checks},
+        status=200 if healthy else 503
+    )
+
 async def health_handler(request):
-    return web.Response(text="SofiaCash Bot is running")
+    """Живость процесса: event loop и обработка обновлений"""
+    return health_response({'loop': check_loop(), 'bot': check_bot(request.app)})
+
+async def ready_handler(request):
+    """Готовность принимать трафик: то же, что /health, плюс база и свежесть обновлений"""
+    bot_check = check_bot(request.app)
+    if bot_check is not None and config.HEALTH_MAX_UPDATE_AGE > 0:
+        age = bot_check['last_update_seconds_ago']
+        if age is not None and age > config.HEALTH_MAX_UPDATE_AGE:
+            bot_check['ok'] = False
+    return health_response({'loop': check_loop(), 'bot': bot_check, 'db': await check_db(request.app)})
+
+async def metrics_handler(request):
+    return web.Response(body=metrics.render().encode('utf-8'), headers={'Content-Type': metrics.CONTENT_TYPE})
 
 async def index_handler(request):
     html = """
@@ -33,49 +110,223 @@ async def index_handler(request):
     """
     return web.Response(text=html, content_type='text/html')
 
-async def start_http_server():
-    """Запуск HTTP сервера"""
+# ===== СЛУЖЕБНЫЕ ЭНДПОИНТЫ =====
+def check_admin_token(request):
+    """Authorization: Bearer <ADMIN_HTTP_TOKEN>; без токена в настройках эндпоинт не существует"""
+    token = config.ADMIN_HTTP_TOKEN
+    if not token or 'db' not in request.app:
+        raise web.HTTPNotFound()
+    header = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(header.encode('utf-8'), f'Bearer {token}'.encode('utf-8')):
+        raise web.HTTPUnauthorized()
+
+async def sql_stats_handler(request):
+    """Статистика трассировки SQL: ?top=N&order=total|mean|p99|count|rows&reset=1"""
+    check_admin_token(request)
+    
+    tracer = request.app['db'].tracer
+    if tracer is None:
+        return web.json_response({'error': 'трассировка SQL выключена (DB_TRACE=1)'}, status=404)
+    
+    try:
+        limit = min(int(request.query.get('top', '20')), 200)
+    except ValueError:
+        raise web.HTTPBadRequest(text='top должен быть числом')
+    order = request.query.get('order', 'total')
+    if order not in sqltrace.ORDERS:
+        raise web.HTTPBadRequest(text=f"order: одно из {', '.join(sqltrace.ORDERS)}")
+    
+    report = tracer.report(limit, order)
+    if request.query.get('reset') == '1':
+        tracer.reset()
+    return web.json_response(report, dumps=functools.partial(json.dumps, ensure_ascii=False))
+
+# ===== ВЫГРУЗКА =====
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+def parse_export_date(value, name):
+    """Дата из запроса ISO 8601 -> 'YYYY-MM-DD HH:MM:SS' UTC, как в created_at"""
+    if value is None:
+        return None
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise web.HTTPBadRequest(text=f"{name}: дата YYYY-MM-DD или YYYY-MM-DDTHH:MM:SS")
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+def encode_export(rows, columns, fmt, header=False):
+    if fmt == 'jsonl':
+        text = ''.join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n' for row in rows)
+    else:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if header:
+            writer.writerow(columns)
+        writer.writerows(rows)
+        text = buffer.getvalue()
+    return text.encode('utf-8')
+
+async def export_handler(request):
+    """Потоковая выгрузка: /admin/export/{transactions|withdrawals|users}?format=csv|jsonl&status=&from=&to=
+    
+    Строки читаются из базы пачками по EXPORT_BATCH и сразу пишутся в ответ
+    с chunked-кодированием: память не растет с размером таблицы, а медленный
+    клиент притормаживает чтение через буфер отправки.
+    """
+    check_admin_token(request)
+    
+    table = request.match_info['table']
+    fmt = request.query.get('format', 'csv')
+    if table not in EXPORT_TABLES:
+        raise web.HTTPNotFound(text=f"таблица: одна из {', '.join(EXPORT_TABLES)}")
+    if fmt not in EXPORT_FORMATS:
+        raise web.HTTPBadRequest(text=f"format: одно из {', '.join(EXPORT_FORMATS)}")
+    filters = {
+        'status': request.query.get('status'),
+        'date_from': parse_export_date(request.query.get('from'), 'from'),
+        'date_to': parse_export_date(request.query.get('to'), 'to'),
+    }
+    columns = EXPORT_TABLES[table][0]
+    
+    started = time.perf_counter()
+    batches = request.app['db'].export(table, **filters)
+    response = None
+    total = 0
+    try:
+        # Ошибки параметров всплывают на первой пачке, до начала ответа
+        try:
+            rows = await batches.__anext__()
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+        except StopAsyncIteration:
+            rows = []
+        
+        response = web.StreamResponse(headers={
+            'Content-Disposition': f'attachment; filename="{table}.{fmt}"',
+        })
+        response.content_type = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+        response.charset = 'utf-8'
+        response.enable_chunked_encoding()
+        await response.prepare(request)
+        
+        await response.write(encode_export(rows, columns, fmt, header=True))
+        total = len(rows)
+        async for rows in batches:
+            await response.write(encode_export(rows, columns, fmt))
+            total += len(rows)
+    except ConnectionResetError:
+        logger.info(f"Выгрузка {table} прервана клиентом после {total} строк")
+        if response is None:
+            raise
+        return response
+    finally:
+        await batches.aclose()
+    
+    await response.write_eof()
+    logger.info(f"Выгрузка {table} ({fmt}, {filters}): {total} строк за {time.perf_counter() - started:.1f} с")
+    return response
+
+# ===== WEBHOOK =====
+async def webhook_handler(request):
+    secret = request.app['webhook_secret']
+    if secret:
+        # Сравнение за постоянное время, как у check_admin_token
+        header = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+        if not hmac.compare_digest(header.encode('utf-8'), secret.encode('utf-8')):
+            return web.Response(status=403)
+    
+    try:
+        update = types.Update(**(await request.json()))
+    except (ValueError, TypeError):
+        return web.Response(status=400)
+    
+    # Очередь воркера ограничена: при перегрузке ответ задерживается,
+    # и Telegram сам снижает темп доставки
+    await request.app['dp'].shards.submit(update)
+    return web.Response()
+
+def create_app(dp=None, webhook_secret=None, db=None, webhook=True):
+    """HTTP приложение; при переданном dp принимает обновления по webhook
+    (webhook=False - режим polling, dp нужен только проверкам здоровья),
+    с db (AsyncDatabase) - отдает служебные эндпоинты и выгрузку (доступ по ADMIN_HTTP_TOKEN)"""
     app = web.Application()
+    app['started_at'] = time.time()
+    app['polling'] = dp is not None and not webhook
     app.router.add_get('/', index_handler)
     app.router.add_get('/health', health_handler)
+    app.router.add_get('/ready', ready_handler)
+    app.router.add_get(config.METRICS_PATH, metrics_handler)
+    
+    if db is not None:
+        app['db'] = db
+        app.router.add_get('/debug/sql', sql_stats_handler)
+        app.router.add_get('/admin/export/{table}', export_handler)
     
+    if dp is not None:
+        app['dp'] = dp
+    if dp is not None and webhook:
+        app['webhook_secret'] = webhook_secret
+        app.router.add_post(config.WEBHOOK_PATH, webhook_handler)
+    
+    return app
+
+async def start_http_server(app, port=None):
+    """Запуск HTTP сервера"""
     runner = web.AppRunner(app)
     await runner.setup()
     
     # Используем порт из переменной окружения или 10000
-    port = 10000
+    port = port or config.PORT
     
     site = web.TCPSite(runner, '0.0.0.0', port)
     await site.start()
     
     logger.info(f"HTTP сервер запущен на порту {port}")
     logger.info(f"Health check: http://0.0.0.0:{port}/health")
-    
-    # Бесконечный цикл
-    await asyncio.Future()
+    return runner
 
-def run_bot():
-    """Запуск бота в отдельном потоке"""
+async def run_bot():
+    """Запуск бота и HTTP сервера в одном event loop"""
     import bot
-    from aiogram import executor
-    
-    # Запускаем polling
-    executor.start_polling(
-        bot.dp,
-        skip_updates=True,
-        on_startup=bot.on_startup,
-        on_shutdown=bot.on_shutdown
-    )
+    
+    Bot.set_current(bot.bot)
+    Dispatcher.set_current(bot.dp)
+    
+    use_webhook = config.BOT_MODE == 'webhook'
+    app = create_app(bot.dp, config.WEBHOOK_SECRET, bot.db, webhook=use_webhook)
+    runner = await start_http_server(app)
+    
+    try:
+        await bot.on_startup(bot.dp)
+        
+        if use_webhook:
+            await bot.bot.set_webhook(
+                config.WEBHOOK_URL,
+                max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+                drop_pending_updates=True,
+                secret_token=config.WEBHOOK_SECRET
+            )
+            logger.info(f"Режим webhook: {config.WEBHOOK_URL}")
+            await asyncio.Future()
+        else:
+            # Резервный режим: long polling в том же event loop
+            await bot.dp.reset_webhook(True)
+            await bot.dp.skip_updates()
+            logger.info("Режим polling")
+            await bot.dp.start_polling()
+    finally:
+        bot.dp.stop_polling()
+        await runner.cleanup()
+        await bot.on_shutdown(bot.dp)
 
 def main():
     """Основная функция запуска"""
-    # Запускаем бота в отдельном потоке
-    bot_thread = threading.Thread(target=run_bot, daemon=True)
-    bot_thread.start()
-    logger.info("Бот запущен в отдельном потоке")
-    
-    # Запускаем HTTP сервер в основном потоке
-    asyncio.run(start_http_server())
+    try:
+        asyncio.run(run_bot())
+    except (KeyboardInterrupt, SystemExit):
+        logger.info("Остановка по сигналу")
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,314 @@
+"""Трассировка запросов SQLite: статистика по выражениям и журнал медленных.
+
+Включается настройкой DB_TRACE. Тогда ConnectionPool открывает соединения
+TracedConnection, курсоры которых замеряют время execute и fetch*, число
+строк и шагов виртуальной машины SQLite (progress handler), а trace callback
+считает запуски триггеров и выражений в их телах. Замеры копятся в потоке, пока
+он держит соединение, и переносятся в общую статистику при возврате
+соединения в пул - одна блокировка на вызов метода Database.
+
+Для каждого выражения хранятся количество, суммарное время, строки, шаги и
+последние DB_TRACE_SAMPLES длительностей для p50/p99. Выражение дольше
+DB_SLOW_QUERY_MS попадает в журнал медленных вместе с EXPLAIN QUERY PLAN.
+Без DB_TRACE используются обычные соединения и накладных расходов нет.
+"""
+import functools
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Период progress handler в инструкциях VM: шаги считаются с этой точностью
+PROGRESS_PERIOD = 100
+
+# Сортировки отчета top(): поле as_dict()
+ORDERS = {'total': 'total_ms', 'mean': 'mean_ms', 'p99': 'p99_ms', 'count': 'count', 'rows': 'rows'}
+
+# Предел кеша нормализованного текста запросов
+_KEY_CACHE_SIZE = 2048
+
+
+class StatementStats:
+    __slots__ = ('sql', 'count', 'total', 'rows', 'steps', 'triggers', 'slow', 'samples', 'methods', 'plan')
+
+    def __init__(self, sql, samples):
+        self.sql = sql
+        self.count = 0
+        self.total = 0.0
+        self.rows = 0
+        self.steps = 0
+        self.triggers = 0
+        self.slow = 0
+        self.samples = deque(maxlen=samples)
+        self.methods = set()
+        self.plan = None
+
+    def percentile(self, fraction):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def as_dict(self):
+        return {
+            'sql': self.sql,
+            'count': self.count,
+            'total_ms': self.total * 1e3,
+            'mean_ms': self.total / self.count * 1e3 if self.count else 0.0,
+            'p50_ms': self.percentile(0.50) * 1e3,
+            'p99_ms': self.percentile(0.99) * 1e3,
+            'rows': self.rows,
+            'steps': self.steps * PROGRESS_PERIOD,
+            'triggers': self.triggers,
+            'slow': self.slow,
+            'methods': sorted(self.methods),
+        }
+
+
+class TracedCursor(sqlite3.Cursor):
+    """Курсор, который отдает замеры своего последнего выражения трассировщику"""
+
+    def _measure(self, statements, call, *args):
+        """statements - сколько выражений запускает вызов сам, без триггеров"""
+        conn = self.connection
+        steps, events = conn.trace_steps, conn.trace_events
+        started = time.perf_counter()
+        try:
+            return call(*args)
+        finally:
+            entry = self._trace_entry
+            entry[3] += time.perf_counter() - started
+            entry[5] += conn.trace_steps - steps
+            entry[6] += max(0, conn.trace_events - events - statements)
+
+    def execute(self, sql, parameters=()):
+        self._trace_entry = self.connection.tracer.begin(sql, parameters)
+        result = self._measure(1, super().execute, sql, parameters)
+        # Для изменяющих выражений строки - затронутые
+        if self.description is None and self.rowcount > 0:
+            self._trace_entry[4] += self.rowcount
+        return result
+
+    def executemany(self, sql, seq_of_parameters):
+        seq_of_parameters = list(seq_of_parameters)
+        first = seq_of_parameters[0] if seq_of_parameters else ()
+        self._trace_entry = self.connection.tracer.begin(sql, first)
+        result = self._measure(len(seq_of_parameters), super().executemany, sql, seq_of_parameters)
+        self._trace_entry[4] += max(self.rowcount, 0)
+        return result
+
+    def fetchone(self):
+        row = self._measure(0, super().fetchone)
+        if row is not None:
+            self._trace_entry[4] += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._measure(0, super().fetchmany, self.arraysize if size is None else size)
+        self._trace_entry[4] += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._measure(0, super().fetchall)
+        self._trace_entry[4] += len(rows)
+        return rows
+
+
+class TracedConnection(sqlite3.Connection):
+    """Соединение с курсорами TracedCursor и хуками trace/progress"""
+
+    tracer = None
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    # Connection.execute в C минует переопределенный Cursor.execute
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def install(self, tracer):
+        self.tracer = tracer
+        self.trace_steps = 0
+        self.trace_events = 0
+        self.set_progress_handler(self._on_progress, PROGRESS_PERIOD)
+        self.set_trace_callback(self._on_trace)
+
+    def _on_progress(self):
+        self.trace_steps += 1
+        return 0
+
+    def _on_trace(self, statement):
+        # Вызывается на старте каждого выражения, а также триггера и каждого
+        # выражения в его теле. Неявный BEGIN модуля sqlite3 не считается
+        if statement != 'BEGIN ':
+            self.trace_events += 1
+
+
+class QueryTracer:
+    """Общая статистика выражений и методов Database"""
+
+    def __init__(self, slow_ms=None, samples=None, slow_log_size=None):
+        self.slow_threshold = (config.DB_SLOW_QUERY_MS if slow_ms is None else slow_ms) / 1e3
+        self.samples = samples or config.DB_TRACE_SAMPLES
+        self.statements = {}
+        self.methods = {}
+        self.slow_log = deque(maxlen=slow_log_size or config.DB_SLOW_LOG_SIZE)
+        self._keys = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    # ===== СБОР =====
+    def _key(self, sql):
+        key = self._keys.get(sql)
+        if key is None:
+            key = ' '.join(sql.split())
+            if len(self._keys) < _KEY_CACHE_SIZE:
+                self._keys[sql] = key
+        return key
+
+    def _pending(self):
+        pending = getattr(self._local, 'pending', None)
+        if pending is None:
+            pending = self._local.pending = []
+        return pending
+
+    def begin(self, sql, parameters):
+        """Новый замер: [ключ, sql, параметры, время, строки, шаги, триггеры, метод]"""
+        entry = [self._key(sql), sql, parameters, 0.0, 0, 0, 0, getattr(self._local, 'method', None)]
+        self._pending().append(entry)
+        return entry
+
+    def flush(self, conn):
+        """Перенести замеры потока в статистику; вызывается при возврате соединения"""
+        pending = getattr(self._local, 'pending', None)
+        if not pending:
+            return
+        self._local.pending = []
+
+        slow = []
+        with self._lock:
+            for entry in pending:
+                key, sql, parameters, elapsed, rows, steps, triggers, method = entry
+                stats = self.statements.get(key)
+                if stats is None:
+                    stats = self.statements[key] = StatementStats(key, self.samples)
+                stats.count += 1
+                stats.total += elapsed
+                stats.rows += rows
+                stats.steps += steps
+                stats.triggers += triggers
+                stats.samples.append(elapsed)
+                if method is not None:
+                    stats.methods.add(method)
+                if elapsed >= self.slow_threshold:
+                    stats.slow += 1
+                    slow.append((stats, entry))
+
+        for stats, entry in slow:
+            self._log_slow(conn, stats, entry)
+
+    def _log_slow(self, conn, stats, entry):
+        key, sql, parameters, elapsed, rows, steps, triggers, method = entry
+        # План одного выражения почти не меняется - EXPLAIN только при первом попадании
+        if stats.plan is None:
+            stats.plan = explain(conn, sql, parameters)
+        record = {
+            'at': time.time(),
+            'sql': key,
+            'ms': elapsed * 1e3,
+            'rows': rows,
+            'method': method,
+            'plan': stats.plan,
+        }
+        self.slow_log.append(record)
+        logger.warning(
+            f"Медленный запрос {elapsed * 1e3:.1f} мс ({method or '?'}, строк {rows}): {key}\n"
+            + '\n'.join(f"    {line}" for line in stats.plan)
+        )
+
+    def wrap_method(self, name, method):
+        """Обертка метода Database: время метода и метка для его выражений"""
+        @functools.wraps(method)
+        def call(*args, **kwargs):
+            local = self._local
+            outer = getattr(local, 'method', None)
+            local.method = name
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                local.method = outer
+                with self._lock:
+                    stats = self.methods.get(name)
+                    if stats is None:
+                        stats = self.methods[name] = StatementStats(name, self.samples)
+                    stats.count += 1
+                    stats.total += elapsed
+                    stats.samples.append(elapsed)
+        return call
+
+    # ===== ОТЧЕТЫ =====
+    def top(self, limit=10, order='total'):
+        """Самые тяжелые выражения по total, mean, p99, count или rows"""
+        with self._lock:
+            items = [stats.as_dict() for stats in self.statements.values()]
+        key = ORDERS[order]
+        items.sort(key=lambda item: item[key], reverse=True)
+        return items[:limit]
+
+    def top_methods(self, limit=10):
+        with self._lock:
+            items = [stats.as_dict() for stats in self.methods.values()]
+        items.sort(key=lambda item: item['total_ms'], reverse=True)
+        fields = ('count', 'total_ms', 'mean_ms', 'p50_ms', 'p99_ms')
+        return [dict(method=item['sql'], **{field: item[field] for field in fields}) for item in items[:limit]]
+
+    def report(self, limit=10, order='total'):
+        """Состояние для JSON: выражения, методы и последние медленные запросы"""
+        return {
+            'statements': self.top(limit, order),
+            'methods': self.top_methods(limit),
+            'slow': list(self.slow_log)[-limit:],
+        }
+
+    def format_top(self, limit=10, order='total', width=120):
+        """Текстовая таблица для админской команды"""
+        lines = []
+        for index, item in enumerate(self.top(limit, order), 1):
+            sql = item['sql'] if len(item['sql']) <= width else item['sql'][:width - 1] + '…'
+            lines.append(
+                f"{index}. {item['count']}× {item['total_ms']:.1f} мс "
+                f"(p50 {item['p50_ms']:.2f} / p99 {item['p99_ms']:.2f} мс, строк {item['rows']})\n{sql}"
+            )
+        return '\n\n'.join(lines)
+
+    def reset(self):
+        with self._lock:
+            self.statements.clear()
+            self.methods.clear()
+            self.slow_log.clear()
+
+
+def explain(conn, sql, parameters=()):
+    """EXPLAIN QUERY PLAN выражения строками дерева; для служебных команд - пусто"""
+    try:
+        # Обычный курсор, чтобы EXPLAIN не попал в статистику
+        rows = sqlite3.Cursor(conn).execute(f'EXPLAIN QUERY PLAN {sql}', parameters).fetchall()
+    except (sqlite3.Error, ValueError):
+        return []
+
+    depth = {0: 0}
+    lines = []
+    for node, parent, _, detail in rows:
+        depth[node] = depth.get(parent, 0) + 1
+        lines.append('  ' * (depth[node] - 1) + detail)
+    return lines
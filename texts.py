@@ -0,0 +1,81 @@
+"""Тексты сообщений, зависящие только от настроек.
+
+Собираются один раз (см. assets) вместо форматирования на каждое
+сообщение; пользовательские части дописываются в обработчиках.
+"""
+import config
+from assets import static
+from utils import format_balance
+
+
+@static('BOT_NAME', 'BOT_DESCRIPTION')
+def WELCOME():
+    return (
+        f"🎉 Добро пожаловать в *{config.BOT_NAME}*!\n\n"
+        f"{config.BOT_DESCRIPTION}\n\n"
+        f"💎 *Наши преимущества:*\n"
+        f"• Мгновенные переводы\n"
+        f"• Низкие комиссии\n"
+        f"• Круглосуточная поддержка\n"
+        f"• Множество способов оплаты\n\n"
+        f"📊 *Быстрый старт:*\n"
+        f"1. Пополните баланс\n"
+        f"2. Выводите средства\n"
+        f"3. Приглашайте друзей\n\n"
+    )
+
+
+@static('SUPPORT_USERNAME', 'CHANNEL_USERNAME', 'WEBSITE_URL', 'MIN_WITHDRAW', 'WITHDRAW_FEE')
+def SUPPORT():
+    return (
+        f"🆘 *Служба поддержки*\n\n"
+        f"📞 Техподдержка: {config.SUPPORT_USERNAME}\n"
+        f"📢 Новости: {config.CHANNEL_USERNAME}\n"
+        f"🌐 Сайт: {config.WEBSITE_URL}\n\n"
+        f"⏰ *Режим работы:*\n"
+        f"• Поддержка: 24/7\n"
+        f"• Выводы: 10:00-22:00 МСК\n\n"
+        f"📋 *Правила:*\n"
+        f"1. Минимальный вывод: {format_balance(config.MIN_WITHDRAW)}\n"
+        f"2. Комиссия на вывод: {config.WITHDRAW_FEE}%\n"
+        f"3. Верификация не требуется"
+    )
+
+
+@static('WITHDRAW_FEE', 'MIN_WITHDRAW', 'MAX_WITHDRAW')
+def RATES():
+    return (
+        f"📈 *Курсы обмена*\n\n"
+        f"💵 *Пополнение:*\n"
+        f"• Т-Банк: 1₽ = 1₽\n"
+        f"• СБП: 1₽ = 1₽\n"
+        f"• Банк. карта: 1₽ = 1₽\n"
+        f"• USDT: 1$ = ~95₽\n\n"
+        f"💸 *Вывод:*\n"
+        f"• Комиссия: {config.WITHDRAW_FEE}%\n"
+        f"• Минимум: {format_balance(config.MIN_WITHDRAW)}\n"
+        f"• Максимум: {format_balance(config.MAX_WITHDRAW)}\n\n"
+        f"⚡ *Сроки:*\n"
+        f"• Пополнение: мгновенно\n"
+        f"• Вывод: 5-60 минут"
+    )
+
+
+@static('MIN_DEPOSIT', 'MAX_DEPOSIT')
+def DEPOSIT_METHODS():
+    return (
+        f"💳 *Выберите способ пополнения:*\n\n"
+        f"Минимальная сумма: {format_balance(config.MIN_DEPOSIT)}\n"
+        f"Максимальная сумма: {format_balance(config.MAX_DEPOSIT)}"
+    )
+
+
+@static()
+def REFERRAL_HOWTO():
+    return (
+        f"📋 *Как работает:*\n"
+        f"1. Друг переходит по вашей ссылке\n"
+        f"2. Пополняет баланс\n"
+        f"3. Вы получаете 5% от его пополнения\n\n"
+        f"💡 *Совет:* Размещайте ссылку в соцсетях!"
+    )
@@ -60,6 +60,24 @@ def format_transaction(trans):
         f"🆔 ID: {trans_id}"
     )
 
+def format_user_info(user):
+    """Карточка пользователя для админа"""
+    return (
+        f"👤 *Информация о пользователе*\n\n"
+        f"🆔 ID: `{user[0]}`\n"
+        f"👁‍🗨 Username: @{user[1] or 'нет'}\n"
+        f"👤 Имя: {user[2] or 'нет'} {user[3] or ''}\n"
+        f"💰 Баланс: {format_balance(user[4])}\n"
+        f"📥 Пополнено: {format_balance(user[5])}\n"
+        f"📤 Выведено: {format_balance(user[6])}\n"
+        f"👥 Рефералов: {user[9]}\n"
+        f"🚫 Заблокирован: {'Да' if user[10] else 'Нет'}\n"
+        f"👑 Админ: {'Да' if user[11] else 'Нет'}\n"
+        f"📅 Регистрация: {format_date(user[12])}\n"
+        f"🔥 Последняя активность: {format_date(user[13])}\n\n"
+        f"🔗 Реферальный код: `{user[7]}`"
+    )
+
 def calculate_withdraw_fee(amount):
     """Расчет комиссии на вывод"""
     fee = amount * (config.WITHDRAW_FEE / 100)